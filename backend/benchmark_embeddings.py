@@ -0,0 +1,117 @@
+"""
+比較 embedding 後端（PyTorch HuggingFaceEmbeddings vs. ONNX int8）的效能與一致性
+
+固定語料：parsed_with_paddleocr.json（群益年報前 30 頁），以與 VectorStoreHandler 相同的
+splitter (chunk_size=512, chunk_overlap=128) 切割
+
+用法：
+    python benchmark_embeddings.py --export          # 先匯出並量化 ONNX 模型
+    python benchmark_embeddings.py                   # 執行比較
+"""
+import argparse
+import json
+import statistics
+import time
+
+import numpy as np
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_huggingface import HuggingFaceEmbeddings
+
+from common.modules.processor.onnx_embeddings import (DEFAULT_ONNX_MODEL_DIR,
+                                                      OnnxEmbeddings,
+                                                      export_onnx_model)
+
+QUERIES = [
+    "群益證券的發言人是誰？",
+    "公司的總公司地址與電話",
+    "112年度的營業收入與稅後淨利",
+    "實收資本額減少到多少？",
+    "董事會成員與獨立董事",
+    "經紀業務市占率",
+    "股利分派政策",
+    "風險管理的組織架構",
+]
+
+
+def load_corpus(path):
+    with open(path, encoding="utf-8") as f:
+        pages = json.load(f)
+    splitter = RecursiveCharacterTextSplitter(chunk_size=512, chunk_overlap=128)
+    chunks = []
+    for page in pages:
+        if page["content"].strip():
+            chunks.extend(splitter.split_text(page["content"]))
+    return chunks
+
+
+def run_backend(name, embedder, chunks, batch_size, repeats):
+    # 先跑一次暖機，避免把模型初始化算進去
+    embedder.embed_documents(chunks[:batch_size])
+    embedder.embed_query(QUERIES[0])
+
+    start = time.perf_counter()
+    doc_vectors = []
+    for i in range(0, len(chunks), batch_size):
+        doc_vectors.extend(embedder.embed_documents(chunks[i:i + batch_size]))
+    doc_time = time.perf_counter() - start
+
+    latencies = []
+    for _ in range(repeats):
+        for q in QUERIES:
+            t = time.perf_counter()
+            embedder.embed_query(q)
+            latencies.append((time.perf_counter() - t) * 1000)
+    query_vectors = [embedder.embed_query(q) for q in QUERIES]
+
+    latencies.sort()
+    print(f"\n[{name}]")
+    print(f"  文件：{len(chunks)} 段，{doc_time:.2f}s，{len(chunks) / doc_time:.1f} docs/s")
+    print(f"  查詢延遲：p50 {statistics.median(latencies):.1f} ms，"
+          f"p95 {latencies[int(len(latencies) * 0.95) - 1]:.1f} ms")
+    return np.asarray(doc_vectors, dtype=np.float32), np.asarray(query_vectors, dtype=np.float32)
+
+
+def normalize(m):
+    return m / np.clip(np.linalg.norm(m, axis=1, keepdims=True), 1e-12, None)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", default="parsed_with_paddleocr.json")
+    parser.add_argument("--model", default="BAAI/bge-m3")
+    parser.add_argument("--onnx-dir", default=DEFAULT_ONNX_MODEL_DIR)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--export", action="store_true", help="匯出並量化 ONNX 模型後結束")
+    args = parser.parse_args()
+
+    if args.export:
+        export_onnx_model(args.model, args.onnx_dir)
+        return
+
+    chunks = load_corpus(args.corpus)
+    hf = HuggingFaceEmbeddings(model_name=args.model, model_kwargs={"device": "cpu"},
+                               encode_kwargs={"normalize_embeddings": True})
+    onnx = OnnxEmbeddings(model_dir=args.onnx_dir, batch_size=args.batch_size)
+
+    hf_docs, hf_queries = run_backend("hf (PyTorch fp32)", hf, chunks, args.batch_size, args.repeats)
+    onnx_docs, onnx_queries = run_backend("onnx (int8)", onnx, chunks, args.batch_size, args.repeats)
+
+    hf_docs, onnx_docs = normalize(hf_docs), normalize(onnx_docs)
+    hf_queries, onnx_queries = normalize(hf_queries), normalize(onnx_queries)
+    agreement = np.sum(hf_docs * onnx_docs, axis=1)
+    print("\n[一致性]")
+    print(f"  文件向量 cosine：平均 {agreement.mean():.4f}，最小 {agreement.min():.4f}")
+
+    # 以兩個後端各自檢索 top-k，比較重疊比例
+    overlaps = []
+    for hq, oq in zip(hf_queries, onnx_queries):
+        hf_top = set(np.argsort(-(hf_docs @ hq))[:args.top_k])
+        onnx_top = set(np.argsort(-(onnx_docs @ oq))[:args.top_k])
+        overlaps.append(len(hf_top & onnx_top) / args.top_k)
+    print(f"  top-{args.top_k} 檢索重疊：平均 {np.mean(overlaps):.2%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+比較 PdfProcessor 摘要階段逐一呼叫 ollama.chat（原本的做法）與 SummaryQueue 併發送出的耗時
+
+以本機的 stub Ollama 伺服器代替 gemma3:27b：每個請求固定延遲 --latency 秒，
+同時最多處理 --server-parallel 個請求（對應 Ollama 的 OLLAMA_NUM_PARALLEL），
+並以 --ocr-ms 模擬每個摘要工作前的 OCR / 表格偵測 CPU 時間
+
+工作來源：
+- --pdf：以 PyMuPDF 將每頁轉成圖片，每頁一個摘要工作（例如群益年報）
+- 未指定時使用 page3_test.png 重複 --jobs 次
+
+用法：
+    python benchmark_pdf_summaries.py
+    python benchmark_pdf_summaries.py --pdf report.pdf --latency 2 --server-parallel 4 --concurrency 1 2 4 8
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import ollama
+
+from common.modules.processor.summary_queue import SummaryQueue
+
+SYSTEM_PROMPT = "你是一位針對圖片影像和表格影像進行提取內容的助手"
+
+
+class StubOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with self.server.slots:  # 模擬模型伺服器的平行推論上限
+            time.sleep(self.server.latency)
+        prompt = request["messages"][-1]["content"]
+        body = json.dumps({
+            "model": request["model"],
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "message": {"role": "assistant", "content": f"摘要：{prompt}"},
+            "done": True,
+            "done_reason": "stop",
+        }, ensure_ascii=False).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(latency, parallel):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubOllamaHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.slots = threading.Semaphore(parallel)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def load_jobs(args, workdir):
+    if args.pdf:
+        import fitz  # PyMuPDF
+        paths = []
+        with fitz.open(args.pdf) as doc:
+            for page in doc:
+                path = os.path.join(workdir, f"page_{page.number + 1}.png")
+                page.get_pixmap(dpi=72).save(path)
+                paths.append(path)
+    else:
+        paths = [args.image] * args.jobs
+    return [(path, f"第 {i + 1} 個摘要工作") for i, path in enumerate(paths)]
+
+
+def simulate_ocr(ocr_ms):
+    time.sleep(ocr_ms / 1000)
+
+
+def run_sequential(jobs, host, model, ocr_ms):
+    client = ollama.Client(host=host)
+    summaries = []
+    for path, prompt in jobs:
+        simulate_ocr(ocr_ms)
+        response = client.chat(model=model, messages=[
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt, "images": [path]}
+        ])
+        summaries.append(response["message"]["content"])
+    return summaries
+
+
+def run_queue(jobs, host, model, ocr_ms, concurrency):
+    # 停用摘要快取，否則第二輪起全部命中，量不到併發效果
+    queue = SummaryQueue(model, SYSTEM_PROMPT, concurrency=concurrency, host=host, use_cache=False)
+    for path, prompt in jobs:
+        simulate_ocr(ocr_ms)
+        queue.add(path, prompt)
+    return queue.join()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pdf")
+    parser.add_argument("--image", default="page3_test.png")
+    parser.add_argument("--jobs", type=int, default=40)
+    parser.add_argument("--latency", type=float, default=0.5, help="stub 模型每個請求的秒數")
+    parser.add_argument("--server-parallel", type=int, default=4)
+    parser.add_argument("--ocr-ms", type=float, default=100.0)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--model", default="gemma3:27b")
+    args = parser.parse_args()
+
+    server, host = start_stub_server(args.latency, args.server_parallel)
+    with tempfile.TemporaryDirectory() as workdir:
+        jobs = load_jobs(args, workdir)
+        print(f"{len(jobs)} 個摘要工作，stub 延遲 {args.latency}s、平行 {args.server_parallel}，OCR {args.ocr_ms:.0f}ms/工作\n")
+
+        start = time.perf_counter()
+        expected = run_sequential(jobs, host, args.model, args.ocr_ms)
+        baseline = time.perf_counter() - start
+        print(f"  逐一呼叫       ：{baseline:6.2f}s")
+
+        for concurrency in args.concurrency:
+            start = time.perf_counter()
+            summaries = run_queue(jobs, host, args.model, args.ocr_ms, concurrency)
+            elapsed = time.perf_counter() - start
+            status = "順序一致" if summaries == expected else "⚠️ 順序不一致"
+            print(f"  SummaryQueue x{concurrency:<2}：{elapsed:6.2f}s，加速 {baseline / elapsed:4.1f}x，{status}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
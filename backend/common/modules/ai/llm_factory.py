@@ -1,6 +1,13 @@
+import threading
+import time
 from enum import StrEnum
-from typing import Literal
+from typing import AsyncIterator, Iterator, Literal
 
+from common.modules.monitoring.metrics import (format_sample,
+                                               register_collector,
+                                               stage_metrics)
+
+from .llm_gateway import DEFAULT_CALL_SITE
 from .model.cloud_model import CloudModel
 from .model.i_model import IModel
 from .model.local_model import LocalModel
@@ -11,11 +18,157 @@ class ModelType(StrEnum):
     LOCAL = "local"
     CLOUD = "cloud"
 
+
+def model_label(model_type, model_name):
+    """ metrics 的 model label；雲端固定使用 Llama-3.3-70B-Instruct，model_name 不影響 """
+    return "cloud" if model_type == ModelType.CLOUD else f"local/{model_name}"
+
+
+class TimedModel(IModel):
+    """
+    包裝 LlmFactory 建立的模型，將每次呼叫的耗時記入 stage_metrics（endpoint="model"）
+    - generate / agenerate：stage 為 generate
+    - stream / astream：stage 為 first_token（第一段回答）與 stream（整個串流）
+    同一實例由所有請求共用，in_flight 為目前進行中的呼叫數
+    token 數與各 call_site 的統計由底層模型經 llm_gateway 記錄
+    """
+
+    def __init__(self, model: IModel, label: str):
+        self.model = model
+        self.label = label
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def _enter(self):
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        return time.perf_counter()
+
+    def _exit(self, stage, start):
+        with self._lock:
+            self.in_flight -= 1
+        self._observe(stage, start)
+
+    def _observe(self, stage, start):
+        stage_metrics.observe(time.perf_counter() - start, endpoint="model", stage=stage, model=self.label)
+
+    def generate(self, query: str, temperature=0.8, max_token=2048, top_p=0.1, call_site=DEFAULT_CALL_SITE) -> str:
+        start = self._enter()
+        try:
+            return self.model.generate(query, temperature, max_token, top_p, call_site)
+        finally:
+            self._exit("generate", start)
+
+    async def agenerate(self, query: str, temperature=0.8, max_token=2048, top_p=0.1, call_site=DEFAULT_CALL_SITE) -> str:
+        start = self._enter()
+        try:
+            return await self.model.agenerate(query, temperature, max_token, top_p, call_site)
+        finally:
+            self._exit("generate", start)
+
+    def stream(self, query: str, temperature=0.8, max_token=2048, top_p=0.1, call_site=DEFAULT_CALL_SITE) -> Iterator[str]:
+        start = self._enter()
+        try:
+            tokens = self.model.stream(query, temperature, max_token, top_p, call_site)
+            first = True
+            try:
+                for token in tokens:
+                    if first:
+                        self._observe("first_token", start)
+                        first = False
+                    yield token
+            finally:
+                # 提前關閉（client 斷線）時一併關閉底層串流
+                tokens.close()
+        finally:
+            self._exit("stream", start)
+
+    async def astream(self, query: str, temperature=0.8, max_token=2048, top_p=0.1, call_site=DEFAULT_CALL_SITE) -> AsyncIterator[str]:
+        start = self._enter()
+        try:
+            tokens = self.model.astream(query, temperature, max_token, top_p, call_site)
+            first = True
+            try:
+                async for token in tokens:
+                    if first:
+                        self._observe("first_token", start)
+                        first = False
+                    yield token
+            finally:
+                await tokens.aclose()
+        finally:
+            self._exit("stream", start)
+
+    def stats(self):
+        with self._lock:
+            return {"calls": self.calls, "in_flight": self.in_flight, "max_in_flight": self.max_in_flight}
+
+
 class LlmFactory():
+    """
+    模型以 (model_type, model_name) 為 key 建立一次後共用（ChatOllama / Azure 連線池皆為長期物件），
+    不再每個請求重新建立；取樣參數由各次呼叫傳入，共用實例不保存請求狀態
+    """
+
+    _pool = {}
+    _lock = threading.Lock()
+    hits = 0
+    misses = 0
+
+    @staticmethod
+    def _key(model_type, model_name):
+        # 雲端模型固定為 Llama-3.3-70B-Instruct，不因 model_name 建立多個實例
+        return (ModelType.CLOUD, "") if model_type == ModelType.CLOUD else (model_type, model_name)
+
     def create(self, model_type: Literal["local", "cloud"]="local", model_name: str="llama3.2"):
-        if model_type == ModelType.CLOUD:
-            return CloudModel()
-        elif model_type == ModelType.LOCAL:
-            return LocalModel(model_name)
-        else:
-            raise Exception("error: Invalid model type")
+        key = self._key(model_type, model_name)
+        with LlmFactory._lock:
+            model = LlmFactory._pool.get(key)
+            if model is not None:
+                LlmFactory.hits += 1
+                return model
+            LlmFactory.misses += 1
+            if model_type == ModelType.CLOUD:
+                model = CloudModel()
+            elif model_type == ModelType.LOCAL:
+                model = LocalModel(model_name)
+            else:
+                raise Exception("error: Invalid model type")
+            model = LlmFactory._pool[key] = TimedModel(model, model_label(model_type, model_name))
+            print(f"🧠 建立 LLM 實例：{model.label}")
+            return model
+
+    @classmethod
+    def stats(cls):
+        with cls._lock:
+            total = cls.hits + cls.misses
+            models = list(cls._pool.values())
+            stats = {"hits": cls.hits, "misses": cls.misses, "hit_rate": cls.hits / total if total else 0.0}
+        stats["models"] = {model.label: model.stats() for model in models}
+        return stats
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._pool.clear()
+
+
+@register_collector
+def _pool_metrics():
+    stats = LlmFactory.stats()
+    lines = [
+        "# HELP rag_llm_pool_requests_total LlmFactory.create 的次數（hit 為重用既有實例）",
+        "# TYPE rag_llm_pool_requests_total counter",
+        format_sample("rag_llm_pool_requests_total", stats["hits"], result="hit"),
+        format_sample("rag_llm_pool_requests_total", stats["misses"], result="miss"),
+        "# HELP rag_llm_in_flight 各模型進行中的呼叫數",
+        "# TYPE rag_llm_in_flight gauge",
+    ]
+    lines += [format_sample("rag_llm_in_flight", m["in_flight"], model=label) for label, m in stats["models"].items()]
+    lines += ["# HELP rag_llm_calls_total 各模型的呼叫次數", "# TYPE rag_llm_calls_total counter"]
+    lines += [format_sample("rag_llm_calls_total", m["calls"], model=label) for label, m in stats["models"].items()]
+    return lines
@@ -0,0 +1,121 @@
+import asyncio
+import time
+import weakref
+from contextlib import contextmanager
+
+import ollama
+
+from common.modules.monitoring.metrics import StageMetrics, register_collector
+
+DEFAULT_CALL_SITE = "unknown"
+# 每次呼叫 token 數的 bucket 上限
+TOKEN_BUCKETS = (16, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+# labels：provider（ollama / azure）、model、call_site（呼叫位置），耗時另有 status（ok / error / cancelled）
+llm_call_metrics = StageMetrics("rag_llm_call_duration_seconds", "各模型與呼叫位置的 LLM 呼叫耗時（秒）")
+llm_ttft_metrics = StageMetrics("rag_llm_time_to_first_token_seconds", "各模型與呼叫位置的 LLM 第一個 token 延遲（秒）")
+llm_token_metrics = StageMetrics("rag_llm_tokens", "每次 LLM 呼叫的 token 數（kind 為 prompt / completion）",
+                                 buckets=TOKEN_BUCKETS)
+
+# ollama.AsyncClient 的 httpx 連線綁定建立它的 event loop，每個 loop 共用一個（loop 結束後自動釋放）
+_async_clients = weakref.WeakKeyDictionary()
+
+
+class LlmCall:
+    """
+    單次 LLM 呼叫的紀錄，由 track_llm_call 建立，結束時寫入 metrics
+    - ttft：串流為收到第一段回答的時間；非串流以 Ollama 回報的 load + prompt eval 時間估計，無此資訊時不記錄
+    - token 數由回應的 usage 取得，上游未回報時不記錄
+    """
+
+    def __init__(self, provider, model, call_site):
+        self.labels = {"provider": provider, "model": model, "call_site": call_site}
+        self.start = time.perf_counter()
+        self.ttft = None
+        self.prompt_tokens = None
+        self.completion_tokens = None
+        self.status = "ok"
+
+    def first_token(self):
+        if self.ttft is None:
+            self.ttft = time.perf_counter() - self.start
+
+    def usage(self, prompt_tokens=None, completion_tokens=None):
+        if prompt_tokens is not None:
+            self.prompt_tokens = prompt_tokens
+        if completion_tokens is not None:
+            self.completion_tokens = completion_tokens
+
+    def ollama_usage(self, metadata):
+        """
+        metadata 為 ollama.chat 的回應，或 ChatOllama 訊息的 response_metadata（串流時只有最後一段有值）
+        """
+        self.usage(metadata.get("prompt_eval_count"), metadata.get("eval_count"))
+        prompt_eval_ns = metadata.get("prompt_eval_duration")
+        if self.ttft is None and prompt_eval_ns is not None:
+            self.ttft = ((metadata.get("load_duration") or 0) + prompt_eval_ns) / 1e9
+
+    def fail(self, status="error"):
+        self.status = status
+
+    def finish(self):
+        llm_call_metrics.observe(time.perf_counter() - self.start, status=self.status, **self.labels)
+        if self.status != "ok":
+            return
+        if self.ttft is not None:
+            llm_ttft_metrics.observe(self.ttft, **self.labels)
+        for kind, count in (("prompt", self.prompt_tokens), ("completion", self.completion_tokens)):
+            if count is not None:
+                llm_token_metrics.observe(count, kind=kind, **self.labels)
+
+
+@contextmanager
+def track_llm_call(provider, model, call_site=DEFAULT_CALL_SITE):
+    """
+    所有 LLM 呼叫的共同入口：with 區塊內發出請求並以 call.usage / first_token 回報，
+    例外記為 error，串流被 consumer 關閉或 task 被取消記為 cancelled，例外照常往外拋
+    """
+    call = LlmCall(provider, model, call_site)
+    try:
+        yield call
+    except (GeneratorExit, asyncio.CancelledError):
+        call.fail("cancelled")
+        raise
+    except Exception:
+        call.fail()
+        raise
+    finally:
+        call.finish()
+
+
+def ollama_chat(model, messages, call_site=DEFAULT_CALL_SITE, client=None, **kwargs):
+    """
+    ollama.chat 的包裝（client 預設為 ollama 模組的預設 client），回傳值不變
+    """
+    with track_llm_call("ollama", model, call_site) as call:
+        response = (client or ollama).chat(model=model, messages=messages, **kwargs)
+        call.ollama_usage(response)
+    return response
+
+
+def _get_async_client():
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = ollama.AsyncClient()
+    return client
+
+
+async def aollama_chat(model, messages, call_site=DEFAULT_CALL_SITE, client=None, **kwargs):
+    """
+    ollama.AsyncClient().chat 的包裝，回傳值不變；未傳入 client 時重用目前 event loop 的 AsyncClient（keep-alive）
+    """
+    with track_llm_call("ollama", model, call_site) as call:
+        response = await (client or _get_async_client()).chat(model=model, messages=messages, **kwargs)
+        call.ollama_usage(response)
+    return response
+
+
+@register_collector
+def _llm_metrics():
+    return [metrics.render().rstrip("\n") for metrics in (llm_call_metrics, llm_ttft_metrics, llm_token_metrics)]
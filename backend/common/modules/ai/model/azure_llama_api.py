@@ -1,14 +1,130 @@
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+import weakref
+
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
+
+from ..llm_gateway import DEFAULT_CALL_SITE, track_llm_call
+
+# 連線設定（秒），環境變數可覆寫；卡住的上游最多佔用 worker AZURE_READ_TIMEOUT 秒
+AZURE_CONNECT_TIMEOUT = float(os.environ.get("AZURE_CONNECT_TIMEOUT", "10"))
+AZURE_READ_TIMEOUT = float(os.environ.get("AZURE_READ_TIMEOUT", "120"))
+# 連線池大小：同時對 Azure 發出的請求數上限，閒置連線保持 keep-alive 供後續請求重用
+AZURE_POOL_SIZE = int(os.environ.get("AZURE_POOL_SIZE", "10"))
+# 429 / 5xx / 連線錯誤時的重試次數與 backoff（full jitter：隨機等待 0 ~ min(max, base * 2^n) 秒）
+AZURE_MAX_RETRIES = int(os.environ.get("AZURE_MAX_RETRIES", "3"))
+AZURE_BACKOFF_BASE = float(os.environ.get("AZURE_BACKOFF_BASE", "0.5"))
+AZURE_BACKOFF_MAX = float(os.environ.get("AZURE_BACKOFF_MAX", "8"))
+RETRY_STATUS = frozenset({429, 500, 502, 503, 504})
+# 只重試請求尚未送達的錯誤（連線失敗 / 連線逾時 / 等待連線池逾時）
+# 讀取逾時不重試：上游可能仍在生成，重送會讓最壞等待時間變成 (重試次數 + 1) × AZURE_READ_TIMEOUT
+RETRY_ERRORS = (requests.ConnectionError,)  # 包含 ConnectTimeout，不含 ReadTimeout
+ASYNC_RETRY_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+SSE_DONE = object()
+
+
+class AzureAPIError(RuntimeError):
+    """ Azure 回傳非 200（重試後仍失敗）；呼叫端以例外處理，錯誤訊息不會被當成回答寫入快取 """
+
+    def __init__(self, status_code, text):
+        super().__init__(f"API 請求失敗: {status_code}, {text}")
+        self.status_code = status_code
+
+
+def _backoff(attempt, retry_after=None):
+    """ 第 attempt 次重試前的等待秒數；有 Retry-After（秒）時以其為準 """
+    if retry_after:
+        try:
+            return min(float(retry_after), AZURE_BACKOFF_MAX)
+        except ValueError:
+            pass  # HTTP-date 格式不處理，改用 backoff
+    return random.uniform(0, min(AZURE_BACKOFF_MAX, AZURE_BACKOFF_BASE * 2 ** attempt))
+
+
+def _record_usage(call, body):
+    """ 將回應中的 usage（OpenAI 格式）記入 llm_gateway 的 LlmCall """
+    usage = body.get("usage") or {}
+    call.usage(usage.get("prompt_tokens"), usage.get("completion_tokens"))
+
+
+def _sse_delta(line, call=None):
+    """ 解析一行 server-sent event：回傳回答片段、None（略過）或 SSE_DONE（串流結束）；帶有 usage 的事件記入 call """
+    if not line or not line.startswith("data:"):
+        return None
+    data = line[len("data:"):].strip()
+    if data == "[DONE]":
+        return SSE_DONE
+    event = json.loads(data)
+    if call is not None:
+        _record_usage(call, event)
+    choices = event.get("choices") or []
+    if choices:
+        return choices[0].get("delta", {}).get("content") or None
+    return None
+
 
 class AzureLlamaAPI:
-    """ 使用 `requests` 呼叫 Azure Inference API """
+    """
+    呼叫 Azure Inference API
+    - 同步：共用一個 requests.Session（keep-alive 連線池），避免每次查詢重新 TLS 握手
+    - 非同步：每個 event loop 共用一個 httpx.AsyncClient
+    - 皆有連線 / 讀取逾時，429 / 5xx / 連線錯誤時以 jitter backoff 重試（讀取逾時不重試），最終仍非 200 時拋出 AzureAPIError
+    - 每次呼叫（含重試）經 llm_gateway 記錄耗時、token 數與錯誤，call_site 標示呼叫位置
+    """
+
+    MODEL = "Llama-3.3-70B-Instruct"
+    API_URL = os.environ.get("AZURE_API_URL", "https://models.inference.ai.azure.com/chat/completions")
+    API_KEY = os.environ.get("AZURE_API_KEY", "#")  # ⚠️ 請確保 API Key 正確
+
+    _session = None
+    _session_lock = threading.Lock()
+    _async_clients = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def _get_session(cls):
+        with cls._session_lock:
+            if cls._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=AZURE_POOL_SIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                cls._session = session
+            return cls._session
 
-    API_URL = "https://models.inference.ai.azure.com/chat/completions"
-    API_KEY = "#"  # ⚠️ 請確保 API Key 正確
+    @classmethod
+    def _get_async_client(cls):
+        # httpx.AsyncClient 的連線綁定建立它的 event loop，因此每個 loop 各一個
+        loop = asyncio.get_running_loop()
+        client = cls._async_clients.get(loop)
+        if client is None:
+            limits = httpx.Limits(max_connections=AZURE_POOL_SIZE, max_keepalive_connections=AZURE_POOL_SIZE)
+            client = cls._async_clients[loop] = httpx.AsyncClient(limits=limits)
+        return client
+
+    @classmethod
+    def close(cls):
+        """ 關閉同步連線池（之後的請求會重新建立） """
+        with cls._session_lock:
+            if cls._session is not None:
+                cls._session.close()
+                cls._session = None
+
+    @classmethod
+    async def aclose(cls):
+        """ 關閉目前 event loop 的 AsyncClient """
+        client = cls._async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
 
     @staticmethod
-    def ask(question: str, context: str = ""):
-        """ 直接發送 `POST` API，包含檢索到的上下文 """
+    def _build_request(question: str, context: str = "", temperature=0.8, max_tokens=2048, top_p=0.1, stream=False):
+        """ 組出 (headers, payload) """
         headers = {
             "Content-Type": "application/json",
             "Authorization": f"Bearer {AzureLlamaAPI.API_KEY}"
@@ -21,16 +137,132 @@ class AzureLlamaAPI:
 
         payload = {
             "messages": messages,
-            "model": "Llama-3.3-70B-Instruct",
-            "temperature": 0.8,
-            "max_tokens": 2048,
-            "top_p": 0.1
+            "model": AzureLlamaAPI.MODEL,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "top_p": top_p
         }
+        if stream:
+            payload["stream"] = True
+        return headers, payload
+
+    @staticmethod
+    def _parse(response, call):
+        """ requests 與 httpx 的 response 介面相同；非 200 時拋出 AzureAPIError（由 track_llm_call 記為 error） """
+        if response.status_code != 200:
+            raise AzureAPIError(response.status_code, response.text)
+        body = response.json()
+        _record_usage(call, body)
+        return body["choices"][0]["message"]["content"]
 
-        response = requests.post(AzureLlamaAPI.API_URL, headers=headers, json=payload)
+    @staticmethod
+    def _track(call_site):
+        return track_llm_call("azure", AzureLlamaAPI.MODEL, call_site)
+
+    @classmethod
+    def _post(cls, headers, payload, stream=False):
+        """ 以共用 session 發送，需重試的狀態碼或連線錯誤時等待後重送；回傳最後一次的 response """
+        for attempt in range(AZURE_MAX_RETRIES + 1):
+            last = attempt == AZURE_MAX_RETRIES
+            try:
+                response = cls._get_session().post(
+                    cls.API_URL, headers=headers, json=payload, stream=stream,
+                    timeout=(AZURE_CONNECT_TIMEOUT, AZURE_READ_TIMEOUT)
+                )
+            except RETRY_ERRORS as e:
+                if last:
+                    raise
+                delay = _backoff(attempt)
+                print(f"⚠️ [Azure] 連線失敗（{e}），{delay:.1f}s 後重試（{attempt + 1}/{AZURE_MAX_RETRIES}）")
+            else:
+                if response.status_code not in RETRY_STATUS or last:
+                    return response
+                delay = _backoff(attempt, response.headers.get("Retry-After"))
+                response.close()
+                print(f"⚠️ [Azure] HTTP {response.status_code}，{delay:.1f}s 後重試（{attempt + 1}/{AZURE_MAX_RETRIES}）")
+            time.sleep(delay)
 
-        if response.status_code == 200:
-            result = response.json()
-            return result["choices"][0]["message"]["content"]
-        else:
-            return f"API 請求失敗: {response.status_code}, {response.text}"
\ No newline at end of file
+    @classmethod
+    async def _apost(cls, headers, payload, stream=False):
+        """ _post 的非同步版本，等待 backoff 時不阻塞 event loop；stream 時呼叫端需 aclose 回傳的 response """
+        client = cls._get_async_client()
+        timeout = httpx.Timeout(AZURE_READ_TIMEOUT, connect=AZURE_CONNECT_TIMEOUT)
+        for attempt in range(AZURE_MAX_RETRIES + 1):
+            last = attempt == AZURE_MAX_RETRIES
+            try:
+                request = client.build_request("POST", cls.API_URL, headers=headers, json=payload, timeout=timeout)
+                response = await client.send(request, stream=stream)
+            except ASYNC_RETRY_ERRORS as e:
+                if last:
+                    raise
+                delay = _backoff(attempt)
+                print(f"⚠️ [Azure] 連線失敗（{e!r}），{delay:.1f}s 後重試（{attempt + 1}/{AZURE_MAX_RETRIES}）")
+            else:
+                if response.status_code not in RETRY_STATUS or last:
+                    return response
+                delay = _backoff(attempt, response.headers.get("Retry-After"))
+                await response.aclose()
+                print(f"⚠️ [Azure] HTTP {response.status_code}，{delay:.1f}s 後重試（{attempt + 1}/{AZURE_MAX_RETRIES}）")
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    def ask(question: str, context: str = "", temperature=0.8, max_tokens=2048, top_p=0.1,
+            call_site=DEFAULT_CALL_SITE):
+        """ 發送 `POST` API，包含檢索到的上下文 """
+        headers, payload = AzureLlamaAPI._build_request(question, context, temperature, max_tokens, top_p)
+        with AzureLlamaAPI._track(call_site) as call:
+            response = AzureLlamaAPI._post(headers, payload)
+            return AzureLlamaAPI._parse(response, call)
+
+    @staticmethod
+    async def aask(question: str, context: str = "", temperature=0.8, max_tokens=2048, top_p=0.1,
+                   call_site=DEFAULT_CALL_SITE):
+        """ 以 httpx 非同步發送 `POST` API，等待回應時不佔用執行緒 """
+        headers, payload = AzureLlamaAPI._build_request(question, context, temperature, max_tokens, top_p)
+        with AzureLlamaAPI._track(call_site) as call:
+            response = await AzureLlamaAPI._apost(headers, payload)
+            return AzureLlamaAPI._parse(response, call)
+
+    @staticmethod
+    def ask_stream(question: str, context: str = "", temperature=0.8, max_tokens=2048, top_p=0.1,
+                   call_site=DEFAULT_CALL_SITE):
+        """ 以 `stream: true` 呼叫 API，逐段 yield 回答內容（server-sent events）；只在收到回應前重試 """
+        headers, payload = AzureLlamaAPI._build_request(
+            question, context, temperature, max_tokens, top_p, stream=True
+        )
+
+        # with 區塊確保 generator 提前關閉時連線也會釋放（歸還連線池）
+        with AzureLlamaAPI._track(call_site) as call, AzureLlamaAPI._post(headers, payload, stream=True) as response:
+            if response.status_code != 200:
+                raise AzureAPIError(response.status_code, response.text)
+            response.encoding = "utf-8"  # text/event-stream 未標 charset 時 requests 會當成 ISO-8859-1
+            for line in response.iter_lines(decode_unicode=True):
+                delta = _sse_delta(line, call)
+                if delta is SSE_DONE:
+                    break
+                if delta:
+                    call.first_token()
+                    yield delta
+
+    @staticmethod
+    async def aask_stream(question: str, context: str = "", temperature=0.8, max_tokens=2048, top_p=0.1,
+                          call_site=DEFAULT_CALL_SITE):
+        """ ask_stream 的非同步版本；aclose 或 task 被取消時關閉 HTTP 串流（連線不再歸還連線池） """
+        headers, payload = AzureLlamaAPI._build_request(
+            question, context, temperature, max_tokens, top_p, stream=True
+        )
+        with AzureLlamaAPI._track(call_site) as call:
+            response = await AzureLlamaAPI._apost(headers, payload, stream=True)
+            try:
+                if response.status_code != 200:
+                    await response.aread()
+                    raise AzureAPIError(response.status_code, response.text)
+                async for line in response.aiter_lines():
+                    delta = _sse_delta(line, call)
+                    if delta is SSE_DONE:
+                        break
+                    if delta:
+                        call.first_token()
+                        yield delta
+            finally:
+                await response.aclose()
@@ -1,3 +1,6 @@
+from typing import AsyncIterator, Iterator
+
+from ..llm_gateway import DEFAULT_CALL_SITE
 from .azure_llama_api import AzureLlamaAPI
 from .i_model import IModel
 
@@ -6,5 +9,19 @@ class CloudModel(IModel):
     def __init__(self):
         self.__model = AzureLlamaAPI()
     
-    def generate(self, query: str, temperature=0.8, max_token=2048, top_p=0.1) -> str:
-        return self.__model.ask(query, temperature, max_token, top_p)
+    def generate(self, query: str, temperature=0.8, max_token=2048, top_p=0.1, call_site=DEFAULT_CALL_SITE) -> str:
+        return self.__model.ask(query, temperature=temperature, max_tokens=max_token, top_p=top_p, call_site=call_site)
+
+    async def agenerate(self, query: str, temperature=0.8, max_token=2048, top_p=0.1, call_site=DEFAULT_CALL_SITE) -> str:
+        return await self.__model.aask(query, temperature=temperature, max_tokens=max_token, top_p=top_p, call_site=call_site)
+
+    def stream(self, query: str, temperature=0.8, max_token=2048, top_p=0.1, call_site=DEFAULT_CALL_SITE) -> Iterator[str]:
+        yield from self.__model.ask_stream(query, temperature=temperature, max_tokens=max_token, top_p=top_p, call_site=call_site)
+
+    async def astream(self, query: str, temperature=0.8, max_token=2048, top_p=0.1, call_site=DEFAULT_CALL_SITE) -> AsyncIterator[str]:
+        tokens = self.__model.aask_stream(query, temperature=temperature, max_tokens=max_token, top_p=top_p, call_site=call_site)
+        try:
+            async for token in tokens:
+                yield token
+        finally:
+            await tokens.aclose()
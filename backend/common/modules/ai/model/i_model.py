@@ -1,7 +1,33 @@
+import asyncio
 from abc import ABC, abstractmethod
+from typing import AsyncIterator, Iterator
+
+from ..llm_gateway import DEFAULT_CALL_SITE
 
 
 class IModel(ABC):
+    """
+    call_site 標示呼叫位置（例如 enterprise_query），LLM 呼叫依 (模型, call_site) 記入 llm_gateway 的 metrics
+    """
+
     @abstractmethod
-    def generate(self, query: str, temperature=0.8, max_token=2048, top_p=0.1) -> str:
+    def generate(self, query: str, temperature=0.8, max_token=2048, top_p=0.1, call_site=DEFAULT_CALL_SITE) -> str:
         pass
+
+    def stream(self, query: str, temperature=0.8, max_token=2048, top_p=0.1, call_site=DEFAULT_CALL_SITE) -> Iterator[str]:
+        """
+        逐段產生回答；預設一次回傳完整答案，支援串流的模型應覆寫
+        consumer 停止讀取（generator.close()）時，實作應關閉底層的 HTTP 串流
+        """
+        yield self.generate(query, temperature, max_token, top_p, call_site)
+
+    async def agenerate(self, query: str, temperature=0.8, max_token=2048, top_p=0.1, call_site=DEFAULT_CALL_SITE) -> str:
+        """ 非同步產生回答；預設在執行緒中呼叫 generate，支援非同步 I/O 的模型應覆寫 """
+        return await asyncio.to_thread(self.generate, query, temperature, max_token, top_p, call_site)
+
+    async def astream(self, query: str, temperature=0.8, max_token=2048, top_p=0.1, call_site=DEFAULT_CALL_SITE) -> AsyncIterator[str]:
+        """
+        非同步逐段產生回答；預設一次回傳 agenerate 的完整答案，支援串流的模型應覆寫
+        consumer 停止讀取（aclose() 或所在 task 被取消）時，實作應關閉底層的 HTTP 串流
+        """
+        yield await self.agenerate(query, temperature, max_token, top_p, call_site)
@@ -1,21 +1,72 @@
+from typing import AsyncIterator, Iterator
+
 from langchain_core.messages import HumanMessage
-from langchain_core.output_parsers import StrOutputParser
 from langchain_ollama import ChatOllama
 
+from ..llm_gateway import DEFAULT_CALL_SITE, track_llm_call
 from .i_model import IModel
 
 DEFAULT_MODEL_NAME="llama3.2"
 
 class LocalModel(IModel):
+    """
+    ChatOllama 模型；同一個實例由 LlmFactory 共用於所有請求與執行緒
+    取樣參數每次呼叫以 bind(options=...) 傳入，不修改共用的 ChatOllama 物件
+    回傳的訊息帶有 Ollama 的 token 數與耗時（response_metadata），記入 llm_gateway 後只回傳文字
+    """
+
     def __init__(self, model_name=DEFAULT_MODEL_NAME):
+        self.model_name = model_name
         self.__model = ChatOllama(
             model = model_name
         )
-        self.__chain = self.__model | StrOutputParser()
 
-    def generate(self, query: str, temperature=0.8, max_token=2048, top_p=0.1) -> str:
+    def _bound(self, temperature, max_token, top_p):
+        options = {"temperature": temperature, "top_p": top_p, "num_predict": max_token}
+        return self.__model.bind(options=options)
+
+    def _track(self, call_site):
+        return track_llm_call("ollama", self.model_name, call_site)
+
+    def generate(self, query: str, temperature=0.8, max_token=2048, top_p=0.1, call_site=DEFAULT_CALL_SITE) -> str:
+        message = [HumanMessage(content=query)]
+        with self._track(call_site) as call:
+            response = self._bound(temperature, max_token, top_p).invoke(message)
+            call.ollama_usage(response.response_metadata)
+        return response.content
+
+    async def agenerate(self, query: str, temperature=0.8, max_token=2048, top_p=0.1, call_site=DEFAULT_CALL_SITE) -> str:
+        message = [HumanMessage(content=query)]
+        # ainvoke 以 httpx 非同步呼叫 Ollama，等待期間不佔用執行緒
+        with self._track(call_site) as call:
+            response = await self._bound(temperature, max_token, top_p).ainvoke(message)
+            call.ollama_usage(response.response_metadata)
+        return response.content
+
+    def stream(self, query: str, temperature=0.8, max_token=2048, top_p=0.1, call_site=DEFAULT_CALL_SITE) -> Iterator[str]:
+        message = [HumanMessage(content=query)]
+        with self._track(call_site) as call:
+            chunks = self._bound(temperature, max_token, top_p).stream(message)
+            try:
+                for chunk in chunks:
+                    call.ollama_usage(chunk.response_metadata)
+                    if chunk.content:
+                        call.first_token()
+                        yield chunk.content
+            finally:
+                # generator 被關閉（例如 client 斷線）時，ChatOllama 的 HTTP 串流也會一併關閉
+                chunks.close()
+
+    async def astream(self, query: str, temperature=0.8, max_token=2048, top_p=0.1, call_site=DEFAULT_CALL_SITE) -> AsyncIterator[str]:
         message = [HumanMessage(content=query)]
-        self.__model.temperature = temperature
-        self.__model.top_p = top_p
-        self.__model.num_predict = max_token
-        return self.__chain.invoke(message)
+        with self._track(call_site) as call:
+            chunks = self._bound(temperature, max_token, top_p).astream(message)
+            try:
+                async for chunk in chunks:
+                    call.ollama_usage(chunk.response_metadata)
+                    if chunk.content:
+                        call.first_token()
+                        yield chunk.content
+            finally:
+                # aclose / 取消時關閉 ChatOllama 的非同步 HTTP 串流，Ollama 隨即停止生成
+                await chunks.aclose()
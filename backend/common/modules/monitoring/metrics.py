@@ -0,0 +1,147 @@
+import bisect
+import math
+import os
+import threading
+from collections import deque
+
+# 直方圖的 bucket 上限（秒），涵蓋 embedding（數十毫秒）到本地 LLM（數十秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+QUANTILES = (0.5, 0.95, 0.99)
+# 計算分位數時保留每個序列最近的觀測筆數
+METRICS_WINDOW = int(os.environ.get("METRICS_WINDOW", "1024"))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Series:
+    __slots__ = ("bucket_counts", "count", "sum", "recent")
+
+    def __init__(self, bucket_count, window):
+        self.bucket_counts = [0] * bucket_count
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=window)
+
+
+class StageMetrics:
+    """
+    各階段耗時的統計，以 Prometheus 文字格式輸出
+    - <name>：直方圖（累計 bucket / sum / count），可在 Prometheus 端以 histogram_quantile 聚合多個 worker
+    - <name>_recent：summary，此行程最近 window 筆觀測的 p50 / p95 / p99
+    labels 例如 endpoint / stage / model / retrieval_mode；計數存在行程記憶體中，每個 worker 各自輸出
+    """
+
+    def __init__(self, name="rag_stage_duration_seconds", description="查詢各階段耗時（秒）",
+                 buckets=DEFAULT_BUCKETS, window=METRICS_WINDOW):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(buckets))
+        self.window = window
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = _Series(len(self.buckets), self.window)
+            index = bisect.bisect_left(self.buckets, seconds)
+            if index < len(self.buckets):
+                series.bucket_counts[index] += 1
+            series.count += 1
+            series.sum += seconds
+            series.recent.append(seconds)
+
+    def observe_timer(self, timer, **labels):
+        """
+        將 StageTimer 的每個階段（含 total）記為一筆觀測，stage label 為階段名稱
+        """
+        for stage, elapsed_ms in timer.as_dict().items():
+            self.observe(elapsed_ms / 1000, stage=stage, **labels)
+
+    @staticmethod
+    def _quantile(values, q):
+        # nearest-rank
+        return values[max(math.ceil(q * len(values)) - 1, 0)]
+
+    def quantiles(self, **labels):
+        with self._lock:
+            series = self._series.get(tuple(sorted(labels.items())))
+            values = sorted(series.recent) if series else []
+        return {q: self._quantile(values, q) for q in QUANTILES} if values else {}
+
+    def render(self):
+        with self._lock:
+            snapshot = [
+                (key, list(s.bucket_counts), s.count, s.sum, sorted(s.recent))
+                for key, s in sorted(self._series.items())
+            ]
+
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for key, bucket_counts, count, total, _ in snapshot:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(key, le=_format_value(bound))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(key, le='+Inf')} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+
+        recent = f"{self.name}_recent"
+        lines += [f"# HELP {recent} {self.description}，最近 {self.window} 筆的分位數",
+                  f"# TYPE {recent} summary"]
+        for key, _, _, _, values in snapshot:
+            if not values:
+                continue
+            for q in QUANTILES:
+                lines.append(f"{recent}{_format_labels(key, quantile=q)} {_format_value(self._quantile(values, q))}")
+            lines.append(f"{recent}_sum{_format_labels(key)} {_format_value(sum(values))}")
+            lines.append(f"{recent}_count{_format_labels(key)} {len(values)}")
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+
+# 查詢路徑（views 與 LlmFactory 建立的模型）共用的耗時統計
+stage_metrics = StageMetrics()
+
+# 其他模組註冊的輸出函式，各自回傳 Prometheus 格式的行（例如 LlmFactory 的連線池狀態）
+_collectors = []
+
+
+def register_collector(collector):
+    _collectors.append(collector)
+    return collector
+
+
+def format_sample(name, value, **labels):
+    return f"{name}{_format_labels(sorted(labels.items())) if labels else ''} {_format_value(value)}"
+
+
+def render_metrics():
+    parts = [stage_metrics.render()]
+    for collector in _collectors:
+        try:
+            lines = collector()
+        except Exception as e:
+            print(f"❌ metrics collector 執行失敗：{e}")
+            continue
+        if lines:
+            parts.append("\n".join(lines) + "\n")
+    return "".join(parts)
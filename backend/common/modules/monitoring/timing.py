@@ -0,0 +1,45 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+class StageTimer:
+    """
+    記錄一個請求中各階段的耗時（毫秒），例如 retrieve / rerank / pack / llm
+    同一階段重複進入時累加；可跨執行緒使用（async view 會把檢索丟到執行緒池）
+    """
+
+    def __init__(self):
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self.timings = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - start) * 1000)
+
+    def record(self, name, elapsed_ms):
+        with self._lock:
+            self.timings[name] = self.timings.get(name, 0.0) + elapsed_ms
+
+    def total_ms(self):
+        return (time.perf_counter() - self._start) * 1000
+
+    def as_dict(self):
+        with self._lock:
+            timings = {name: round(ms, 1) for name, ms in self.timings.items()}
+        timings["total"] = round(self.total_ms(), 1)
+        return timings
+
+    def server_timing(self):
+        """
+        HTTP Server-Timing header 的值，瀏覽器開發者工具的 Timing 分頁會顯示各階段耗時
+        """
+        return ", ".join(f"{name};dur={ms}" for name, ms in self.as_dict().items())
+
+    def summary(self):
+        return "，".join(f"{name} {ms:.0f}ms" for name, ms in self.as_dict().items())
@@ -0,0 +1,169 @@
+import json
+import time
+
+import numpy as np
+
+from .sqlite_store import SqliteStore
+
+DEFAULT_ANSWER_CACHE_PATH = "answer_cache.sqlite3"
+DEFAULT_THRESHOLD = 0.95
+DEFAULT_TTL_SECONDS = 24 * 60 * 60
+DEFAULT_MAX_ENTRIES = 2000
+
+
+class SemanticAnswerCache(SqliteStore):
+    """
+    以查詢向量做語意比對的回答快取
+    - scope：(model_type, model_name, use_retrieval, retrieval_mode, departments, k / fetch_k / rerank) 相同才可共用答案
+    - 同 scope 中 cosine 相似度 >= threshold 的最相近項目即為命中（向量皆已 L2 正規化，內積即 cosine）
+    - 超過 ttl_seconds 的項目視為過期；超過 max_entries 時依最後使用時間淘汰（LRU）
+    - citations 記錄每筆答案引用的 Knowledge id，知識更新/刪除時以 invalidate_knowledge 清除
+    以 SQLite 存放，多個 worker 行程共用同一份快取與失效狀態
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS answers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            scope TEXT NOT NULL,
+            query TEXT NOT NULL,
+            vector BLOB NOT NULL,
+            answer TEXT NOT NULL,
+            retrieved_docs TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_used REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS citations (
+            answer_id INTEGER NOT NULL,
+            knowledge_id TEXT NOT NULL,
+            PRIMARY KEY (knowledge_id, answer_id)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_answers_scope ON answers(scope);
+        CREATE INDEX IF NOT EXISTS idx_answers_last_used ON answers(last_used);
+        CREATE INDEX IF NOT EXISTS idx_citations_answer ON citations(answer_id);
+    """
+
+    def __init__(self, path=DEFAULT_ANSWER_CACHE_PATH, threshold=DEFAULT_THRESHOLD,
+                 ttl_seconds=DEFAULT_TTL_SECONDS, max_entries=DEFAULT_MAX_ENTRIES):
+        super().__init__(path)
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def scope_key(model_type, model_name, use_retrieval, retrieval_mode="mmr", departments=None,
+                  **retrieval_options):
+        """
+        retrieval_options 為其他影響檢索結果的參數（例如 k / fetch_k / rerank）
+        """
+        return json.dumps(
+            [model_type, model_name, bool(use_retrieval), retrieval_mode if use_retrieval else "",
+             sorted(departments) if departments else None,
+             sorted(retrieval_options.items()) if use_retrieval else []],
+            ensure_ascii=False
+        )
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def _delete_ids(self, ids):
+        self._execute_in("DELETE FROM citations WHERE answer_id IN ({marks})", ids)
+        self._execute_in("DELETE FROM answers WHERE id IN ({marks})", ids)
+
+    def get(self, scope, query_vector):
+        """
+        命中時回傳 {"query", "answer", "retrieved_docs", "similarity"}，否則回傳 None
+        """
+        query_vector = self._normalize(query_vector)
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, query, vector, answer, retrieved_docs, created_at FROM answers WHERE scope=?", (scope,)
+            ).fetchall()
+            expired = [r[0] for r in rows if now - r[5] > self.ttl_seconds]
+            if expired:
+                self._delete_ids(expired)
+                self._conn.commit()
+            rows = [r for r in rows if now - r[5] <= self.ttl_seconds]
+
+            best = None
+            if rows:
+                matrix = np.stack([np.frombuffer(r[2], dtype=np.float32) for r in rows])
+                scores = matrix @ query_vector
+                index = int(np.argmax(scores))
+                if scores[index] >= self.threshold:
+                    best = rows[index], float(scores[index])
+
+            if best is None:
+                self.misses += 1
+                return None
+            row, similarity = best
+            self._conn.execute("UPDATE answers SET last_used=? WHERE id=?", (now, row[0]))
+            self._conn.commit()
+            self.hits += 1
+        return {
+            "query": row[1],
+            "answer": row[3],
+            "retrieved_docs": json.loads(row[4]),
+            "similarity": similarity,
+        }
+
+    def put(self, scope, query, query_vector, answer, retrieved_docs, knowledge_ids=()):
+        now = time.time()
+        vector = self._normalize(query_vector)
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO answers (scope, query, vector, answer, retrieved_docs, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (scope, query, vector.tobytes(), answer, json.dumps(retrieved_docs, ensure_ascii=False), now, now)
+            )
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO citations (answer_id, knowledge_id) VALUES (?, ?)",
+                [(cursor.lastrowid, str(k)) for k in set(knowledge_ids)]
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        count = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow > 0:
+            ids = [r[0] for r in self._conn.execute(
+                "SELECT id FROM answers ORDER BY last_used ASC LIMIT ?", (overflow,)
+            )]
+            self._delete_ids(ids)
+
+    def invalidate_knowledge(self, knowledge_id):
+        """
+        清除所有引用此 Knowledge 的答案，回傳清除的筆數
+        """
+        with self._lock:
+            ids = [r[0] for r in self._conn.execute(
+                "SELECT answer_id FROM citations WHERE knowledge_id=?", (str(knowledge_id),)
+            )]
+            self._delete_ids(ids)
+            self._conn.commit()
+        return len(ids)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM citations")
+            self._conn.execute("DELETE FROM answers")
+            self._conn.commit()
+
+    def stats(self):
+        total = self.hits + self.misses
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": size,
+            "max_entries": self.max_entries,
+            "threshold": self.threshold,
+            "ttl_seconds": self.ttl_seconds,
+        }
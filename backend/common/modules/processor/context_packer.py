@@ -0,0 +1,133 @@
+import math
+import os
+import re
+
+# CJK 統一表意文字、日文假名、全形標點
+_CJK_CHAR = re.compile(r"[　-〿぀-ヿ㐀-䶿一-鿿豈-﫿＀-￯]")
+
+# 各模型可用於背景資訊的 token 上限（不含問題與模板）
+# Ollama 預設 num_ctx 為 2048，需保留回答的空間；雲端 Llama-3.3-70B 的 context 較大
+DEFAULT_TOKEN_BUDGETS = {
+    "llama3.2": 1500,
+    "gemma3": 1500,
+    "cloud": 6000,
+}
+DEFAULT_TOKEN_BUDGET = 1500
+# CONTEXT_TOKEN_BUDGET 可統一覆寫所有模型的上限
+CONTEXT_TOKEN_BUDGET = os.environ.get("CONTEXT_TOKEN_BUDGET")
+
+SEPARATOR = "\n\n"
+# 剩餘空間少於此數量時不再截斷片段塞入，避免只放入半句話
+MIN_TRUNCATED_TOKENS = 64
+# 重疊少於此字數視為巧合（例如同為「。」或空白結尾），不去除
+MIN_OVERLAP_CHARS = 5
+
+
+def estimate_tokens(text):
+    """
+    不載入 tokenizer 的估算：中日文字元約 1 token，其餘字元約 4 個一個 token
+    """
+    cjk = len(_CJK_CHAR.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def token_budget(model_type, model_name):
+    if CONTEXT_TOKEN_BUDGET:
+        return int(CONTEXT_TOKEN_BUDGET)
+    key = "cloud" if model_type == "cloud" else model_name
+    return DEFAULT_TOKEN_BUDGETS.get(key, DEFAULT_TOKEN_BUDGET)
+
+
+def merge_overlap(left, right, max_overlap=None, min_overlap=MIN_OVERLAP_CHARS):
+    """
+    串接相鄰 chunk，去除 left 結尾與 right 開頭重複的部分（splitter 的 chunk_overlap）
+    max_overlap 應傳入 splitter 的 chunk_overlap；重疊少於 min_overlap 字時直接串接
+    """
+    limit = min(len(left), len(right), max_overlap or len(right))
+    for size in range(limit, min_overlap - 1, -1):
+        if left.endswith(right[:size]):
+            return left + right[size:]
+    return left + right
+
+
+def _truncate(text, max_tokens):
+    # 依估算比例截斷，再逐步縮短直到符合上限
+    end = max(int(len(text) * max_tokens / max(estimate_tokens(text), 1)), 0)
+    while end > 0 and estimate_tokens(text[:end]) > max_tokens:
+        end -= max(1, end // 20)
+    return text[:end]
+
+
+def pack_context(docs, budget_tokens=DEFAULT_TOKEN_BUDGET, separator=SEPARATOR, max_overlap=None):
+    """
+    組出送入 LLM 的背景資訊
+    - docs 為依相關性排序的 [{"id", "document_id", "page_number", "media_type", "source", "chunk_index", "content"}, ...]
+    - 同一個 chunk id 重複出現時只保留名次最前的一筆
+    - 同一次切割（同文件、同頁、同類型、同來源）中 chunk_index 連續的 chunk 合併為一段，並去除重疊文字
+    - 各段依其中最相關 chunk 的名次排序，依序放入直到 budget_tokens
+    chunk_index 為 None 的項目（例如 docstore 的完整表格內容）不與其他 chunk 合併
+    max_overlap 為 splitter 的 chunk_overlap，傳給 merge_overlap
+    回傳 (context, stats)
+    """
+    groups = {}
+    standalone = []
+    seen = set()
+    for rank, doc in enumerate(docs):
+        chunk_id = doc.get("id")
+        if chunk_id is not None:
+            if chunk_id in seen:
+                continue
+            seen.add(chunk_id)
+        if doc.get("chunk_index") is None:
+            standalone.append((rank, [doc]))
+            continue
+        key = tuple(str(doc.get(field)) for field in ("document_id", "page_number", "media_type", "source"))
+        groups.setdefault(key, []).append((rank, doc))
+
+    segments = list(standalone)
+    for members in groups.values():
+        members.sort(key=lambda m: m[1]["chunk_index"])
+        run = [members[0]]
+        for member in members[1:]:
+            if member[1]["chunk_index"] == run[-1][1]["chunk_index"] + 1:
+                run.append(member)
+            else:
+                segments.append((min(r for r, _ in run), [d for _, d in run]))
+                run = [member]
+        segments.append((min(r for r, _ in run), [d for _, d in run]))
+    segments.sort(key=lambda s: s[0])
+
+    raw_chars = sum(len(doc["content"]) for doc in docs)
+    texts = []
+    for _, members in segments:
+        text = members[0]["content"]
+        for doc in members[1:]:
+            text = merge_overlap(text, doc["content"], max_overlap)
+        texts.append(text)
+
+    packed, used = [], 0
+    separator_tokens = estimate_tokens(separator)
+    for text in texts:
+        cost = estimate_tokens(text) + (separator_tokens if packed else 0)
+        if used + cost <= budget_tokens:
+            packed.append(text)
+            used += cost
+            continue
+        remaining = budget_tokens - used - (separator_tokens if packed else 0)
+        if remaining >= MIN_TRUNCATED_TOKENS:
+            truncated = _truncate(text, remaining)
+            packed.append(truncated)
+            used += estimate_tokens(truncated) + (separator_tokens if len(packed) > 1 else 0)
+        # 放不下的段落略過，較短的後續段落仍可能放得下
+
+    context = separator.join(packed)
+    stats = {
+        "chunks": len(docs),
+        "segments": len(segments),
+        "packed_segments": len(packed),
+        "raw_chars": raw_chars,
+        "context_chars": len(context),
+        "tokens": used,
+        "budget": budget_tokens,
+    }
+    return context, stats
@@ -0,0 +1,54 @@
+from langchain_core.stores import BaseStore
+
+from .sqlite_store import SqliteStore
+
+
+class SqliteDocStore(SqliteStore, BaseStore[str, str]):
+    """
+    多向量檢索用的持久化 docstore：向量庫只存摘要向量，原始內容（例如表格完整 OCR 文字）存在這裡
+    以 doc_id 對應向量 metadata 中的 doc_id，並記錄 document_id 以便整份文件刪除
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS payloads (
+            doc_id TEXT PRIMARY KEY,
+            document_id TEXT,
+            payload TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_payloads_document ON payloads(document_id);
+    """
+
+    def mget(self, keys):
+        with self._lock:
+            found = dict(self._select_in("SELECT doc_id, payload FROM payloads WHERE doc_id IN ({marks})", keys))
+        return [found.get(key) for key in keys]
+
+    def mset(self, key_value_pairs, document_id=None):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO payloads (doc_id, document_id, payload) VALUES (?, ?, ?)",
+                [(key, None if document_id is None else str(document_id), value) for key, value in key_value_pairs]
+            )
+            self._conn.commit()
+
+    def mdelete(self, keys):
+        with self._lock:
+            self._execute_in("DELETE FROM payloads WHERE doc_id IN ({marks})", keys)
+            self._conn.commit()
+
+    def delete_document(self, document_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM payloads WHERE document_id=?", (str(document_id),))
+            self._conn.commit()
+
+    def yield_keys(self, prefix=None):
+        with self._lock:
+            if prefix:
+                rows = self._conn.execute(
+                    "SELECT doc_id FROM payloads WHERE doc_id LIKE ? ESCAPE '\\'",
+                    (prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%",)
+                ).fetchall()
+            else:
+                rows = self._conn.execute("SELECT doc_id FROM payloads").fetchall()
+        for (key,) in rows:
+            yield key
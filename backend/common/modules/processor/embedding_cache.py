@@ -0,0 +1,213 @@
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from .sqlite_store import SqliteStore
+
+DEFAULT_CACHE_PATH = "embedding_cache.sqlite3"
+DEFAULT_MAX_ENTRIES = 500_000
+DEFAULT_QUERY_LRU_SIZE = 1024
+# 命中時只有 last_used 早於此秒數才更新，避免每次查詢都寫入 SQLite；淘汰順序的精度因此為此間隔
+DEFAULT_TOUCH_INTERVAL = 600
+
+
+def normalize_text(text):
+    """
+    正規化後再計算 hash：NFKC（全形/半形統一）、合併連續空白、去除頭尾空白
+    """
+    text = unicodedata.normalize("NFKC", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def text_key(model_name, text):
+    return hashlib.sha256(f"{model_name}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class CachedEmbeddings(SqliteStore, Embeddings):
+    """
+    以 (模型名稱, 正規化文字 hash) 為 key 的持久化 embedding 快取
+    - 存放於 SQLite，向量以 float32 bytes 儲存
+    - 超過 max_entries 時依最後使用時間淘汰最舊的項目；last_used 最多每 touch_interval 秒更新一次
+    - 項目數開啟時讀取一次、之後在記憶體中累計，寫入時不需 COUNT(*)（多個行程共用同一檔案時淘汰為近似值）
+    - hits / misses 計數器可用於觀察快取效果：需要模型推論的文字記為 miss，其餘（含批次內重複）記為 hit
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS embeddings (
+            key TEXT PRIMARY KEY,
+            vector BLOB NOT NULL,
+            last_used REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used);
+    """
+
+    def __init__(self, embedder, model_name, path=DEFAULT_CACHE_PATH, max_entries=DEFAULT_MAX_ENTRIES,
+                 touch_interval=DEFAULT_TOUCH_INTERVAL):
+        super().__init__(path)
+        self.embedder = embedder
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.touch_interval = touch_interval
+        self.hits = 0
+        self.misses = 0
+        self._size = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def _lookup(self, keys):
+        with self._lock:
+            rows = self._select_in("SELECT key, vector, last_used FROM embeddings WHERE key IN ({marks})", keys)
+            found = {k: np.frombuffer(v, dtype=np.float32).tolist() for k, v, _ in rows}
+            now = time.time()
+            stale = [k for k, _, last_used in rows if now - last_used >= self.touch_interval]
+            if stale:
+                self._conn.executemany("UPDATE embeddings SET last_used=? WHERE key=?", [(now, k) for k in stale])
+                self._conn.commit()
+        return found
+
+    def _store(self, pairs):
+        now = time.time()
+        rows = [(k, np.asarray(v, dtype=np.float32).tobytes(), now) for k, v in pairs]
+        with self._lock:
+            existing = self._select_in("SELECT key FROM embeddings WHERE key IN ({marks})", [k for k, _, _ in rows])
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)", rows
+            )
+            self._size += len({k for k, _, _ in rows}) - len(existing)
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        overflow = self._size - self.max_entries
+        if overflow > 0:
+            deleted = self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)", (overflow,)
+            ).rowcount
+            self._size -= deleted
+
+    def _count(self, hits, misses):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def embed_documents(self, texts):
+        keys = [text_key(self.model_name, t) for t in texts]
+        cached = self._lookup(list(set(keys)))
+
+        # 同一批次中重複的文字只計算一次，計數規則與 LruQueryEmbeddings.embed_queries 相同
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        self._count(len(texts) - len(missing), len(missing))
+
+        if missing:
+            vectors = self.embedder.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self._store(computed.items())
+            cached.update(computed)
+        return [cached[k] for k in keys]
+
+    def embed_query(self, text):
+        key = text_key(self.model_name, text)
+        cached = self._lookup([key])
+        if key in cached:
+            self._count(1, 0)
+            return cached[key]
+        self._count(0, 1)
+        vector = self.embedder.embed_query(text)
+        self._store([(key, vector)])
+        return vector
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": self._size,
+            "max_entries": self.max_entries,
+        }
+
+
+class LruQueryEmbeddings(Embeddings):
+    """
+    行程內的查詢向量 LRU，放在所有 embedding 包裝的最外層
+    同一個查詢在一次請求中會被回答快取、檢索等多處使用，重複查詢也很常見；
+    命中時不需模型推論，也不需查詢 SQLite 快取。文件 embedding 直接交給下一層
+    """
+
+    def __init__(self, embedder, max_entries=DEFAULT_QUERY_LRU_SIZE):
+        self.embedder = embedder
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        return self.embedder.embed_documents(texts)
+
+    def embed_query(self, text):
+        key = normalize_text(text)
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return list(vector)
+            self.misses += 1
+        vector = tuple(self.embedder.embed_query(text))
+        with self._lock:
+            self._remember(key, vector)
+        return list(vector)
+
+    def embed_queries(self, texts):
+        """
+        批次查詢用：LRU 中沒有的查詢以一次 embed_documents 推論（bge-m3 的查詢與文件向量相同），
+        結果寫入 LRU，之後回答快取與檢索的 embed_query 皆可直接命中
+        """
+        keys = [normalize_text(t) for t in texts]
+        with self._lock:
+            found = {}
+            for key in dict.fromkeys(keys):
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    found[key] = self._entries[key]
+            missing = {}
+            for key, text in zip(keys, texts):
+                if key not in found and key not in missing:
+                    missing[key] = text
+            # 與逐筆呼叫 embed_query 的計數相同：每個需要推論的查詢記一次 miss，其餘（含批次內重複）記為 hit
+            self.misses += len(missing)
+            self.hits += len(keys) - len(missing)
+        if missing:
+            vectors = self.embedder.embed_documents(list(missing.values()))
+            with self._lock:
+                for key, vector in zip(missing, vectors):
+                    found[key] = tuple(vector)
+                    self._remember(key, found[key])
+        return [list(found[key]) for key in keys]
+
+    def _remember(self, key, vector):
+        self._entries[key] = vector
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        total = self.hits + self.misses
+        with self._lock:
+            size = len(self._entries)
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": size,
+            "max_entries": self.max_entries,
+        }
@@ -0,0 +1,17 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+# embedding 與 Chroma 檢索皆為同步且吃 CPU 的呼叫；async view 透過固定大小的執行緒池執行，
+# 併發查詢再多也只會有 BLOCKING_WORKERS 個同時在做 embedding / 檢索，其餘在 event loop 上等待
+BLOCKING_WORKERS = int(os.environ.get("BLOCKING_WORKERS", "4"))
+_blocking_pool = ThreadPoolExecutor(max_workers=BLOCKING_WORKERS, thread_name_prefix="blocking")
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """
+    在有上限的執行緒池中執行同步函式，不阻塞 event loop
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_blocking_pool, partial(fn, *args, **kwargs))
@@ -0,0 +1,187 @@
+import math
+import re
+import unicodedata
+from collections import Counter
+
+from .sqlite_store import SqliteStore
+
+# CJK 統一表意文字（含擴充 A）與相容表意文字
+_CJK_RUN = re.compile(r"[㐀-䶿一-鿿豈-﫿]+")
+_WORD = re.compile(r"[a-z0-9]+")
+
+# 出現在超過此比例 chunk 中的詞（例如「公司」「本年」這類 bigram）idf 很低、倒排表卻最長，查詢時略過
+MAX_DF_RATIO = 0.5
+# 語料少於此 chunk 數時不略過任何詞（小語料中高頻詞仍有鑑別力，倒排表也不長）
+PRUNE_MIN_DOCS = 1000
+
+
+def tokenize(text):
+    """
+    不需下載任何斷詞模型的切詞方式：
+    - 中文：連續漢字切成字元 bigram（單一漢字則保留 unigram）
+    - 英數：連續英數字為一個詞（帳戶代號、股票代碼等可精確比對）
+    """
+    text = unicodedata.normalize("NFKC", text).lower()
+    tokens = []
+    for run in _CJK_RUN.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    tokens.extend(_WORD.findall(text))
+    return tokens
+
+
+class LexicalIndex(SqliteStore):
+    """
+    以 SQLite 持久化的 BM25 倒排索引
+    - postings(term, chunk_id, tf)：倒排表
+    - chunks(chunk_id, document_id, department, length)：每個 chunk 的長度，用於 BM25 長度正規化
+    chunk_id 與 Chroma 的 id 相同，方便與向量檢索結果融合；department 同時用來查 chunk 所在的部門 collection
+    查詢時略過 df 超過 max_df_ratio 的高頻詞；只在讀取倒排表時持有 lock，BM25 計分在 lock 外進行
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS chunks (
+            chunk_id TEXT PRIMARY KEY,
+            document_id TEXT,
+            department TEXT NOT NULL DEFAULT '',
+            length INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS postings (
+            term TEXT NOT NULL,
+            chunk_id TEXT NOT NULL,
+            tf INTEGER NOT NULL,
+            PRIMARY KEY (term, chunk_id)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_postings_chunk ON postings(chunk_id);
+        CREATE INDEX IF NOT EXISTS idx_chunks_document ON chunks(document_id);
+    """
+
+    def __init__(self, path, k1=1.5, b=0.75, max_df_ratio=MAX_DF_RATIO, prune_min_docs=PRUNE_MIN_DOCS):
+        super().__init__(path)
+        self.k1 = k1
+        self.b = b
+        self.max_df_ratio = max_df_ratio
+        self.prune_min_docs = prune_min_docs
+
+    def _migrate(self):
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(chunks)")}
+        if "department" not in columns:
+            self._conn.execute("ALTER TABLE chunks ADD COLUMN department TEXT NOT NULL DEFAULT ''")
+
+    def add(self, ids, texts, document_ids, departments=None):
+        departments = departments or [""] * len(ids)
+        chunk_rows, posting_rows = [], []
+        for chunk_id, text, document_id, department in zip(ids, texts, document_ids, departments):
+            counts = Counter(tokenize(text))
+            chunk_rows.append((chunk_id, str(document_id), department or "", sum(counts.values())))
+            posting_rows.extend((term, chunk_id, tf) for term, tf in counts.items())
+        with self._lock:
+            self._delete_ids(ids)
+            self._conn.executemany(
+                "INSERT INTO chunks (chunk_id, document_id, department, length) VALUES (?, ?, ?, ?)", chunk_rows
+            )
+            self._conn.executemany("INSERT INTO postings (term, chunk_id, tf) VALUES (?, ?, ?)", posting_rows)
+            self._conn.commit()
+
+    def _delete_ids(self, ids):
+        self._execute_in("DELETE FROM postings WHERE chunk_id IN ({marks})", ids)
+        self._execute_in("DELETE FROM chunks WHERE chunk_id IN ({marks})", ids)
+
+    def delete_ids(self, ids):
+        with self._lock:
+            self._delete_ids(ids)
+            self._conn.commit()
+
+    def delete_document(self, document_id):
+        with self._lock:
+            ids = [r[0] for r in self._conn.execute(
+                "SELECT chunk_id FROM chunks WHERE document_id=?", (str(document_id),)
+            )]
+            self._delete_ids(ids)
+            self._conn.commit()
+
+    def delete_department(self, department):
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM postings WHERE chunk_id IN (SELECT chunk_id FROM chunks WHERE department=?)",
+                (department or "",)
+            )
+            self._conn.execute("DELETE FROM chunks WHERE department=?", (department or "",))
+            self._conn.commit()
+
+    def locate(self, ids):
+        """
+        回傳 {chunk_id: department}，不在索引中的 chunk 不會出現在結果裡
+        """
+        with self._lock:
+            return dict(self._select_in("SELECT chunk_id, department FROM chunks WHERE chunk_id IN ({marks})", ids))
+
+    def document_department(self, document_id):
+        """
+        回傳文件所在的部門，索引中沒有這份文件時回傳 None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT department FROM chunks WHERE document_id=? LIMIT 1", (str(document_id),)
+            ).fetchone()
+        return row[0] if row else None
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM postings")
+            self._conn.execute("DELETE FROM chunks")
+            self._conn.commit()
+
+    def search(self, query, k=20, departments=None):
+        """
+        回傳 [(chunk_id, bm25_score), ...]，依分數由高到低；departments 可限制只搜尋特定部門
+        """
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        with self._lock:
+            n_docs, avg_len = self._conn.execute("SELECT COUNT(*), AVG(length) FROM chunks").fetchone()
+            if not n_docs:
+                return []
+            # df 只需掃描主鍵索引，不必 JOIN chunks
+            dfs = {
+                term: self._conn.execute("SELECT COUNT(*) FROM postings WHERE term=?", (term,)).fetchone()[0]
+                for term in terms
+            }
+        dfs = {term: df for term, df in dfs.items() if df}
+        if dfs and n_docs >= self.prune_min_docs:
+            rare = {term: df for term, df in dfs.items() if df <= self.max_df_ratio * n_docs}
+            # 查詢只有高頻詞時保留最少見的一個，仍能回傳結果
+            dfs = rare or dict([min(dfs.items(), key=lambda item: item[1])])
+
+        sql = (
+            "SELECT p.chunk_id, p.tf, c.length FROM postings p "
+            "JOIN chunks c ON c.chunk_id = p.chunk_id WHERE p.term=?"
+        )
+        allowed = sorted({d or "" for d in departments}) if departments else None
+        if allowed is not None:
+            sql += f" AND c.department IN ({','.join('?' * len(allowed))})"
+
+        scores = Counter()
+        for term, df in dfs.items():
+            with self._lock:
+                rows = self._conn.execute(sql, [term, *(allowed or [])]).fetchall()
+            # idf 以整個語料計算，部門過濾只影響候選集合
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            for chunk_id, tf, length in rows:
+                norm = self.k1 * (1 - self.b + self.b * length / avg_len)
+                scores[chunk_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores.most_common(k)
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """
+    RRF：score(d) = Σ 1 / (k + rank)，rankings 為多個依序排列的 id list
+    """
+    scores = Counter()
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, start=1):
+            scores[chunk_id] += 1.0 / (k + rank)
+    return scores.most_common()
@@ -0,0 +1,245 @@
+import fcntl
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+VECTORS_FILE = "vectors.f16"
+ALIVE_FILE = "alive.u8"
+ROWS_FILE = "rows.jsonl"
+HEADER_FILE = "header.json"
+LOCK_FILE = "index.lock"
+
+# 墓碑（已刪除的列）比例超過此值時自動壓縮
+COMPACT_RATIO = 0.2
+# 每次以 float32 計算的列數，限制暫存記憶體用量
+SCORE_BLOCK_ROWS = 65536
+
+
+class MmapVectorIndex:
+    """
+    以記憶體映射檔案存放的精確（暴力）向量檢索索引，作為 Chroma HNSW 之外的選擇
+    - vectors.f16：N x dim 的 float16 矩陣（已 L2 正規化），只在尾端追加
+    - alive.u8：每列一個 byte，0 表示已刪除（墓碑），刪除/更新時原地寫入
+    - rows.jsonl：每列一行 [chunk_id, document_id, department]
+    - header.json：{"dim", "count", "tombstones", "generation"}，以 os.replace 原子更新
+    寫入以 fcntl 檔案鎖互斥（跨 worker 行程）；讀取端以唯讀 mmap 共用檔案，
+    每次檢索前比對 header，有新增列或壓縮（generation 改變）時才重新映射
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.RLock()
+        self._generation = None
+        self._count = 0
+        self._dim = None
+        self._vectors = None
+        self._alive = None
+        self._ids = []
+        self._document_ids = []
+        self._departments = []
+        self._rows_offset = 0
+        self._row_of = {}
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    @contextmanager
+    def _file_lock(self, exclusive):
+        with open(self._path(LOCK_FILE), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_header(self):
+        try:
+            with open(self._path(HEADER_FILE), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"dim": None, "count": 0, "tombstones": 0, "generation": 0}
+
+    def _write_header(self, header):
+        tmp = self._path(HEADER_FILE + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(header, f)
+        os.replace(tmp, self._path(HEADER_FILE))
+
+    def _refresh(self, header=None):
+        """
+        依 header 更新本行程的映射與 id 陣列；只讀取新增的 rows.jsonl 行
+        """
+        header = header or self._read_header()
+        if header["generation"] != self._generation:
+            self._ids, self._document_ids, self._departments = [], [], []
+            self._rows_offset = 0
+            self._row_of = {}
+            self._generation = header["generation"]
+            self._count = 0
+            self._vectors = None
+        if header["count"] == self._count and self._vectors is not None:
+            return header
+
+        self._dim = header["dim"]
+        count = header["count"]
+        if count and self._dim:
+            self._vectors = np.memmap(self._path(VECTORS_FILE), dtype=np.float16, mode="r", shape=(count, self._dim))
+            self._alive = np.memmap(self._path(ALIVE_FILE), dtype=np.uint8, mode="r", shape=(count,))
+            with open(self._path(ROWS_FILE), encoding="utf-8") as f:
+                f.seek(self._rows_offset)
+                for _ in range(count - len(self._ids)):
+                    chunk_id, document_id, department = json.loads(f.readline())
+                    self._row_of[chunk_id] = len(self._ids)
+                    self._ids.append(chunk_id)
+                    self._document_ids.append(document_id)
+                    self._departments.append(department)
+                self._rows_offset = f.tell()
+        else:
+            self._vectors = np.zeros((0, self._dim or 0), dtype=np.float16)
+            self._alive = np.zeros((0,), dtype=np.uint8)
+        self._count = count
+        return header
+
+    def refresh(self):
+        with self._lock, self._file_lock(exclusive=False):
+            return self._refresh()
+
+    def count(self):
+        """
+        目前有效（未刪除）的列數
+        """
+        header = self.refresh()
+        return header["count"] - header["tombstones"]
+
+    def add(self, ids, embeddings, document_ids, departments=None):
+        """
+        追加向量；已存在的 chunk_id（更新內容）先標記舊列為墓碑
+        """
+        if not ids:
+            return
+        # 不可原地正規化：呼叫端傳入 float32 ndarray 時 asarray 不會複製
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        matrix = matrix / np.clip(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12, None)
+        departments = departments or [""] * len(ids)
+        with self._lock, self._file_lock(exclusive=True):
+            header = self._refresh()
+            if header["dim"] is None:
+                header["dim"] = matrix.shape[1]
+            elif header["dim"] != matrix.shape[1]:
+                raise ValueError(f"向量維度不符：索引為 {header['dim']}，寫入為 {matrix.shape[1]}")
+            header["tombstones"] += self._tombstone([self._row_of[i] for i in ids if i in self._row_of])
+
+            with open(self._path(VECTORS_FILE), "ab") as f:
+                f.write(matrix.astype(np.float16).tobytes())
+            with open(self._path(ALIVE_FILE), "ab") as f:
+                f.write(np.ones(len(ids), dtype=np.uint8).tobytes())
+            with open(self._path(ROWS_FILE), "a", encoding="utf-8") as f:
+                for chunk_id, document_id, department in zip(ids, document_ids, departments):
+                    f.write(json.dumps([chunk_id, str(document_id), department or ""], ensure_ascii=False) + "\n")
+            header["count"] += len(ids)
+            self._write_header(header)
+            self._refresh(header)
+
+    def _tombstone(self, rows):
+        rows = [r for r in rows if self._alive[r]]
+        if rows:
+            alive = np.memmap(self._path(ALIVE_FILE), dtype=np.uint8, mode="r+", shape=(self._count,))
+            alive[rows] = 0
+            alive.flush()
+        return len(rows)
+
+    def _delete_rows(self, select):
+        with self._lock, self._file_lock(exclusive=True):
+            header = self._refresh()
+            removed = self._tombstone(select())
+            if removed:
+                header["tombstones"] += removed
+                self._write_header(header)
+        if removed and header["tombstones"] > COMPACT_RATIO * header["count"]:
+            self.compact()
+        return removed
+
+    def delete_ids(self, ids):
+        return self._delete_rows(lambda: [self._row_of[i] for i in ids if i in self._row_of])
+
+    def delete_document(self, document_id):
+        document_id = str(document_id)
+        return self._delete_rows(lambda: [r for r, d in enumerate(self._document_ids) if d == document_id])
+
+    def delete_department(self, department):
+        department = department or ""
+        return self._delete_rows(lambda: [r for r, d in enumerate(self._departments) if d == department])
+
+    def compact(self):
+        """
+        移除墓碑列，重寫所有檔案並遞增 generation；其他行程下次檢索時會重新映射
+        """
+        with self._lock, self._file_lock(exclusive=True):
+            header = self._refresh()
+            keep = np.flatnonzero(np.asarray(self._alive, dtype=bool))
+            for name, data in (
+                (VECTORS_FILE, np.asarray(self._vectors[keep]).tobytes()),
+                (ALIVE_FILE, np.ones(len(keep), dtype=np.uint8).tobytes()),
+            ):
+                with open(self._path(name + ".tmp"), "wb") as f:
+                    f.write(data)
+                os.replace(self._path(name + ".tmp"), self._path(name))
+            with open(self._path(ROWS_FILE + ".tmp"), "w", encoding="utf-8") as f:
+                for r in keep:
+                    f.write(json.dumps(
+                        [self._ids[r], self._document_ids[r], self._departments[r]], ensure_ascii=False
+                    ) + "\n")
+            os.replace(self._path(ROWS_FILE + ".tmp"), self._path(ROWS_FILE))
+            removed = header["count"] - len(keep)
+            header.update({"count": len(keep), "tombstones": 0, "generation": header["generation"] + 1})
+            self._write_header(header)
+            self._refresh(header)
+        print(f"🧹 向量索引已壓縮，移除 {removed} 筆已刪除的向量，剩餘 {len(keep)} 筆")
+        return removed
+
+    def clear(self):
+        with self._lock, self._file_lock(exclusive=True):
+            header = self._read_header()
+            for name in (VECTORS_FILE, ALIVE_FILE, ROWS_FILE):
+                open(self._path(name), "wb").close()
+            self._write_header({"dim": None, "count": 0, "tombstones": 0, "generation": header["generation"] + 1})
+            self._refresh()
+
+    def _mask(self, departments=None):
+        mask = np.asarray(self._alive, dtype=bool)
+        if departments:
+            allowed = {d or "" for d in departments}
+            mask = mask & np.fromiter((d in allowed for d in self._departments), dtype=bool, count=self._count)
+        return mask
+
+    def search(self, query_embedding, k=20, departments=None, include_vectors=False):
+        """
+        精確 top-k（cosine），回傳 [(chunk_id, similarity, vector), ...]
+        include_vectors 為 True 時一併回傳 float32 向量（供 MMR 使用，不需再向 Chroma 取 embedding），否則為 None
+        """
+        with self._lock:
+            self.refresh()
+            if not self._count:
+                return []
+            vectors, mask = self._vectors, self._mask(departments)
+            ids = list(self._ids)
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+
+        scores = np.empty(len(mask), dtype=np.float32)
+        for start in range(0, len(mask), SCORE_BLOCK_ROWS):
+            block = np.asarray(vectors[start:start + SCORE_BLOCK_ROWS], dtype=np.float32)
+            scores[start:start + len(block)] = block @ query
+        scores[~mask] = -np.inf
+
+        k = min(k, int(mask.sum()))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        vectors = np.asarray(vectors[top], dtype=np.float32) if include_vectors else [None] * len(top)
+        return [(ids[r], float(scores[r]), vector) for r, vector in zip(top, vectors)]
@@ -0,0 +1,287 @@
+import os
+import threading
+
+import chromadb
+from langchain_chroma import Chroma
+from langchain_core.embeddings import Embeddings
+from langchain_huggingface import HuggingFaceEmbeddings
+
+from .answer_cache import (DEFAULT_MAX_ENTRIES as DEFAULT_ANSWER_CACHE_MAX_ENTRIES,
+                           DEFAULT_THRESHOLD, DEFAULT_TTL_SECONDS, SemanticAnswerCache)
+from .docstore import SqliteDocStore
+from .embedding_cache import (DEFAULT_CACHE_PATH, DEFAULT_MAX_ENTRIES, DEFAULT_QUERY_LRU_SIZE,
+                              CachedEmbeddings, LruQueryEmbeddings)
+from .lexical_index import LexicalIndex
+from .mmap_index import MmapVectorIndex
+from .onnx_embeddings import DEFAULT_ONNX_MODEL_DIR, OnnxEmbeddings
+from .reranker import DEFAULT_RERANKER_MODEL, CrossEncoderReranker
+from .retrieval_cache import (DEFAULT_MAX_ENTRIES as DEFAULT_RETRIEVAL_CACHE_MAX_ENTRIES,
+                              DEFAULT_RETRIEVAL_CACHE_NAME, RetrievalCache)
+
+DEFAULT_DB_PATH = "chroma_user_db"
+DEFAULT_EMBED_MODEL = "BAAI/bge-m3"
+DEFAULT_COLLECTION = "langchain"  # langchain_chroma 預設的 collection 名稱
+
+# embedding 後端："hf"（PyTorch，HuggingFaceEmbeddings）或 "onnx"（onnxruntime int8 量化模型）
+EMBED_BACKEND = os.environ.get("EMBED_BACKEND", "hf")
+ONNX_MODEL_DIR = os.environ.get("ONNX_MODEL_DIR", DEFAULT_ONNX_MODEL_DIR)
+
+# 向量檢索引擎："chroma"（HNSW）或 "mmap"（記憶體映射 float16 矩陣的精確檢索，需先 rebuild_mmap_index）
+VECTOR_SEARCH_ENGINE = os.environ.get("VECTOR_SEARCH_ENGINE", "chroma")
+
+# embedding 快取設定，EMBEDDING_CACHE=0 可停用
+EMBEDDING_CACHE_ENABLED = os.environ.get("EMBEDDING_CACHE", "1") == "1"
+EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH", DEFAULT_CACHE_PATH)
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES))
+# 行程內查詢向量 LRU 的大小，0 可停用
+QUERY_EMBEDDING_LRU_SIZE = int(os.environ.get("QUERY_EMBEDDING_LRU_SIZE", DEFAULT_QUERY_LRU_SIZE))
+
+# 語意回答快取設定，ANSWER_CACHE=0 可停用
+ANSWER_CACHE_ENABLED = os.environ.get("ANSWER_CACHE", "1") == "1"
+ANSWER_CACHE_THRESHOLD = float(os.environ.get("ANSWER_CACHE_THRESHOLD", DEFAULT_THRESHOLD))
+ANSWER_CACHE_TTL_SECONDS = float(os.environ.get("ANSWER_CACHE_TTL_SECONDS", DEFAULT_TTL_SECONDS))
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", DEFAULT_ANSWER_CACHE_MAX_ENTRIES))
+
+# 檢索結果快取設定，RETRIEVAL_CACHE=0 可停用
+RETRIEVAL_CACHE_ENABLED = os.environ.get("RETRIEVAL_CACHE", "1") == "1"
+RETRIEVAL_CACHE_MAX_ENTRIES = int(os.environ.get("RETRIEVAL_CACHE_MAX_ENTRIES", DEFAULT_RETRIEVAL_CACHE_MAX_ENTRIES))
+
+# cross-encoder 重排序模型
+RERANKER_MODEL = os.environ.get("RERANKER_MODEL", DEFAULT_RERANKER_MODEL)
+
+
+class LockedEmbeddings(Embeddings):
+    """
+    共用 embedding 模型的包裝，同一時間只允許一個執行緒做 forward
+    （torch 本身已多執行緒運算，序列化不會損失吞吐，但可避免同時載入/推論造成記憶體暴增）
+    """
+
+    def __init__(self, embedder, model_name):
+        self.embedder = embedder
+        self.model_name = model_name
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        with self._lock:
+            return self.embedder.embed_documents(texts)
+
+    def embed_query(self, text):
+        with self._lock:
+            return self.embedder.embed_query(text)
+
+
+class ModelRegistry:
+    """
+    行程內共用的模型與 Chroma client 註冊表
+    - embedder 以 (embed_model, backend) 為 key，只載入一次，並包上持久化 embedding 快取
+    - 每個 db_path 只開啟一個 Chroma PersistentClient
+    - Chroma collection 以 (db_path, embed_model, backend, collection_name) 為 key，只開啟一次
+    皆為 lazy 初始化，並以 lock 確保多執行緒下不會重複載入
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._embedders = {}
+        self._clients = {}
+        self._vectorstores = {}
+        self._lexical_indexes = {}
+        self._docstores = {}
+        self._answer_caches = {}
+        self._retrieval_caches = {}
+        self._rerankers = {}
+        self._mmap_indexes = {}
+
+    def _load_embedder(self, embed_model, backend):
+        if backend == "onnx":
+            return OnnxEmbeddings(model_dir=ONNX_MODEL_DIR)
+        if backend == "hf":
+            return HuggingFaceEmbeddings(
+                model_name=embed_model,
+                model_kwargs={"device": "cpu"}  # 強制使用 CPU
+            )
+        raise ValueError(f"不支援的 embedding 後端：{backend}")
+
+    def get_embedder(self, embed_model=DEFAULT_EMBED_MODEL, backend=None):
+        key = (embed_model, backend or EMBED_BACKEND)
+        embedder = self._embedders.get(key)
+        if embedder is not None:
+            return embedder
+        with self._lock:
+            if key not in self._embedders:
+                embed_model, backend = key
+                print(f"⏳ 載入 embedding 模型：{embed_model}（{backend}）")
+                # 不同後端的向量略有差異，快取 key 需區分後端
+                cache_name = embed_model if backend == "hf" else f"{embed_model}@{backend}"
+                embedder = LockedEmbeddings(self._load_embedder(embed_model, backend), cache_name)
+                if EMBEDDING_CACHE_ENABLED:
+                    embedder = CachedEmbeddings(
+                        embedder, cache_name,
+                        path=EMBEDDING_CACHE_PATH,
+                        max_entries=EMBEDDING_CACHE_MAX_ENTRIES
+                    )
+                # 最外層：查詢向量 LRU，檢索、重排序前的候選、回答快取共用同一份
+                if QUERY_EMBEDDING_LRU_SIZE > 0:
+                    embedder = LruQueryEmbeddings(embedder, QUERY_EMBEDDING_LRU_SIZE)
+                self._embedders[key] = embedder
+            return self._embedders[key]
+
+    def get_reranker(self, model_name=None):
+        model_name = model_name or RERANKER_MODEL
+        reranker = self._rerankers.get(model_name)
+        if reranker is not None:
+            return reranker
+        with self._lock:
+            if model_name not in self._rerankers:
+                print(f"⏳ 載入重排序模型：{model_name}")
+                self._rerankers[model_name] = CrossEncoderReranker(model_name)
+            return self._rerankers[model_name]
+
+    def get_client(self, db_path=DEFAULT_DB_PATH):
+        client = self._clients.get(db_path)
+        if client is not None:
+            return client
+        with self._lock:
+            if db_path not in self._clients:
+                self._clients[db_path] = chromadb.PersistentClient(path=db_path)
+            return self._clients[db_path]
+
+    def get_vectorstore(self, db_path=DEFAULT_DB_PATH, embed_model=DEFAULT_EMBED_MODEL, backend=None,
+                        collection_name=DEFAULT_COLLECTION, collection_metadata=None):
+        key = (db_path, embed_model, backend or EMBED_BACKEND, collection_name)
+        vectorstore = self._vectorstores.get(key)
+        if vectorstore is not None:
+            return vectorstore
+        with self._lock:
+            if key not in self._vectorstores:
+                embedder = self.get_embedder(embed_model, backend)
+                self._vectorstores[key] = Chroma(
+                    client=self.get_client(db_path),
+                    collection_name=collection_name,
+                    collection_metadata=collection_metadata,
+                    embedding_function=embedder
+                )
+                print(f"✅ 已開啟向量庫：{db_path}/{collection_name}（{embed_model}）")
+            return self._vectorstores[key]
+
+    def drop_collection(self, db_path, collection_name):
+        """
+        刪除整個 collection 並移除已開啟的 handle
+        """
+        with self._lock:
+            self.get_client(db_path).delete_collection(collection_name)
+            for key in [k for k in self._vectorstores if k[0] == db_path and k[3] == collection_name]:
+                del self._vectorstores[key]
+
+    def get_lexical_index(self, db_path=DEFAULT_DB_PATH):
+        """
+        BM25 倒排索引與 Chroma 放在同一個資料夾下
+        """
+        index = self._lexical_indexes.get(db_path)
+        if index is not None:
+            return index
+        with self._lock:
+            if db_path not in self._lexical_indexes:
+                self._lexical_indexes[db_path] = LexicalIndex(os.path.join(db_path, "lexical_index.sqlite3"))
+            return self._lexical_indexes[db_path]
+
+    def get_mmap_index(self, db_path=DEFAULT_DB_PATH):
+        """
+        VECTOR_SEARCH_ENGINE=mmap 時回傳精確檢索索引，否則回傳 None
+        """
+        if VECTOR_SEARCH_ENGINE != "mmap":
+            return None
+        index = self._mmap_indexes.get(db_path)
+        if index is not None:
+            return index
+        with self._lock:
+            if db_path not in self._mmap_indexes:
+                self._mmap_indexes[db_path] = MmapVectorIndex(os.path.join(db_path, "mmap_index"))
+            return self._mmap_indexes[db_path]
+
+    def get_docstore(self, db_path=DEFAULT_DB_PATH):
+        """
+        多向量檢索的原始內容 docstore，與 Chroma 放在同一個資料夾下
+        """
+        docstore = self._docstores.get(db_path)
+        if docstore is not None:
+            return docstore
+        with self._lock:
+            if db_path not in self._docstores:
+                self._docstores[db_path] = SqliteDocStore(os.path.join(db_path, "docstore.sqlite3"))
+            return self._docstores[db_path]
+
+    def get_answer_cache(self, db_path=DEFAULT_DB_PATH):
+        """
+        語意回答快取，停用時回傳 None
+        """
+        if not ANSWER_CACHE_ENABLED:
+            return None
+        cache = self._answer_caches.get(db_path)
+        if cache is not None:
+            return cache
+        with self._lock:
+            if db_path not in self._answer_caches:
+                self._answer_caches[db_path] = SemanticAnswerCache(
+                    os.path.join(db_path, "answer_cache.sqlite3"),
+                    threshold=ANSWER_CACHE_THRESHOLD,
+                    ttl_seconds=ANSWER_CACHE_TTL_SECONDS,
+                    max_entries=ANSWER_CACHE_MAX_ENTRIES
+                )
+            return self._answer_caches[db_path]
+
+    def get_retrieval_cache(self, db_path=DEFAULT_DB_PATH, name=DEFAULT_RETRIEVAL_CACHE_NAME):
+        """
+        檢索結果快取，停用時回傳 None；不同向量庫（不同 embedding 模型）以 name 區分
+        """
+        if not RETRIEVAL_CACHE_ENABLED:
+            return None
+        key = (db_path, name)
+        cache = self._retrieval_caches.get(key)
+        if cache is not None:
+            return cache
+        with self._lock:
+            if key not in self._retrieval_caches:
+                self._retrieval_caches[key] = RetrievalCache(
+                    os.path.join(db_path, f"{name}.sqlite3"), max_entries=RETRIEVAL_CACHE_MAX_ENTRIES
+                )
+            return self._retrieval_caches[key]
+
+    def cache_stats(self):
+        """
+        各 embedding 快取層的命中統計，key 為 "模型@後端"
+        """
+        stats = {}
+        for (embed_model, backend), embedder in list(self._embedders.items()):
+            layers = {}
+            while embedder is not None:
+                if isinstance(embedder, LruQueryEmbeddings):
+                    layers["query_lru"] = embedder.stats()
+                elif isinstance(embedder, CachedEmbeddings):
+                    layers["embedding_cache"] = embedder.stats()
+                embedder = getattr(embedder, "embedder", None)
+            stats[f"{embed_model}@{backend}"] = layers
+        return stats
+
+    def warm_up(self, db_path=DEFAULT_DB_PATH, embed_model=DEFAULT_EMBED_MODEL, backend=None):
+        """
+        於 worker 啟動時預先載入模型並跑一次 embedding，避免第一個請求承擔載入時間
+        """
+        vectorstore = self.get_vectorstore(db_path, embed_model, backend)
+        vectorstore.embeddings.embed_query("warm up")
+        print(f"🔥 已預熱向量庫：{db_path}（{embed_model}）")
+        return vectorstore
+
+    def clear(self):
+        with self._lock:
+            self._vectorstores.clear()
+            self._lexical_indexes.clear()
+            self._docstores.clear()
+            self._answer_caches.clear()
+            self._retrieval_caches.clear()
+            self._clients.clear()
+            self._embedders.clear()
+            self._rerankers.clear()
+            self._mmap_indexes.clear()
+
+
+registry = ModelRegistry()
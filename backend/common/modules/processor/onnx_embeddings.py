@@ -0,0 +1,84 @@
+import os
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+DEFAULT_ONNX_MODEL_DIR = "onnx_models/bge-m3-int8"
+QUANTIZED_MODEL_FILE = "model_quantized.onnx"
+
+
+def export_onnx_model(model_name="BAAI/bge-m3", output_dir=DEFAULT_ONNX_MODEL_DIR, quantize=True):
+    """
+    以 optimum 將 HuggingFace 模型匯出為 ONNX，並做動態 int8 量化（僅權重，不需校正資料）
+    匯出後的資料夾包含 tokenizer 與 model_quantized.onnx，可直接給 OnnxEmbeddings 使用
+    """
+    from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoTokenizer
+
+    os.makedirs(output_dir, exist_ok=True)
+    model = ORTModelForFeatureExtraction.from_pretrained(model_name, export=True)
+    model.save_pretrained(output_dir)
+    AutoTokenizer.from_pretrained(model_name).save_pretrained(output_dir)
+    print(f"✅ ONNX 模型已匯出：{output_dir}")
+
+    if quantize:
+        quantizer = ORTQuantizer.from_pretrained(output_dir)
+        qconfig = AutoQuantizationConfig.avx2(is_static=False, per_channel=True)
+        quantizer.quantize(save_dir=output_dir, quantization_config=qconfig)
+        print(f"✅ int8 量化完成：{os.path.join(output_dir, QUANTIZED_MODEL_FILE)}")
+    return output_dir
+
+
+class OnnxEmbeddings(Embeddings):
+    """
+    以 onnxruntime (CPU) 執行匯出後的 bge-m3
+    - 依 token 長度排序後分批，每批只 padding 到該批最長的長度（dynamic-length batching）
+    - 取 [CLS] 向量並做 L2 正規化，與 sentence-transformers 版本的 bge-m3 dense 向量一致
+    """
+
+    def __init__(self, model_dir=DEFAULT_ONNX_MODEL_DIR, model_file=QUANTIZED_MODEL_FILE,
+                 batch_size=32, max_length=512, intra_op_num_threads=None):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        self.model_dir = model_dir
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_num_threads:
+            options.intra_op_num_threads = intra_op_num_threads
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, model_file), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def _encode_batch(self, texts):
+        encoded = self.tokenizer(
+            texts, padding="longest", truncation=True, max_length=self.max_length, return_tensors="np"
+        )
+        inputs = {k: v.astype(np.int64) for k, v in encoded.items() if k in self.input_names}
+        last_hidden_state = self.session.run(None, inputs)[0]
+        cls = last_hidden_state[:, 0]
+        norms = np.linalg.norm(cls, axis=1, keepdims=True)
+        return cls / np.clip(norms, 1e-12, None)
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        # 先依長度排序，讓同一批的序列長度相近，減少 padding 的無效運算
+        lengths = [len(ids) for ids in self.tokenizer(texts, truncation=True, max_length=self.max_length)["input_ids"]]
+        order = np.argsort(lengths)
+        vectors = [None] * len(texts)
+        for start in range(0, len(texts), self.batch_size):
+            batch_idx = order[start:start + self.batch_size]
+            batch_vectors = self._encode_batch([texts[i] for i in batch_idx])
+            for i, vector in zip(batch_idx, batch_vectors):
+                vectors[i] = vector.tolist()
+        return vectors
+
+    def embed_query(self, text):
+        return self._encode_batch([text])[0].tolist()
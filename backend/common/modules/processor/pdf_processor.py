@@ -8,7 +8,6 @@ from datetime import datetime
 import cv2
 import fitz  # PyMuPDF
 import numpy as np
-import ollama
 import pdfplumber
 import torch
 from easyocr import Reader
@@ -16,13 +15,18 @@ from pdf2image import convert_from_path
 from PIL import Image, ImageDraw
 from transformers import AutoModelForObjectDetection, AutoProcessor
 
+from .summary_queue import SUMMARY_CONCURRENCY, SummaryQueue
+
+IMAGE_SUMMARY_SYSTEM_PROMPT = "你是一位針對圖片影像和表格影像進行提取內容的助手，請以敘述者的角度說明每張圖片中的資料或文本內容，例如數據、文字等，若是圖表也請說明其趨勢與關鍵數據"
+
 
 def log(msg):
     now = datetime.now().strftime("[%Y-%m-%d %H:%M:%S]")
     print(f"{now} {msg}")
 
 class PdfProcessor:
-    def __init__(self, pdf_path, output_dir="media/extract_data", model_name="gemma3:27b", knowledge_id=None, vectorstore=None,cid_threshold=20):
+    def __init__(self, pdf_path, output_dir="media/extract_data", model_name="gemma3:27b", knowledge_id=None, vectorstore=None,cid_threshold=20,
+                 summary_concurrency=SUMMARY_CONCURRENCY, use_summary_cache=True):
         self.pdf_path = pdf_path
         self.file_stem = os.path.splitext(os.path.basename(pdf_path))[0]
         self.output_dir = os.path.join(output_dir, self.file_stem)
@@ -33,6 +37,11 @@ class PdfProcessor:
         self.detector = AutoModelForObjectDetection.from_pretrained("microsoft/table-transformer-detection", revision="no_timm").to(self.device)
         self.processor = AutoProcessor.from_pretrained("microsoft/table-transformer-detection", revision="no_timm")
         self.cid_threshold = cid_threshold
+        # 摘要請求送入佇列併發處理，process() 結束前 join 回填結果；
+        # 圖片內容、prompt 與模型相同的摘要直接取自快取（use_summary_cache=False 可強制重新摘要）
+        self.use_summary_cache = use_summary_cache
+        self.summaries = SummaryQueue(model_name, IMAGE_SUMMARY_SYSTEM_PROMPT, summary_concurrency,
+                                      use_cache=use_summary_cache, call_site="pdf_processor.summary_queue")
         #self.vectorstore = vectorstore or VectorStoreHandler(db_path="chroma_user_db")
         self.log = log
         os.makedirs(self.output_dir, exist_ok=True)
@@ -55,23 +64,6 @@ class PdfProcessor:
             print(f"文字符合標準，使用pdfplumber")
             return False
 
-    def summarize_image(self, image_paths, prompt):
-        if isinstance(image_paths, str):
-            image_paths = [image_paths]
-        log("[解析圖片或整頁影像]")
-        system_prompt = "你是一位針對圖片影像和表格影像進行提取內容的助手，請以敘述者的角度說明每張圖片中的資料或文本內容，例如數據、文字等，若是圖表也請說明其趨勢與關鍵數據"
-        try:
-            response = ollama.chat(
-                model=self.model_name,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": prompt, "images": image_paths}
-                ]
-            )
-            return response['message']['content']
-        except Exception as e:
-            return f"❌ 圖像分析錯誤: {str(e)}"
-
     def detect_rotation_angle_easyocr(self, ocr_result, min_text_count=5, vertical_angle_range=(75, 105)):
         vertical_texts, short_texts, tall_boxes = 0, 0, 0
         total_texts = len(ocr_result)
@@ -201,14 +193,16 @@ class PdfProcessor:
                 f"以下是表格標題：{title}\n以下是 OCR 內容：\n{chr(10).join(texts)}\n"
                 f"請統整摘要如下：\n1. 表格主題\n2. 每個欄位的意義\n3. 數據趨勢與重點"
             )
-            summary = self.summarize_image(imgs, prompt)
-            log(f"📋 表格組 {group_index + 1} 摘要完成：{summary[:80]}...")
-            table_results.append({
-                "page": pages,
-                "source": imgs,
-                "title": title,
-                "content": f"表格標題: {title}\n[ocr]\n{chr(10).join(texts)}\n[llm摘要]\n{summary}"
-            })
+            entry = {"page": pages, "source": imgs, "title": title}
+
+            def fill(summary, entry=entry, texts=texts, group_index=group_index):
+                log(f"📋 表格組 {group_index + 1} 摘要完成：{summary[:80]}...")
+                title = entry["title"]
+                entry["summary"] = f"表格標題: {title}\n{summary}"  # 用於建立向量，完整內容存入 docstore
+                entry["content"] = f"表格標題: {title}\n[ocr]\n{chr(10).join(texts)}\n[llm摘要]\n{summary}"
+
+            self.summaries.add(imgs, prompt, fill)
+            table_results.append(entry)
         return table_results
 
     def extract_texts(self,page,i,page_images,text_results,split_index=0):
@@ -220,13 +214,14 @@ class PdfProcessor:
             ocr_result = self.reader.readtext(np.array(img))
             ocr_text = "\n".join([text for _, text, conf in ocr_result if conf > 0.5]) if ocr_result else ""
             prompt = f"以下圖片是一頁PDF文件的原始內容和擷取的文字如下:{ocr_text.strip()}，請直接敘述內容重點，條列其邏輯與段落，勿加入多餘引言或評論"
-            summary = self.summarize_image(path, prompt)
-            log(f"第 {i} 頁文字 OCR+LLM 摘要完成：[ocr]{ocr_text.strip()}\n[llm]{summary}")
-            text_results.append({
-                "page": i,
-                "source": "ocr+llm",
-                "content": f"[ocr]{ocr_text.strip()}\n[llm]{summary}"
-            })
+            entry = {"page": i, "source": "ocr+llm"}
+
+            def fill(summary, entry=entry, ocr_text=ocr_text.strip()):
+                log(f"第 {entry['page']} 頁文字 OCR+LLM 摘要完成：[ocr]{ocr_text}\n[llm]{summary}")
+                entry["content"] = f"[ocr]{ocr_text}\n[llm]{summary}"
+
+            self.summaries.add(path, prompt, fill)
+            text_results.append(entry)
         else:
             log(f"第 {i} 頁純文字處理完成：{text}...")
             text_results.append({
@@ -270,14 +265,14 @@ class PdfProcessor:
             # 如果 OCR 結果長度符合條件，繼續處理圖片摘要
             print(f"OCR 結果: {ocr_text}")
             prompt = "請描述圖片內容，若為圖表請指出類型、X/Y軸意義、趨勢與關鍵變化，若非圖表請描述主要構成與重要資訊"
-            summary = self.summarize_image(img_path, prompt)
-            log(f"🖼️ 第 {i} 頁圖片摘要完成：[ocr]{ocr_text}\n[llm]{summary[:80]}...")
+            entry = {"page": i, "source": img_path}
 
-            image_results.append({
-                "page": i,
-                "source": img_path,
-                "content": summary
-            })
+            def fill(summary, entry=entry, ocr_text=ocr_text):
+                log(f"🖼️ 第 {entry['page']} 頁圖片摘要完成：[ocr]{ocr_text}\n[llm]{summary[:80]}...")
+                entry["content"] = summary
+
+            self.summaries.add(img_path, prompt, fill)
+            image_results.append(entry)
 
         return image_results
 
@@ -320,6 +315,13 @@ class PdfProcessor:
     # 原先使用 table-transformer 的表格偵測流程，改為使用 pdfplumber 的 page.find_tables()
     # 並且僅在需要處理圖片摘要的情境下才使用 convert_from_path
     def process(self,split_index,pdf_split):
+        try:
+            return self._process(split_index, pdf_split)
+        finally:
+            # OCR / 表格偵測中途失敗時不會執行到 join()，在此停止摘要佇列的背景 event loop 並回收執行緒
+            self.summaries.close()
+
+    def _process(self,split_index,pdf_split):
         import time
         start_time = time.time()
         text_results, table_results, image_results = [], [], []
@@ -405,6 +407,12 @@ class PdfProcessor:
             
         pdf.close()
         doc.close()
+
+        # 等待佇列中的摘要完成並回填；表格頁先處理，結果依頁碼重新排序（sort 為穩定排序，同頁維持原順序）
+        self.summaries.join()
+        text_results.sort(key=lambda r: r["page"])
+        image_results.sort(key=lambda r: r["page"])
+        table_results.sort(key=lambda r: r["page"][0])
                     
         if rotated_pages:
             self.rotate_original_pdf(pdf_split, rotated_pages)
@@ -0,0 +1,36 @@
+import threading
+
+DEFAULT_RERANKER_MODEL = "BAAI/bge-reranker-base"
+
+
+class CrossEncoderReranker:
+    """
+    以 cross-encoder 對 (query, 文件) 重新評分
+    所有候選在同一次 predict 中批次計算（CPU 上一次 forward 比逐筆呼叫快得多）
+    模型不支援多執行緒同時推論，以 lock 序列化
+    """
+
+    def __init__(self, model_name=DEFAULT_RERANKER_MODEL, batch_size=32, max_length=512):
+        from sentence_transformers import CrossEncoder
+
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.model = CrossEncoder(model_name, max_length=max_length, device="cpu")
+        self._lock = threading.Lock()
+
+    def score(self, query, texts):
+        if not texts:
+            return []
+        with self._lock:
+            scores = self.model.predict(
+                [(query, text) for text in texts], batch_size=self.batch_size, show_progress_bar=False
+            )
+        return [float(s) for s in scores]
+
+    def rerank(self, query, documents, top_k=5):
+        """
+        documents 為 langchain Document list，回傳分數最高的 top_k 筆 [(document, score), ...]
+        """
+        scores = self.score(query, [d.page_content for d in documents])
+        ranked = sorted(zip(documents, scores), key=lambda pair: pair[1], reverse=True)
+        return ranked[:top_k]
@@ -0,0 +1,164 @@
+import hashlib
+import json
+import time
+
+from .embedding_cache import normalize_text
+from .sqlite_store import SqliteStore
+
+DEFAULT_RETRIEVAL_CACHE_NAME = "retrieval_cache"
+DEFAULT_MAX_ENTRIES = 20000
+
+
+class RetrievalCache(SqliteStore):
+    """
+    檢索結果快取：(正規化查詢, 過濾條件, k, fetch_k, search_type) -> chunk id 與分數
+    以版本號判斷是否過期，寫入時不需清空整個快取：
+    - versions(document_id, version)：文件的 chunk 被更新/刪除時遞增，快取項目記錄寫入當下引用文件的版本
+    - epoch：新增 chunk 時遞增（新內容可能出現在任何查詢的結果中），快取項目記錄寫入當下的 epoch
+    讀取時 epoch 與所有引用文件的版本都一致才算命中
+    註：更新/刪除未被引用的文件不會使項目過期，MMR 候選集合的細微變動因此可能晚一點才反映
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS meta (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS versions (
+            document_id TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS entries (
+            key TEXT PRIMARY KEY,
+            chunk_ids TEXT NOT NULL,
+            scores TEXT NOT NULL,
+            doc_versions TEXT NOT NULL,
+            epoch INTEGER NOT NULL,
+            last_used REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_entries_last_used ON entries(last_used);
+        INSERT OR IGNORE INTO meta (name, value) VALUES ('epoch', 0);
+    """
+
+    def __init__(self, path, max_entries=DEFAULT_MAX_ENTRIES):
+        super().__init__(path)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    @staticmethod
+    def make_key(query, k, fetch_k, search_type, departments=None, **filters):
+        raw = json.dumps(
+            [normalize_text(query), k, fetch_k, search_type, sorted(departments) if departments else None,
+             sorted(filters.items())],
+            ensure_ascii=False
+        )
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _epoch(self):
+        return self._conn.execute("SELECT value FROM meta WHERE name='epoch'").fetchone()[0]
+
+    def _versions(self, document_ids):
+        found = dict(self._select_in(
+            "SELECT document_id, version FROM versions WHERE document_id IN ({marks})", document_ids
+        ))
+        return {document_id: found.get(document_id, 0) for document_id in document_ids}
+
+    def epoch(self):
+        with self._lock:
+            return self._epoch()
+
+    def get(self, key):
+        """
+        命中時回傳 (chunk_ids, scores)，未命中或已過期回傳 None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT chunk_ids, scores, doc_versions, epoch FROM entries WHERE key=?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            chunk_ids, scores, doc_versions, epoch = row
+            doc_versions = json.loads(doc_versions)
+            if epoch != self._epoch() or self._versions(list(doc_versions)) != doc_versions:
+                self._conn.execute("DELETE FROM entries WHERE key=?", (key,))
+                self._conn.commit()
+                self.stale += 1
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE entries SET last_used=? WHERE key=?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(chunk_ids), json.loads(scores)
+
+    def put(self, key, chunk_ids, scores, document_ids, epoch=None):
+        """
+        epoch 為檢索開始前取得的 epoch，檢索期間若有新增 chunk 則不寫入
+        """
+        document_ids = sorted({str(d) for d in document_ids if d is not None})
+        with self._lock:
+            current_epoch = self._epoch()
+            if epoch is not None and epoch != current_epoch:
+                return
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, chunk_ids, scores, doc_versions, epoch, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, json.dumps(chunk_ids), json.dumps(scores), json.dumps(self._versions(document_ids)),
+                 current_epoch, time.time())
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        count = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM entries WHERE key IN "
+                "(SELECT key FROM entries ORDER BY last_used ASC LIMIT ?)", (overflow,)
+            )
+
+    def bump_documents(self, document_ids):
+        """
+        文件的 chunk 被更新或刪除時呼叫，使引用這些文件的快取項目過期
+        """
+        document_ids = {str(d) for d in document_ids if d is not None}
+        if not document_ids:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO versions (document_id, version) VALUES (?, 1) "
+                "ON CONFLICT(document_id) DO UPDATE SET version = version + 1",
+                [(d,) for d in document_ids]
+            )
+            self._conn.commit()
+
+    def bump_epoch(self):
+        """
+        新增 chunk 時呼叫，使所有快取項目過期
+        """
+        with self._lock:
+            self._conn.execute("UPDATE meta SET value = value + 1 WHERE name='epoch'")
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM entries")
+            self._conn.commit()
+
+    def stats(self):
+        total = self.hits + self.misses
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            epoch = self._epoch()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": size,
+            "max_entries": self.max_entries,
+            "epoch": epoch,
+        }
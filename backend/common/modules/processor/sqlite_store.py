@@ -0,0 +1,53 @@
+import os
+import sqlite3
+import threading
+
+# SQLite 參數上限為 999，IN (...) 查詢分段送出
+SQLITE_MAX_PARAMS = 900
+
+
+def in_chunks(items, size=SQLITE_MAX_PARAMS):
+    """
+    將 items 切成每段最多 size 個，回傳 (段落 list, "?,?,..." 佔位字串)
+    """
+    items = list(items)
+    for start in range(0, len(items), size):
+        part = items[start:start + size]
+        yield part, ",".join("?" * len(part))
+
+
+class SqliteStore:
+    """
+    持久化快取 / 索引共用的 SQLite 設定：建立所在目錄、開啟 WAL、整個行程共用一個連線（以 lock 保護）
+    子類別以 SCHEMA 建立資料表，需要調整舊版資料表時覆寫 _migrate
+    """
+
+    SCHEMA = ""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(self.SCHEMA)
+        self._migrate()
+        self._conn.commit()
+
+    def _migrate(self):
+        pass
+
+    def _select_in(self, sql, items):
+        """
+        sql 中的 {marks} 代換為佔位字串，分段查詢後合併所有列；呼叫端需持有 lock
+        """
+        rows = []
+        for part, marks in in_chunks(items):
+            rows.extend(self._conn.execute(sql.format(marks=marks), part).fetchall())
+        return rows
+
+    def _execute_in(self, sql, items):
+        """ 與 _select_in 相同的分段方式執行 DELETE / UPDATE；呼叫端需持有 lock 並自行 commit """
+        for part, marks in in_chunks(items):
+            self._conn.execute(sql.format(marks=marks), part)
@@ -0,0 +1,167 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from .sqlite_store import SqliteStore
+
+DEFAULT_SUMMARY_CACHE_PATH = "summary_cache.sqlite3"
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# LLM 摘要快取設定，SUMMARY_CACHE=0 可全域停用（個別呼叫也可傳 use_cache=False 略過）
+SUMMARY_CACHE_ENABLED = os.environ.get("SUMMARY_CACHE", "1") == "1"
+SUMMARY_CACHE_PATH = os.environ.get("SUMMARY_CACHE_PATH", DEFAULT_SUMMARY_CACHE_PATH)
+SUMMARY_CACHE_MAX_BYTES = int(float(os.environ.get("SUMMARY_CACHE_MAX_MB", "256")) * 1024 * 1024)
+
+
+def _sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def image_digest(image):
+    """
+    圖片內容的 hash；image 可為檔案路徑或 bytes
+    以內容而非路徑計算，重新解析同一份 PDF 時暫存圖檔路徑不同也能命中
+    """
+    if isinstance(image, (bytes, bytearray)):
+        return _sha256(image)
+    digest = hashlib.sha256()
+    with open(image, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def is_error_summary(summary):
+    # 各呼叫端失敗時回傳 "❌ ..." 字串，不可寫入快取
+    return not isinstance(summary, str) or summary.startswith("❌")
+
+
+class SummaryCache(SqliteStore):
+    """
+    LLM 摘要的持久化快取：(模型, system prompt, prompt hash, 各圖片內容 hash) -> 摘要
+    - 存放於 SQLite，重跑失敗的解析、重新上傳同一份文件時，內容未變的摘要不再呼叫 LLM
+    - 總大小超過 max_bytes 時依最後使用時間淘汰最舊的項目
+    - hits / misses 計數器可用於觀察快取效果
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS summaries (
+            key TEXT PRIMARY KEY,
+            model TEXT NOT NULL,
+            summary TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            last_used REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_summaries_last_used ON summaries(last_used);
+    """
+
+    def __init__(self, path=DEFAULT_SUMMARY_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES):
+        super().__init__(path)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model, prompt, system_prompt="", images=()):
+        """
+        images 依順序參與計算（多張表格圖片的順序不同，摘要也不同）
+        """
+        if isinstance(images, (str, bytes, bytearray)):
+            images = [images]
+        raw = json.dumps(
+            [model, system_prompt or "", _sha256(prompt.encode("utf-8")), [image_digest(i) for i in images]]
+        )
+        return _sha256(raw.encode("utf-8"))
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT summary FROM summaries WHERE key=?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE summaries SET last_used=? WHERE key=?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+        return row[0]
+
+    def put(self, key, model, summary):
+        if is_error_summary(summary):
+            return
+        size = len(summary.encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO summaries (key, model, summary, size, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, model, summary, size, time.time())
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        overflow = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM summaries").fetchone()[0] - self.max_bytes
+        if overflow <= 0:
+            return
+        stale = []
+        for key, size in self._conn.execute("SELECT key, size FROM summaries ORDER BY last_used ASC"):
+            stale.append((key,))
+            overflow -= size
+            if overflow <= 0:
+                break
+        self._conn.executemany("DELETE FROM summaries WHERE key=?", stale)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM summaries")
+            self._conn.commit()
+
+    def stats(self):
+        total = self.hits + self.misses
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM summaries").fetchone()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+        }
+
+
+_summary_cache = None
+_summary_cache_lock = threading.Lock()
+
+
+def get_summary_cache():
+    """
+    行程內共用的摘要快取，停用時回傳 None
+    """
+    global _summary_cache
+    if not SUMMARY_CACHE_ENABLED:
+        return None
+    with _summary_cache_lock:
+        if _summary_cache is None:
+            _summary_cache = SummaryCache(SUMMARY_CACHE_PATH, max_bytes=SUMMARY_CACHE_MAX_BYTES)
+        return _summary_cache
+
+
+def cached_summary(model, prompt, summarize, system_prompt="", images=(), use_cache=True):
+    """
+    先查快取，未命中才呼叫 summarize() 並寫入；use_cache=False 或全域停用時直接呼叫
+    圖片讀取失敗（例如檔案不存在）時同樣直接呼叫，由 summarize 自行處理錯誤
+    """
+    cache = get_summary_cache() if use_cache else None
+    if cache is None:
+        return summarize()
+    try:
+        key = SummaryCache.make_key(model, prompt, system_prompt, images)
+    except OSError as e:
+        print(f"⚠️ 無法計算摘要快取 key，略過快取：{e}")
+        return summarize()
+    summary = cache.get(key)
+    if summary is not None:
+        return summary
+    summary = summarize()
+    cache.put(key, model, summary)
+    return summary
@@ -0,0 +1,138 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+import ollama
+from common.modules.ai.llm_gateway import aollama_chat
+
+from .summary_cache import SummaryCache, get_summary_cache
+
+# 同時送往 Ollama 的摘要請求數；需搭配 Ollama 端的 OLLAMA_NUM_PARALLEL 才能真正平行推論，
+# 否則請求會在 Ollama 端排隊，但 OCR / 表格偵測仍可與 LLM 推論重疊
+SUMMARY_CONCURRENCY = int(os.environ.get("SUMMARY_CONCURRENCY", "4"))
+
+
+class SummaryQueue:
+    """
+    圖片 / 表格 / OCR 頁面的摘要工作佇列
+    - add()：立即在背景 event loop 以 ollama.AsyncClient 送出（同時最多 concurrency 個），
+      呼叫端可繼續做 OCR 與表格偵測，CPU 與 Ollama 同時工作
+    - join()：等待所有摘要完成，依加入順序呼叫各工作的 on_done(summary) 回填結果並回傳摘要 list
+    單一工作失敗時摘要為錯誤訊息字串（「❌ 圖像分析錯誤: ...」），不影響其他工作
+    use_cache=True 時先查 SummaryCache，命中的工作不送出請求，成功的摘要寫回快取
+    送出的請求經 llm_gateway 記錄，call_site 標示呼叫位置
+    """
+
+    def __init__(self, model_name, system_prompt, concurrency=SUMMARY_CONCURRENCY, host=None, use_cache=True,
+                 call_site="summary_queue"):
+        self.model_name = model_name
+        self.call_site = call_site
+        self.system_prompt = system_prompt
+        self.concurrency = max(1, concurrency)
+        self.host = host
+        self.cache = get_summary_cache() if use_cache else None
+        self.cache_hits = 0
+        self._jobs = []
+        self._loop = None
+        self._thread = None
+        self._client = None
+        self._semaphore = None
+        self._start = None
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def _ensure_loop(self):
+        if self._loop is not None:
+            return
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="summary-queue", daemon=True)
+        self._thread.start()
+        self._client = ollama.AsyncClient(host=self.host)
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._start = time.perf_counter()
+
+    def messages(self, image_paths, prompt):
+        return [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "user", "content": prompt, "images": image_paths}
+        ]
+
+    async def _summarize(self, image_paths, prompt, key=None):
+        async with self._semaphore:
+            try:
+                response = await aollama_chat(self.model_name, self.messages(image_paths, prompt), self.call_site,
+                                              client=self._client)
+                summary = response["message"]["content"]
+            except Exception as e:
+                return f"❌ 圖像分析錯誤: {str(e)}"
+        if key is not None:
+            self.cache.put(key, self.model_name, summary)
+        return summary
+
+    def _cache_key(self, image_paths, prompt):
+        if self.cache is None:
+            return None
+        try:
+            return SummaryCache.make_key(self.model_name, prompt, self.system_prompt, image_paths)
+        except OSError as e:
+            print(f"⚠️ 無法計算摘要快取 key，略過快取：{e}")
+            return None
+
+    def add(self, image_paths, prompt, on_done=None):
+        if isinstance(image_paths, str):
+            image_paths = [image_paths]
+        key = self._cache_key(image_paths, prompt)
+        summary = self.cache.get(key) if key is not None else None
+        if summary is not None:
+            future = Future()
+            future.set_result(summary)
+            self.cache_hits += 1
+        else:
+            self._ensure_loop()
+            future = asyncio.run_coroutine_threadsafe(self._summarize(image_paths, prompt, key), self._loop)
+        self._jobs.append((future, on_done))
+
+    def join(self):
+        jobs = self._jobs
+        if not jobs:
+            return []
+        try:
+            summaries = [future.result() for future, _ in jobs]
+            hits = self.cache_hits
+            elapsed = f"，自第一筆送出起用時 {time.perf_counter() - self._start:.2f} 秒" if self._start else ""
+            print(f"🧾 {len(jobs)} 筆摘要完成（快取命中 {hits} 筆，併發 {self.concurrency}）{elapsed}")
+        finally:
+            self.close()
+        # 在呼叫端執行緒依加入順序回填，結果 list 不需加鎖
+        for (_, on_done), summary in zip(jobs, summaries):
+            if on_done is not None:
+                on_done(summary)
+        return summaries
+
+    async def _shutdown(self):
+        # 取消尚未完成的摘要（呼叫端中途失敗時），再關閉 client 的連線
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if hasattr(self._client, "close"):  # 舊版 ollama 的 AsyncClient 沒有 close()
+            await self._client.close()
+
+    def close(self):
+        """
+        停止背景 event loop 並回收執行緒，未完成的工作一併取消；可重複呼叫，之後再 add() 會重新建立
+        """
+        self._jobs, self.cache_hits = [], 0
+        if self._loop is None:
+            return
+        loop, thread = self._loop, self._thread
+        try:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), loop).result()
+        finally:
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+            self._loop = self._thread = self._client = self._semaphore = self._start = None
@@ -1,22 +1,156 @@
+import hashlib
 import json
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 
+import numpy as np
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_chroma import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
+from langchain_chroma.vectorstores import maximal_marginal_relevance
+from langchain_core.documents import Document
+
+from .lexical_index import reciprocal_rank_fusion
+from .model_registry import (DEFAULT_COLLECTION, DEFAULT_DB_PATH,
+                             DEFAULT_EMBED_MODEL, registry)
+
+
+EMBED_BATCH_SIZE = 64      # 每次送入 embedding 模型的 chunk 數
+WRITE_BATCH_SIZE = 2048    # 每次寫入 Chroma 的 chunk 數（一個 transaction）
+CHUNK_SIZE = 512
+CHUNK_OVERLAP = 128        # 相鄰 chunk 重疊的字數，組 context 時據此去除重複文字
+
+# 多向量檢索：摘要向量的 metadata 以 doc_id 指向 docstore 中的原始內容
+DOC_ID_KEY = "doc_id"
+
+# 每個部門一個 collection；未指定部門的 chunk 留在預設 collection
+# 分片前寫入預設 collection 的舊資料以 reshard()（manage.py reshard_departments）搬到所屬部門
+SHARD_PREFIX = "dept_"
+_search_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="shard-search")
+
+
+def department_collection_name(department):
+    """
+    Chroma collection 名稱只允許英數與 ._-，部門名稱（多為中文）以 hash 轉換
+    """
+    if not department:
+        return DEFAULT_COLLECTION
+    return SHARD_PREFIX + hashlib.sha1(department.encode("utf-8")).hexdigest()[:16]
 
 
 class VectorStoreHandler:
-    def __init__(self, db_path="chroma_user_db", embed_model="BAAI/bge-m3"):
-        self.embedder = HuggingFaceEmbeddings(
-            model_name=embed_model,
-            model_kwargs={"device": "cpu"}  # 強制使用 CPU
+    def __init__(self, db_path=DEFAULT_DB_PATH, embed_model=DEFAULT_EMBED_MODEL, backend=None):
+        # embedding 模型、Chroma client 與各索引由 registry 共用，且在第一次使用時才載入 / 開啟：
+        # 建立 handler 不會載入模型或開啟任何檔案（migrate、check 等指令匯入 view 時不受影響）
+        # backend 為 None 時使用 EMBED_BACKEND 環境變數（"hf" 或 "onnx"）
+        self.db_path = db_path
+        self.embed_model = embed_model
+        self.backend = backend
+        self.splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+
+    @property
+    def embedder(self):
+        return registry.get_embedder(self.embed_model, self.backend)
+
+    @property
+    def vectorstore(self):
+        # 預設 collection（未指定部門）；各部門的 collection 由 shard() 取得
+        return self.shard(None)
+
+    @property
+    def lexical(self):
+        # BM25 倒排索引，由 add/update/delete 同步維護，用於 hybrid 檢索
+        return registry.get_lexical_index(self.db_path)
+
+    @property
+    def docstore(self):
+        # 摘要向量對應的原始內容（例如表格完整 OCR 文字），不另外產生 embedding
+        return registry.get_docstore(self.db_path)
+
+    @property
+    def retrieval_cache(self):
+        # 檢索結果快取（停用時為 None），寫入時以 epoch / 文件版本號使舊結果過期
+        return registry.get_retrieval_cache(self.db_path)
+
+    @property
+    def mmap_index(self):
+        # VECTOR_SEARCH_ENGINE=mmap 時的精確檢索索引（否則為 None），與 Chroma 同步寫入
+        return registry.get_mmap_index(self.db_path)
+
+    def shard(self, department=None):
+        return registry.get_vectorstore(
+            self.db_path, self.embed_model, self.backend,
+            collection_name=department_collection_name(department),
+            collection_metadata={"department": department} if department else None
         )
-        self.vectorstore = Chroma(persist_directory=db_path, embedding_function=self.embedder)
-        self.splitter = RecursiveCharacterTextSplitter(chunk_size=512, chunk_overlap=128)
 
-    def add(self, content, media_type, page, document_id, source):
-        if not content.strip():
+    def shards(self, departments=None):
+        """
+        departments 為空時回傳所有 collection（各部門 + 預設 collection）
+        """
+        if departments:
+            return [self.shard(d) for d in dict.fromkeys(departments)]
+        names = [c if isinstance(c, str) else c.name for c in registry.get_client(self.db_path).list_collections()]
+        names = [n for n in names if n == DEFAULT_COLLECTION or n.startswith(SHARD_PREFIX)]
+        return [
+            registry.get_vectorstore(self.db_path, self.embed_model, self.backend, collection_name=n)
+            for n in names
+        ] or [self.vectorstore]
+
+    def _locate_chunks(self, ids):
+        """
+        找出每個 chunk 所在的 collection，回傳 {chunk_id: shard}
+        先查 BM25 索引記錄的部門，索引中沒有的（舊資料）才逐一查詢各 collection
+        """
+        located = {chunk_id: self.shard(dept or None) for chunk_id, dept in self.lexical.locate(ids).items()}
+        missing = [chunk_id for chunk_id in ids if chunk_id not in located]
+        if missing:
+            for shard in self.shards():
+                found = shard._collection.get(ids=missing, include=[])["ids"]
+                located.update({chunk_id: shard for chunk_id in found})
+                missing = [chunk_id for chunk_id in missing if chunk_id not in located]
+                if not missing:
+                    break
+        return located
+
+    def _document_shard(self, document_id, department=None):
+        if department is not None:
+            return self.shard(department)
+        indexed = self.lexical.document_department(document_id)
+        if indexed is not None:
+            return self.shard(indexed or None)
+        for shard in self.shards():
+            if shard._collection.get(where={"document_id": document_id}, include=[], limit=1)["ids"]:
+                return shard
+        return self.vectorstore
+
+    def drop_department(self, department):
+        """
+        刪除整個部門：直接 drop 該部門的 collection
+        """
+        try:
+            registry.drop_collection(self.db_path, department_collection_name(department))
+            self.lexical.delete_department(department)
+            if self.mmap_index is not None:
+                self.mmap_index.delete_department(department)
+            self._invalidate(new_chunks=True)
+            print(f"🗑 已刪除部門 {department} 的向量資料")
+            return True
+        except Exception as e:
+            print(f"❌ 刪除部門失敗: {e}")
             return False
+
+    def _invalidate(self, document_ids=(), new_chunks=False):
+        """
+        使檢索快取中的舊結果過期：新增 chunk 時遞增 epoch，更新/刪除時遞增文件版本號
+        """
+        if self.retrieval_cache is None:
+            return
+        if new_chunks:
+            self.retrieval_cache.bump_epoch()
+        self.retrieval_cache.bump_documents(document_ids)
+
+    def _split(self, content, media_type, page, document_id, source):
         chunks = self.splitter.split_text(content)
         metadatas = [
             {
@@ -27,64 +161,288 @@ class VectorStoreHandler:
                 "chunk_index": i
             } for i in range(len(chunks))
         ]
-        self.vectorstore.add_texts(chunks, metadatas=metadatas)
+        return chunks, metadatas
+
+    def _write_chunks(self, chunks, metadatas, department=None,
+                      embed_batch_size=EMBED_BATCH_SIZE, write_batch_size=WRITE_BATCH_SIZE):
+        """
+        先分批計算 embedding，再以較大的批次寫入該部門的 collection，回傳新增的 chunk id
+        """
+        shard = self.shard(department)
+        ids = [str(uuid.uuid4()) for _ in chunks]
+        if department:
+            metadatas = [{**m, "department": department} for m in metadatas]
+        # Chroma 單次寫入有上限，避免超過 client 允許的最大批次
+        max_batch_size = getattr(shard._client, "get_max_batch_size", lambda: write_batch_size)()
+        write_batch_size = min(write_batch_size, max_batch_size)
+
+        for start in range(0, len(chunks), write_batch_size):
+            end = start + write_batch_size
+            batch_texts = chunks[start:end]
+            embeddings = []
+            for e_start in range(0, len(batch_texts), embed_batch_size):
+                embeddings.extend(self.embedder.embed_documents(batch_texts[e_start:e_start + embed_batch_size]))
+            shard._collection.add(
+                ids=ids[start:end],
+                embeddings=embeddings,
+                documents=batch_texts,
+                metadatas=metadatas[start:end]
+            )
+            self.lexical.add(
+                ids[start:end], batch_texts,
+                [m["document_id"] for m in metadatas[start:end]],
+                [department or ""] * len(batch_texts)
+            )
+            if self.mmap_index is not None:
+                self.mmap_index.add(
+                    ids[start:end], embeddings,
+                    [m["document_id"] for m in metadatas[start:end]],
+                    [department or ""] * len(batch_texts)
+                )
+        self._invalidate({m["document_id"] for m in metadatas}, new_chunks=True)
+        return ids
+
+    def add(self, content, media_type, page, document_id, source, department=None):
+        if not content.strip():
+            return False
+        chunks, metadatas = self._split(content, media_type, page, document_id, source)
+        self._write_chunks(chunks, metadatas, department)
         print(f"✅ 向量已儲存：{media_type} 第 {page} 頁，共 {len(chunks)} 段")
         return True
 
-    def list(self, document_id):
-        try:
-            result = self.vectorstore._collection.get(
-                where={"document_id": document_id},
-                include=["documents", "metadatas"]
+    def add_many(self, items, document_id, department=None,
+                 embed_batch_size=EMBED_BATCH_SIZE, write_batch_size=WRITE_BATCH_SIZE):
+        """
+        一次寫入多筆內容，items 為 [{"content", "media_type", "page", "source"}, ...]
+        所有內容會先全部切割，再分批 embedding 並以少數幾次大批次寫入 Chroma
+        回傳實際寫入的 chunk 數
+        """
+        start_time = time.perf_counter()
+        all_chunks, all_metadatas, payloads = [], [], []
+        for item in items:
+            content = item.get("content") or ""
+            if not content.strip():
+                continue
+            chunks, metadatas = self._split(
+                content, item["media_type"], item["page"], document_id, item["source"]
             )
-            return [
-                {
-                    "id": result["ids"][i],
-                    "content": result["documents"][i],
-                    "chunk_index": result["metadatas"][i].get("chunk_index", i),
-                    "page_number": json.loads(result["metadatas"][i].get("page_number", "1")),  # ✅ 轉回 list
-                    "media_type": result["metadatas"][i].get("media_type", "text"),
-                    "source": json.loads(result["metadatas"][i].get("source", "\"\""))  # ✅ 轉回 list
+            # 有 payload 時，content 為摘要（只對摘要做 embedding），原始內容存入 docstore
+            if item.get("payload"):
+                doc_id = str(uuid.uuid4())
+                payloads.append((doc_id, item["payload"]))
+                for meta in metadatas:
+                    meta[DOC_ID_KEY] = doc_id
+            all_chunks.extend(chunks)
+            all_metadatas.extend(metadatas)
+
+        if payloads:
+            self.docstore.mset(payloads, document_id=document_id)
+
+        if not all_chunks:
+            print(f"⚠️ document_id={document_id} 沒有可寫入的內容")
+            return 0
+
+        split_time = time.perf_counter()
+        self._write_chunks(all_chunks, all_metadatas, department, embed_batch_size, write_batch_size)
+        end_time = time.perf_counter()
+
+        elapsed = end_time - split_time
+        rate = len(all_chunks) / elapsed if elapsed > 0 else float("inf")
+        print(
+            f"✅ 批次向量已儲存：document_id={document_id}，共 {len(all_chunks)} 段，"
+            f"切割 {split_time - start_time:.2f}s，embedding+寫入 {elapsed:.2f}s（{rate:.1f} chunks/s）"
+        )
+        return len(all_chunks)
+
+    def ingest_result(self, result, document_id, department=None, **kwargs):
+        """
+        寫入 PdfProcessor.optimized_process() 的結果 {"text": [...], "table": [...], "image": [...]}
+        page 與 source 以 JSON list 字串存入 metadata（與 list() 的解析方式一致）
+        有 summary 的項目（表格）只對摘要建立向量，完整內容存入 docstore，檢索時回傳完整內容
+        """
+        items = []
+        for media_type in ["text", "table", "image"]:
+            for item in result.get(media_type, []):
+                summary = item.get("summary")
+                items.append({
+                    "content": summary or item["content"],
+                    "payload": item["content"] if summary else None,
+                    "media_type": media_type,
+                    "page": json.dumps(item["page"] if isinstance(item["page"], list) else [item["page"]]),
+                    "source": json.dumps(item["source"] if isinstance(item["source"], list) else [item["source"]])
+                })
+        return self.add_many(items, document_id, department=department, **kwargs)
+
+    @staticmethod
+    def _load_list_field(value, default):
+        # page_number / source 以 JSON list 字串存放，舊資料可能是單一值
+        if isinstance(value, str):
+            try:
+                value = json.loads(value)
+            except ValueError:
+                pass
+        if value is None:
+            return default
+        return value if isinstance(value, list) else [value]
+
+    def _position_key(self, meta):
+        pages = self._load_list_field(meta.get("page_number"), [0])
+        first_page = pages[0] if pages and isinstance(pages[0], int) else 0
+        return first_page, meta.get("chunk_index", 0)
+
+    def list(self, document_id, offset=0, limit=None, order_by_position=True, fields="full", preview_chars=200,
+             department=None):
+        """
+        列出文件的 chunks
+        - offset / limit：分頁
+        - order_by_position：依 (頁碼, chunk_index) 排序；排序只讀取 metadata，分頁後才讀取該頁內容
+        - fields："full" 完整內容、"preview" 只回傳前 preview_chars 個字、"metadata" 不回傳內容
+        - department：文件所在部門，未提供時自動查找
+        """
+        try:
+            collection = self._document_shard(document_id, department)._collection
+            include = ["metadatas"] if fields == "metadata" else ["documents", "metadatas"]
+
+            if order_by_position:
+                meta_result = collection.get(where={"document_id": document_id}, include=["metadatas"])
+                ordered = sorted(
+                    zip(meta_result["ids"], meta_result["metadatas"]),
+                    key=lambda pair: self._position_key(pair[1] or {})
+                )
+                page = ordered[offset:offset + limit if limit is not None else None]
+                ids = [chunk_id for chunk_id, _ in page]
+                if not ids:
+                    return []
+                if fields == "metadata":
+                    result = {"ids": ids, "metadatas": [meta for _, meta in page]}
+                else:
+                    fetched = collection.get(ids=ids, include=include)
+                    by_id = dict(zip(fetched["ids"], zip(fetched["documents"], fetched["metadatas"])))
+                    ids = [chunk_id for chunk_id in ids if chunk_id in by_id]
+                    result = {
+                        "ids": ids,
+                        "documents": [by_id[chunk_id][0] for chunk_id in ids],
+                        "metadatas": [by_id[chunk_id][1] for chunk_id in ids],
+                    }
+            else:
+                result = collection.get(
+                    where={"document_id": document_id}, include=include, limit=limit, offset=offset or None
+                )
+
+            chunks = []
+            for i, chunk_id in enumerate(result["ids"]):
+                meta = result["metadatas"][i] or {}
+                chunk = {
+                    "id": chunk_id,
+                    "chunk_index": meta.get("chunk_index", offset + i),
+                    "page_number": self._load_list_field(meta.get("page_number"), [1]),  # ✅ 轉回 list
+                    "media_type": meta.get("media_type", "text"),
+                    "source": self._load_list_field(meta.get("source"), [])  # ✅ 轉回 list
                 }
-                for i in range(len(result["documents"]))
-            ]
+                if fields == "full":
+                    chunk["content"] = result["documents"][i]
+                elif fields == "preview":
+                    chunk["content"] = result["documents"][i][:preview_chars]
+                chunks.append(chunk)
+            return chunks
         except Exception as e:
             print(f"❌ 查詢失敗: {e}")
             return []
 
     def delete(self, document_id):
         try:
-            self.vectorstore._collection.delete(where={"document_id": document_id})
+            # 文件可能曾被搬移部門，所有 collection 都刪除一次（各 collection 以 metadata 索引過濾，成本很低）
+            for shard in self.shards():
+                shard._collection.delete(where={"document_id": document_id})
+            self.lexical.delete_document(document_id)
+            self.docstore.delete_document(document_id)
+            if self.mmap_index is not None:
+                self.mmap_index.delete_document(document_id)
+            self._invalidate([document_id])
             print(f"🗑 已刪除 document_id={document_id} 的向量資料")
             return True
         except Exception as e:
             print(f"❌ 刪除失敗: {e}")
             return False
         
-    def update(self, chunk_id, new_content):
+    def upsert_chunk(self, chunk_id, new_content):
+        """
+        原地更新單一 chunk：保留 chunk_id 與 metadata，只對新內容做 embedding
+        回傳 {"id", "old_content", "metadata"}，找不到或失敗時回傳 None
+        """
         try:
-            meta = self.vectorstore._collection.get(
-                ids=[chunk_id], include=["metadatas"]
-            )["metadatas"][0]
-            self.vectorstore._collection.delete(ids=[chunk_id])
-            new_ids = self.vectorstore.add_texts([new_content], metadatas=[meta])
-            return new_ids[0] if new_ids else None  # ✅ 回傳新的 chunk_id
+            shard = self._locate_chunks([chunk_id]).get(chunk_id)
+            if shard is None:
+                return None
+            existing = shard._collection.get(ids=[chunk_id], include=["documents", "metadatas"])
+            old_content = existing["documents"][0]
+            meta = existing["metadatas"][0] or {}
+            if new_content != old_content:
+                embedding = self.embedder.embed_documents([new_content])[0]
+                shard._collection.update(
+                    ids=[chunk_id], embeddings=[embedding], documents=[new_content]
+                )
+                self.lexical.add([chunk_id], [new_content], [meta.get("document_id")], [meta.get("department", "")])
+                if self.mmap_index is not None:
+                    # 舊列標記為墓碑，新向量追加在尾端
+                    self.mmap_index.add(
+                        [chunk_id], [embedding], [meta.get("document_id")], [meta.get("department", "")]
+                    )
+                self._invalidate([meta.get("document_id")])
+            return {"id": chunk_id, "old_content": old_content, "metadata": meta}
         except Exception as e:
             print(f"❌ 更新失敗: {e}")
             return None
-        
-    def delete_chunk_by_id(self, chunk_id):
+
+    def update(self, chunk_id, new_content):
+        result = self.upsert_chunk(chunk_id, new_content)
+        return result["id"] if result else None  # ✅ chunk_id 不變
+
+    def delete_chunk(self, chunk_id):
+        """
+        刪除單一 chunk，回傳被刪除的 {"id", "content", "metadata"}，找不到或失敗時回傳 None
+        """
         try:
-            self.vectorstore._collection.delete(ids=[chunk_id])
+            shard = self._locate_chunks([chunk_id]).get(chunk_id)
+            if shard is None:
+                return None
+            existing = shard._collection.get(ids=[chunk_id], include=["documents", "metadatas"])
+            shard._collection.delete(ids=[chunk_id])
+            self.lexical.delete_ids([chunk_id])
+            if self.mmap_index is not None:
+                self.mmap_index.delete_ids([chunk_id])
+            self._invalidate([(existing["metadatas"][0] or {}).get("document_id")])
             print(f"🗑 已刪除 chunk_id={chunk_id} 的向量資料")
-            return True
+            return {"id": chunk_id, "content": existing["documents"][0], "metadata": existing["metadatas"][0] or {}}
         except Exception as e:
             print(f"❌ 刪除 chunk 失敗: {e}")
-            return False
-    
-    def get_chunks_by_document_id(self, document_id):
+            return None
+
+    def delete_chunk_by_id(self, chunk_id):
+        return self.delete_chunk(chunk_id) is not None
+
+    def first_chunk(self, document_id, department=None):
+        """
+        取得文件的第一個 chunk 內容（與 list() 的第一筆相同）：依 metadata 排序，只讀取該筆的內容
+        """
+        try:
+            collection = self._document_shard(document_id, department)._collection
+            meta_result = collection.get(where={"document_id": document_id}, include=["metadatas"])
+            if not meta_result["ids"]:
+                return ""
+            first_id, _ = min(
+                zip(meta_result["ids"], meta_result["metadatas"]),
+                key=lambda pair: self._position_key(pair[1] or {})
+            )
+            result = collection.get(ids=[first_id], include=["documents"])
+            return result["documents"][0] if result["documents"] else ""
+        except Exception as e:
+            print(f"❌ 查詢 chunk 發生錯誤: {e}")
+            return ""
+
+    def get_chunks_by_document_id(self, document_id, department=None):
         try:
-            result = self.vectorstore._collection.get(
+            result = self._document_shard(document_id, department)._collection.get(
                 where={"document_id": document_id},
                 include=["documents", "metadatas"]
             )
@@ -101,7 +459,10 @@ class VectorStoreHandler:
 
     def get_chunk_metadata_by_id(self, chunk_id):
         try:
-            result = self.vectorstore._collection.get(
+            shard = self._locate_chunks([chunk_id]).get(chunk_id)
+            if shard is None:
+                return None
+            result = shard._collection.get(
                 ids=[chunk_id],
                 include=["metadatas"]
             )
@@ -109,3 +470,292 @@ class VectorStoreHandler:
         except Exception as e:
             print(f"❌ 查詢 chunk metadata 失敗: {e}")
             return None
+
+    def rebuild_lexical_index(self, batch_size=1000):
+        """
+        由 Chroma 內現有的 chunk 重建 BM25 索引（用於啟用 hybrid 檢索前已存在的資料）
+        """
+        self.lexical.clear()
+        total = 0
+        for shard in self.shards():
+            department = (shard._collection.metadata or {}).get("department", "")
+            count = shard._collection.count()
+            for offset in range(0, count, batch_size):
+                result = shard._collection.get(
+                    include=["documents", "metadatas"], limit=batch_size, offset=offset
+                )
+                self.lexical.add(
+                    result["ids"], result["documents"],
+                    [(m or {}).get("document_id") for m in result["metadatas"]],
+                    [department] * len(result["ids"])
+                )
+            total += count
+        print(f"✅ 已重建 BM25 索引，共 {total} 段")
+        return total
+
+    def rebuild_mmap_index(self, batch_size=1000):
+        """
+        由 Chroma 內現有的向量重建精確檢索索引（啟用 VECTOR_SEARCH_ENGINE=mmap 前執行一次）
+        """
+        if self.mmap_index is None:
+            raise RuntimeError("VECTOR_SEARCH_ENGINE 不是 mmap")
+        self.mmap_index.clear()
+        total = 0
+        for shard in self.shards():
+            department = (shard._collection.metadata or {}).get("department", "")
+            count = shard._collection.count()
+            for offset in range(0, count, batch_size):
+                result = shard._collection.get(
+                    include=["embeddings", "metadatas"], limit=batch_size, offset=offset
+                )
+                self.mmap_index.add(
+                    result["ids"], result["embeddings"],
+                    [(m or {}).get("document_id") for m in result["metadatas"]],
+                    [department] * len(result["ids"])
+                )
+            total += count
+        print(f"✅ 已重建精確檢索索引，共 {total} 段")
+        return total
+
+    def reshard(self, departments_by_document, batch_size=1000):
+        """
+        將預設 collection 中的舊資料（分片前寫入）搬到所屬部門的 collection，沿用原本的 chunk id 與向量
+        - departments_by_document：{str(document_id): 部門}，對應不到部門的 chunk 留在預設 collection
+        - 先寫入部門 collection 再從預設 collection 刪除，中途失敗可直接重跑（upsert 不會重複）
+        回傳搬移的 chunk 數
+        """
+        source = self.vectorstore._collection
+        plan = {}
+        count = source.count()
+        for offset in range(0, count, batch_size):
+            result = source.get(include=["metadatas"], limit=batch_size, offset=offset)
+            for chunk_id, meta in zip(result["ids"], result["metadatas"]):
+                department = departments_by_document.get(str((meta or {}).get("document_id")))
+                if department:
+                    plan.setdefault(department, []).append(chunk_id)
+
+        moved = 0
+        document_ids = set()
+        for department, ids in plan.items():
+            target = self.shard(department)._collection
+            for start in range(0, len(ids), batch_size):
+                result = source.get(
+                    ids=ids[start:start + batch_size], include=["embeddings", "documents", "metadatas"]
+                )
+                metadatas = [{**(m or {}), "department": department} for m in result["metadatas"]]
+                doc_ids = [m.get("document_id") for m in metadatas]
+                target.upsert(
+                    ids=result["ids"], embeddings=result["embeddings"],
+                    documents=result["documents"], metadatas=metadatas
+                )
+                self.lexical.add(result["ids"], result["documents"], doc_ids, [department] * len(doc_ids))
+                if self.mmap_index is not None:
+                    self.mmap_index.add(result["ids"], result["embeddings"], doc_ids, [department] * len(doc_ids))
+                source.delete(ids=result["ids"])
+                moved += len(result["ids"])
+                document_ids.update(doc_ids)
+            print(f"📦 已將 {len(ids)} 段搬到部門 {department}")
+        if moved:
+            self._invalidate(document_ids, new_chunks=True)
+        print(f"✅ 分片搬移完成，共 {moved} 段，預設 collection 剩餘 {source.count()} 段")
+        return moved
+
+    def _fan_out(self, fn, shards):
+        # 多個部門時平行查詢各 collection
+        if len(shards) == 1:
+            return [fn(shards[0])]
+        return list(_search_pool.map(fn, shards))
+
+    def _dense_candidates(self, embedding, fetch_k, departments=None, include_embeddings=False):
+        """
+        在各部門 collection 中各取 fetch_k 筆，合併後依距離取整體前 fetch_k 筆
+        """
+        if self.mmap_index is not None and self.mmap_index.count() > 0:
+            return self._mmap_candidates(embedding, fetch_k, departments, include_embeddings)
+
+        include = ["documents", "metadatas", "distances"] + (["embeddings"] if include_embeddings else [])
+
+        def query(shard):
+            count = shard._collection.count()
+            if count == 0:
+                return []
+            result = shard._collection.query(
+                query_embeddings=[embedding], n_results=min(fetch_k, count), include=include
+            )
+            return [
+                {
+                    "id": result["ids"][0][i],
+                    "content": result["documents"][0][i],
+                    "metadata": result["metadatas"][0][i] or {},
+                    "distance": result["distances"][0][i],
+                    "embedding": result["embeddings"][0][i] if include_embeddings else None,
+                }
+                for i in range(len(result["ids"][0]))
+            ]
+
+        merged = [c for shard_result in self._fan_out(query, self.shards(departments)) for c in shard_result]
+        merged.sort(key=lambda c: c["distance"])
+        return merged[:fetch_k]
+
+    def _mmap_candidates(self, embedding, fetch_k, departments=None, include_embeddings=False):
+        """
+        以記憶體映射矩陣做精確 top fetch_k，再依 id 一次向 Chroma 取回內容
+        distance 換算為與 Chroma 預設 l2 相同的尺度（正規化向量：2 - 2 * cosine）
+        """
+        hits = self.mmap_index.search(embedding, fetch_k, departments, include_vectors=include_embeddings)
+        found = self._get_chunks([chunk_id for chunk_id, _, _ in hits])
+        candidates = []
+        for chunk_id, similarity, vector in hits:
+            if chunk_id not in found:
+                continue
+            candidates.append({
+                **found[chunk_id],
+                "distance": 2.0 - 2.0 * similarity,
+                "embedding": vector,
+            })
+        return candidates
+
+    def _get_chunks(self, ids):
+        located = self._locate_chunks(ids)
+        found = {}
+        by_shard = {}
+        for chunk_id, shard in located.items():
+            by_shard.setdefault(id(shard), (shard, []))[1].append(chunk_id)
+        for shard, shard_ids in by_shard.values():
+            result = shard._collection.get(ids=shard_ids, include=["documents", "metadatas"])
+            found.update({
+                chunk_id: {"id": chunk_id, "content": text, "metadata": meta or {}}
+                for chunk_id, text, meta in zip(result["ids"], result["documents"], result["metadatas"])
+            })
+        return found
+
+    @staticmethod
+    def _to_document(candidate):
+        return Document(id=candidate["id"], page_content=candidate["content"], metadata=candidate["metadata"])
+
+    def search(self, query, k=5, fetch_k=20, search_type="mmr", departments=None, use_cache=True,
+               rerank=False, timer=None):
+        """
+        統一的檢索入口，回傳 langchain Document list
+        - mmr：向量 MMR 檢索（原本 as_retriever(search_type="mmr") 的行為）
+        - hybrid：BM25 + 向量檢索，以 RRF 融合
+        - departments：只搜尋指定部門的 collection，未指定則搜尋全部
+        - rerank：取 fetch_k 筆候選（mmr 時直接取向量最相近的 fetch_k 筆），以 cross-encoder 批次評分後取前 k 筆
+        - timer：StageTimer，記錄 embed / retrieve / rerank 三個階段的耗時
+        相同查詢與參數的結果會記在檢索快取中，命中時只需依 chunk id 讀回內容，不需 embedding 與向量檢索
+        """
+        if search_type not in ("mmr", "hybrid"):
+            raise ValueError(f"不支援的檢索方式：{search_type}")
+
+        cache = self.retrieval_cache if use_cache else None
+        with timer.stage("retrieve") if timer else nullcontext():
+            if cache is not None:
+                key = cache.make_key(query, k, fetch_k, search_type, departments, rerank=bool(rerank))
+                cached = cache.get(key)
+                if cached:
+                    chunk_ids, scores = cached
+                    found = self._get_chunks(chunk_ids)
+                    # chunk 已不存在（例如版本號尚未遞增前被刪除）時視為未命中
+                    if all(chunk_id in found for chunk_id in chunk_ids):
+                        print(f"🎯 [檢索快取] 命中：{query[:50]}")
+                        return self.resolve_payloads([self._to_document(found[chunk_id]) for chunk_id in chunk_ids])
+                epoch = cache.epoch()
+
+        # 查詢向量單獨計時；之後各檢索方式的 embed_query 會命中查詢 LRU
+        if timer and hasattr(self.embedder, "embed_queries"):
+            with timer.stage("embed"):
+                self.embedder.embed_query(query)
+
+        with timer.stage("retrieve") if timer else nullcontext():
+            if rerank and search_type == "mmr":
+                # 重排序時不需 MMR 的多樣性選取，直接取向量最相近的候選
+                embedding = self.embedder.embed_query(query)
+                ranked = [(c, c["distance"]) for c in self._dense_candidates(embedding, fetch_k, departments)]
+            elif search_type == "hybrid":
+                ranked = self._hybrid_ranked(query, k=fetch_k if rerank else k, fetch_k=fetch_k,
+                                             departments=departments)
+            else:
+                ranked = self._mmr_ranked(query, k=k, fetch_k=fetch_k, departments=departments)
+            scores = {c["id"]: float(score) for c, score in ranked}
+            documents = self.resolve_payloads([self._to_document(c) for c, _ in ranked])
+
+        if rerank and documents:
+            with timer.stage("rerank") if timer else nullcontext():
+                reranked = registry.get_reranker().rerank(query, documents, top_k=k)
+            documents = [document for document, _ in reranked]
+            scores = {document.id: score for document, score in reranked}
+
+        if cache is not None:
+            cache.put(
+                key, [d.id for d in documents], [scores[d.id] for d in documents],
+                [d.metadata.get("document_id") for d in documents], epoch=epoch
+            )
+        return documents
+
+    def resolve_payloads(self, documents):
+        """
+        將摘要向量換回 docstore 中的原始內容；同一份原始內容只回傳一次（多個摘要 chunk 可能指向同一筆）
+        """
+        doc_ids = list({d.metadata[DOC_ID_KEY] for d in documents if d.metadata.get(DOC_ID_KEY)})
+        if not doc_ids:
+            return documents
+        payloads = dict(zip(doc_ids, self.docstore.mget(doc_ids)))
+        resolved, seen = [], set()
+        for document in documents:
+            doc_id = document.metadata.get(DOC_ID_KEY)
+            if not doc_id or payloads.get(doc_id) is None:
+                resolved.append(document)
+                continue
+            if doc_id in seen:
+                continue
+            seen.add(doc_id)
+            resolved.append(Document(
+                id=document.id,
+                page_content=payloads[doc_id],
+                metadata={**document.metadata, "summary": document.page_content}
+            ))
+        return resolved
+
+    def mmr_search(self, query, k=5, fetch_k=20, lambda_mult=0.5, departments=None):
+        ranked = self._mmr_ranked(query, k, fetch_k, lambda_mult, departments)
+        return [self._to_document(c) for c, _ in ranked]
+
+    def _mmr_ranked(self, query, k=5, fetch_k=20, lambda_mult=0.5, departments=None):
+        """
+        回傳 [(candidate, 向量距離), ...]，依 MMR 選取順序排列
+        """
+        embedding = self.embedder.embed_query(query)
+        candidates = self._dense_candidates(embedding, fetch_k, departments, include_embeddings=True)
+        if not candidates:
+            return []
+        selected = maximal_marginal_relevance(
+            np.array(embedding, dtype=np.float32),
+            [c["embedding"] for c in candidates],
+            k=k,
+            lambda_mult=lambda_mult
+        )
+        return [(candidates[i], candidates[i]["distance"]) for i in selected]
+
+    def hybrid_search(self, query, k=5, fetch_k=20, lexical_k=None, rrf_k=60, departments=None):
+        ranked = self._hybrid_ranked(query, k, fetch_k, lexical_k, rrf_k, departments)
+        return [self._to_document(c) for c, _ in ranked]
+
+    def _hybrid_ranked(self, query, k=5, fetch_k=20, lexical_k=None, rrf_k=60, departments=None):
+        """
+        回傳 [(candidate, RRF 分數), ...]，依分數由高到低
+        """
+        embedding = self.embedder.embed_query(query)
+        dense = self._dense_candidates(embedding, fetch_k, departments)
+        found = {c["id"]: c for c in dense}
+        lexical_ids = [
+            chunk_id for chunk_id, _ in self.lexical.search(query, lexical_k or fetch_k, departments=departments)
+        ]
+
+        fused = reciprocal_rank_fusion([[c["id"] for c in dense], lexical_ids], k=rrf_k)[:k]
+
+        # 只在 BM25 找到、向量檢索沒找到的 chunk 需要再回 Chroma 取內容
+        missing = [chunk_id for chunk_id, _ in fused if chunk_id not in found]
+        if missing:
+            found.update(self._get_chunks(missing))
+
+        return [(found[chunk_id], score) for chunk_id, score in fused if chunk_id in found]
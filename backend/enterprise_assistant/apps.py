@@ -1,8 +1,15 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 class EnterpriseAssistantConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "enterprise_assistant"
 
     def ready(self):
-        import enterprise_assistant.admin  # ✅ 確保 admin.py 被載入
\ No newline at end of file
+        import enterprise_assistant.admin  # ✅ 確保 admin.py 被載入
+        import enterprise_assistant.signals  # ✅ 知識更新/刪除時清除快取答案
+
+        # 啟動 worker 時預先載入 embedding 模型與向量庫（預設關閉，避免 migrate 等指令也載入模型）
+        if getattr(settings, "VECTOR_STORE_WARMUP", False):
+            from common.modules.processor.model_registry import registry
+            registry.warm_up(settings.VECTOR_STORE_DB_PATH)
\ No newline at end of file
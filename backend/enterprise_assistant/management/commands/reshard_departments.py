@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from common.modules.processor.vector_store import VectorStoreHandler
+from enterprise_assistant.models import Knowledge
+
+
+class Command(BaseCommand):
+    help = "將部門分片前寫入預設 collection 的 chunk 依 Knowledge.department 搬到各部門的 collection"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--db-path", default=settings.VECTOR_STORE_DB_PATH)
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        departments = {
+            str(knowledge_id): department
+            for knowledge_id, department in Knowledge.objects.values_list("id", "department")
+        }
+        moved = VectorStoreHandler(options["db_path"]).reshard(departments, batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"已搬移 {moved} 段至部門 collection"))
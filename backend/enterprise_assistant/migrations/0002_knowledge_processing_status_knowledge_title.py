@@ -0,0 +1,23 @@
+# Generated by Django 5.1.15 on 2026-10-17 23:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('enterprise_assistant', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='knowledge',
+            name='processing_status',
+            field=models.CharField(default='pending', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='knowledge',
+            name='title',
+            field=models.CharField(default='未分類', max_length=255),
+        ),
+    ]
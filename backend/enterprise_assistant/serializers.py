@@ -34,6 +34,47 @@ class EnterpriseQuerySerializer(serializers.Serializer):
         default=True,
         help_text="是否啟用知識檢索 (RAG)"
     )
+    retrieval_mode = serializers.ChoiceField(
+        choices=[("mmr", "MMR 向量檢索"), ("hybrid", "BM25 + 向量混合檢索")],
+        default="mmr",
+        help_text="檢索方式：mmr 或 hybrid（關鍵字與向量結果以 RRF 融合，適合科目名稱、股票代碼等精確詞）"
+    )
+    departments = serializers.ListField(
+        child=serializers.CharField(),
+        required=False,
+        help_text="只檢索指定部門的知識文件；未提供時，部門管理員預設為自己的部門，其餘檢索全部"
+    )
+    k = serializers.IntegerField(
+        default=5, min_value=1, max_value=20,
+        help_text="送入 LLM 的段落數"
+    )
+    fetch_k = serializers.IntegerField(
+        required=False, min_value=1, max_value=100,
+        help_text="候選段落數（MMR / 重排序的候選池）；未提供時 mmr 為 20、hybrid 為 10"
+    )
+    rerank = serializers.BooleanField(
+        default=False,
+        help_text="是否以 cross-encoder 對 fetch_k 筆候選重新評分後取前 k 筆（較準確但較慢）"
+    )
+
+    def validate(self, attrs):
+        fetch_k = attrs.get("fetch_k")
+        if fetch_k is not None and fetch_k < attrs["k"]:
+            raise serializers.ValidationError({"fetch_k": "fetch_k 不可小於 k"})
+        return attrs
+
+
+class EnterpriseBatchQuerySerializer(EnterpriseQuerySerializer):
+    query = None  # 以 queries 取代單一 query，其餘參數所有查詢共用
+    queries = serializers.ListField(
+        child=serializers.CharField(),
+        min_length=1, max_length=50,
+        help_text="多個查詢內容，共用相同的模型與檢索參數"
+    )
+    concurrency = serializers.IntegerField(
+        required=False, min_value=1, max_value=16,
+        help_text="同時進行的 LLM 生成數；未提供時使用 BATCH_LLM_CONCURRENCY（預設 2）"
+    )
 
 
 class EnterpriseQueryResponseSerializer(serializers.Serializer):
@@ -43,10 +84,14 @@ class EnterpriseQueryResponseSerializer(serializers.Serializer):
         child=serializers.DictField(),
         help_text="LLM 回答所依據的相關段落內容"
     )
+    timings = serializers.DictField(
+        child=serializers.FloatField(), required=False,
+        help_text="各階段耗時（毫秒）：embed / cache / retrieve / rerank / pack / llm / total"
+    )
 
 class ChunkSerializer(serializers.Serializer):
     id = serializers.CharField()
-    content = serializers.CharField()
+    content = serializers.CharField(required=False)  # fields=metadata 時不回傳
     chunk_index = serializers.IntegerField()
     page_number = serializers.ListField(child=serializers.IntegerField())
     media_type = serializers.CharField()
@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from common.modules.processor.model_registry import registry
+from enterprise_assistant.models import Knowledge
+
+
+def invalidate_knowledge_cache(knowledge_id):
+    """
+    清除引用此知識文件的快取答案（QuerySet.update 不會觸發 signal，需手動呼叫）
+    """
+    cache = registry.get_answer_cache(settings.VECTOR_STORE_DB_PATH)
+    if cache is None:
+        return
+    removed = cache.invalidate_knowledge(knowledge_id)
+    if removed:
+        print(f"🧹 已清除 {removed} 筆引用知識 ID={knowledge_id} 的快取答案")
+
+
+@receiver(post_save, sender=Knowledge)
+def knowledge_saved(sender, instance, created, **kwargs):
+    # 新建立的知識不會被任何快取答案引用
+    if not created:
+        invalidate_knowledge_cache(instance.pk)
+
+
+@receiver(post_delete, sender=Knowledge)
+def knowledge_deleted(sender, instance, **kwargs):
+    invalidate_knowledge_cache(instance.pk)
@@ -0,0 +1,260 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import httpx
+import requests
+from common.modules.ai.llm_gateway import llm_call_metrics, llm_token_metrics
+from common.modules.ai.model import azure_llama_api
+from common.modules.ai.model.azure_llama_api import AzureAPIError, AzureLlamaAPI
+from common.modules.ai.model.cloud_model import CloudModel
+from django.test import SimpleTestCase
+
+
+STREAM_TOKENS = ["第一段", "第二段", "第三段"]
+
+
+class StandInAzureHandler(BaseHTTPRequestHandler):
+    """
+    模擬 Azure Inference API：依序回傳 server.replies 中的 (status, headers, delay)，用完後一律回傳 200
+    stream 請求以 server-sent events 逐段送出 STREAM_TOKENS，每段間隔 server.stream_delay 秒
+    """
+    protocol_version = "HTTP/1.1"  # 支援 keep-alive，才能驗證連線重用
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        server = self.server
+        with server.lock:
+            server.requests.append(json.loads(body))
+            server.client_ports.add(self.client_address[1])
+            status, headers, delay = server.replies.pop(0) if server.replies else (200, {}, 0)
+        if delay:
+            time.sleep(delay)
+        if status == 200 and server.requests[-1].get("stream"):
+            return self.send_stream()
+
+        if status == 200:
+            payload = {
+                "choices": [{"message": {"content": f"回答 #{len(server.requests)}"}}],
+                "usage": {"prompt_tokens": 12, "completion_tokens": 3},
+            }
+        else:
+            payload = {"error": {"code": status}}
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # client 已逾時斷線
+
+    def send_stream(self):
+        self.close_connection = True
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            for token in STREAM_TOKENS:
+                event = {"choices": [{"delta": {"content": token}}]}
+                self.wfile.write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+                time.sleep(self.server.stream_delay)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.server.completed_streams += 1
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # client 停止讀取
+
+    def log_message(self, format, *args):
+        pass
+
+
+class AzureLlamaAPITests(SimpleTestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StandInAzureHandler)
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.client_ports = set()
+        self.server.replies = []
+        self.server.stream_delay = 0
+        self.server.completed_streams = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        url = f"http://127.0.0.1:{self.server.server_address[1]}/chat/completions"
+        for patcher in (
+            mock.patch.object(AzureLlamaAPI, "API_URL", url),
+            mock.patch.object(azure_llama_api, "AZURE_BACKOFF_BASE", 0.01),
+            mock.patch.object(azure_llama_api, "AZURE_MAX_RETRIES", 3),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        AzureLlamaAPI.close()
+        self.addCleanup(AzureLlamaAPI.close)
+        for metrics in (llm_call_metrics, llm_token_metrics):
+            metrics.clear()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_generate_sends_sampling_parameters(self):
+        answer = CloudModel().generate("問題", temperature=0.2, max_token=64, top_p=0.9)
+
+        self.assertEqual(answer, "回答 #1")
+        payload = self.server.requests[0]
+        self.assertEqual((payload["temperature"], payload["max_tokens"], payload["top_p"]), (0.2, 64, 0.9))
+
+    def test_connections_are_reused(self):
+        for _ in range(3):
+            AzureLlamaAPI.ask("問題")
+
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(len(self.server.client_ports), 1)
+
+    def test_retries_on_429_and_5xx(self):
+        self.server.replies = [(429, {"Retry-After": "0"}, 0), (503, {}, 0)]
+
+        self.assertEqual(AzureLlamaAPI.ask("問題"), "回答 #3")
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_gives_up_after_max_retries(self):
+        self.server.replies = [(500, {}, 0)] * 10
+
+        with self.assertRaises(AzureAPIError) as raised:
+            AzureLlamaAPI.ask("問題")
+
+        self.assertEqual(raised.exception.status_code, 500)
+        self.assertEqual(len(self.server.requests), 4)
+
+    def test_does_not_retry_client_errors(self):
+        self.server.replies = [(400, {}, 0)]
+
+        with self.assertRaises(AzureAPIError) as raised:
+            AzureLlamaAPI.ask("問題")
+
+        self.assertEqual(raised.exception.status_code, 400)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_stream_errors_raise_instead_of_yielding_text(self):
+        self.server.replies = [(400, {}, 0), (400, {}, 0)]
+
+        with self.assertRaises(AzureAPIError):
+            list(CloudModel().stream("問題"))
+
+        async def run():
+            try:
+                return [token async for token in CloudModel().astream("問題")]
+            finally:
+                await AzureLlamaAPI.aclose()
+
+        with self.assertRaises(AzureAPIError):
+            asyncio.run(run())
+
+    def test_read_timeout_is_not_retried(self):
+        self.server.replies = [(200, {}, 1.0)]
+
+        with mock.patch.object(azure_llama_api, "AZURE_READ_TIMEOUT", 0.2):
+            with self.assertRaises(requests.ReadTimeout):
+                AzureLlamaAPI.ask("問題")
+
+            async def run():
+                try:
+                    return await AzureLlamaAPI.aask("問題")
+                finally:
+                    await AzureLlamaAPI.aclose()
+
+            self.server.replies = [(200, {}, 1.0)]
+            with self.assertRaises(httpx.ReadTimeout):
+                asyncio.run(run())
+
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_connection_errors_are_retried(self):
+        session = AzureLlamaAPI._get_session()
+        real_post = session.post
+        failures = [requests.ConnectTimeout("連線逾時"), requests.ConnectionError("連線被拒")]
+
+        def flaky_post(*args, **kwargs):
+            if failures:
+                raise failures.pop(0)
+            return real_post(*args, **kwargs)
+
+        with mock.patch.object(session, "post", side_effect=flaky_post) as post:
+            self.assertEqual(AzureLlamaAPI.ask("問題"), "回答 #1")
+        self.assertEqual(post.call_count, 3)
+
+        real_send = httpx.AsyncClient.send
+        failures = [httpx.ConnectTimeout("連線逾時"), httpx.ConnectError("連線被拒")]
+
+        async def flaky_send(client, request, **kwargs):
+            if failures:
+                raise failures.pop(0)
+            return await real_send(client, request, **kwargs)
+
+        async def run():
+            try:
+                return await AzureLlamaAPI.aask("問題")
+            finally:
+                await AzureLlamaAPI.aclose()
+
+        with mock.patch.object(httpx.AsyncClient, "send", flaky_send):
+            self.assertEqual(asyncio.run(run()), "回答 #2")
+        self.assertEqual(failures, [])
+
+    def test_aask_retries_and_reuses_connection(self):
+        self.server.replies = [(502, {}, 0)]
+
+        async def run():
+            try:
+                first = await CloudModel().agenerate("問題", temperature=0.3, max_token=32, top_p=0.5)
+                second = await AzureLlamaAPI.aask("問題")
+                return first, second
+            finally:
+                await AzureLlamaAPI.aclose()
+
+        self.assertEqual(asyncio.run(run()), ("回答 #2", "回答 #3"))
+        self.assertEqual(self.server.requests[1]["temperature"], 0.3)
+        self.assertEqual(len(self.server.client_ports), 1)
+
+    def test_stream_yields_deltas(self):
+        self.server.replies = [(503, {}, 0)]
+
+        self.assertEqual(list(CloudModel().stream("問題")), STREAM_TOKENS)
+        self.assertTrue(self.server.requests[-1]["stream"])
+
+    def test_astream_stops_when_consumer_stops_reading(self):
+        self.server.stream_delay = 0.5
+
+        async def run():
+            tokens = CloudModel().astream("問題")
+            try:
+                return await tokens.__anext__()
+            finally:
+                await tokens.aclose()
+                await AzureLlamaAPI.aclose()
+
+        start = time.perf_counter()
+        self.assertEqual(asyncio.run(run()), STREAM_TOKENS[0])
+        self.assertLess(time.perf_counter() - start, 1.0)
+        time.sleep(1.5)
+        self.assertEqual(self.server.completed_streams, 0)
+
+    def test_calls_are_accounted_per_call_site(self):
+        labels = {"provider": "azure", "model": AzureLlamaAPI.MODEL, "call_site": "query_user"}
+        CloudModel().generate("問題", call_site="query_user")
+        self.server.replies = [(400, {}, 0)]
+        with self.assertRaises(AzureAPIError):
+            CloudModel().generate("問題", call_site="query_user")
+
+        self.assertTrue(llm_call_metrics.quantiles(status="ok", **labels))
+        self.assertTrue(llm_call_metrics.quantiles(status="error", **labels))
+        self.assertEqual(llm_token_metrics.quantiles(kind="prompt", **labels)[0.5], 12)
+        self.assertEqual(llm_token_metrics.quantiles(kind="completion", **labels)[0.5], 3)
+        self.assertIn('call_site="query_user"', llm_call_metrics.render())
@@ -0,0 +1,179 @@
+import base64
+import tempfile
+from unittest import mock
+from urllib import parse
+
+from common.modules.processor.model_registry import registry
+from common.modules.processor.vector_store import VectorStoreHandler
+from django.test import SimpleTestCase, TestCase
+from enterprise_assistant.models import Knowledge
+from enterprise_assistant.tests.test_vector_store import KeywordEmbedder
+from enterprise_assistant.views import chunk
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+
+class ChunkViewTestCase(TestCase):
+    """ chunk 相關 view 使用暫存目錄的向量庫，embedding 以 KeywordEmbedder 取代 """
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.addCleanup(registry.clear)
+        self.embedder = KeywordEmbedder()
+        self.handler = VectorStoreHandler(db_path=tmp.name)
+        for patcher in (
+            mock.patch.object(registry, "get_embedder", return_value=self.embedder),
+            mock.patch.object(chunk, "get_vectorstore", return_value=self.handler),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.factory = APIRequestFactory()
+
+    def add_knowledge(self, contents, department="財務"):
+        knowledge = Knowledge.objects.create(
+            title="年報", department=department, content=contents[0], chunk=len(contents)
+        )
+        for page, content in enumerate(contents, start=1):
+            self.handler.add(content, "text", f"[{page}]", knowledge.id, "[]", department=department)
+        return knowledge
+
+    def chunk_ids(self, knowledge):
+        return [c["id"] for c in self.handler.list(knowledge.id, department=knowledge.department)]
+
+
+class ChunkDetailViewTests(ChunkViewTestCase):
+    def put(self, chunk_id, content):
+        request = self.factory.put(f"/chunks/{chunk_id}/", {"content": content}, format="json")
+        return chunk.ChunkDetailView.as_view()(request, chunk_id=chunk_id)
+
+    def delete(self, chunk_id):
+        request = self.factory.delete(f"/chunks/{chunk_id}/")
+        return chunk.ChunkDetailView.as_view()(request, chunk_id=chunk_id)
+
+    def test_put_keeps_chunk_id_and_updates_preview(self):
+        knowledge = self.add_knowledge(["營收成長", "員工福利"])
+        first, second = self.chunk_ids(knowledge)
+
+        response = self.put(first, "設備採購")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["data"], {"id": first})
+        self.assertEqual(self.chunk_ids(knowledge), [first, second])
+        knowledge.refresh_from_db()
+        self.assertEqual(knowledge.content, "設備採購")
+        self.assertEqual(knowledge.chunk, 2)
+
+    def test_put_on_other_chunk_keeps_preview(self):
+        knowledge = self.add_knowledge(["營收成長", "員工福利"])
+        second = self.chunk_ids(knowledge)[1]
+
+        self.put(second, "設備採購")
+
+        knowledge.refresh_from_db()
+        self.assertEqual(knowledge.content, "營收成長")
+
+    def test_put_unchanged_content_skips_embedding(self):
+        knowledge = self.add_knowledge(["營收成長"])
+        self.embedder.embedded.clear()
+
+        response = self.put(self.chunk_ids(knowledge)[0], "營收成長")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.embedder.embedded, [])
+
+    def test_put_unknown_chunk_fails(self):
+        response = self.put("missing", "設備採購")
+        self.assertEqual(response.status_code, 400)
+
+    def test_delete_decrements_count_and_refreshes_preview(self):
+        knowledge = self.add_knowledge(["營收成長", "員工福利"])
+        first, second = self.chunk_ids(knowledge)
+
+        with mock.patch.object(chunk, "invalidate_knowledge_cache") as invalidate:
+            response = self.delete(first)
+
+        self.assertEqual(response.status_code, 204)
+        invalidate.assert_called_once_with(knowledge.id)
+        self.assertEqual(self.chunk_ids(knowledge), [second])
+        self.assertEqual(self.handler.lexical.search("營收"), [])
+        knowledge.refresh_from_db()
+        self.assertEqual(knowledge.chunk, 1)
+        self.assertEqual(knowledge.content, "員工福利")
+
+    def test_delete_never_makes_chunk_count_negative(self):
+        knowledge = self.add_knowledge(["營收成長"])
+        Knowledge.objects.filter(id=knowledge.id).update(chunk=0)
+
+        response = self.delete(self.chunk_ids(knowledge)[0])
+
+        self.assertEqual(response.status_code, 204)
+        knowledge.refresh_from_db()
+        self.assertEqual(knowledge.chunk, 0)
+        self.assertEqual(knowledge.content, "")
+
+    def test_delete_unknown_chunk_fails(self):
+        response = self.delete("missing")
+        self.assertEqual(response.status_code, 400)
+
+
+class ChunkListViewTests(ChunkViewTestCase):
+    def setUp(self):
+        super().setUp()
+        self.knowledge = self.add_knowledge(["營收成長", "員工福利", "設備採購"])
+
+    def get(self, params=None):
+        request = self.factory.get(f"/knowledge/{self.knowledge.id}/chunks/", params or {})
+        return chunk.ChunkListCreateView.as_view()(request, pk=self.knowledge.id)
+
+    @staticmethod
+    def cursor_of(link):
+        return parse.parse_qs(parse.urlsplit(link).query)["cursor"][0]
+
+    def test_cursor_pages_follow_position_order(self):
+        first = self.get({"size": 2})
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual([c["content"] for c in first.data["chunks"]], ["營收成長", "員工福利"])
+        self.assertIsNone(first.data["previous"])
+
+        second = self.get({"size": 2, "cursor": self.cursor_of(first.data["next"])})
+
+        self.assertEqual([c["content"] for c in second.data["chunks"]], ["設備採購"])
+        self.assertIsNone(second.data["next"])
+        self.assertNotIn("cursor", second.data["previous"])
+
+    def test_metadata_fields_omit_content(self):
+        response = self.get({"fields": "metadata"})
+
+        self.assertEqual([c["page_number"] for c in response.data["chunks"]], [[1], [2], [3]])
+        self.assertNotIn("content", response.data["chunks"][0])
+
+    def test_invalid_fields_is_rejected(self):
+        self.assertEqual(self.get({"fields": "all"}).status_code, 400)
+
+    def test_invalid_cursor_is_not_found(self):
+        for cursor in ("not-base64!", base64.b64encode(b"x=1").decode("ascii")):
+            with self.subTest(cursor=cursor):
+                self.assertEqual(self.get({"cursor": cursor}).status_code, 404)
+
+
+class ChunkCursorPaginationTests(SimpleTestCase):
+    def test_cursor_round_trip(self):
+        paginator = chunk.ChunkCursorPagination()
+        paginator.base_url = "http://testserver/chunks/?size=2"
+
+        link = paginator.encode_cursor(4)
+        request = Request(APIRequestFactory().get(link))
+
+        self.assertEqual(paginator.decode_cursor(request), 4)
+        self.assertEqual(paginator.encode_cursor(0), "http://testserver/chunks/?size=2")
+        with self.assertRaises(NotFound):
+            paginator.decode_cursor(Request(APIRequestFactory().get("/chunks/", {"cursor": "%%%"})))
+
+    def test_page_size_is_clamped(self):
+        paginator = chunk.ChunkCursorPagination()
+        sizes = [paginator.get_page_size(Request(APIRequestFactory().get("/", {"size": size})))
+                 for size in ("0", "1000", "abc")]
+        self.assertEqual(sizes, [1, paginator.max_page_size, paginator.page_size])
@@ -0,0 +1,77 @@
+from common.modules.processor.context_packer import estimate_tokens, merge_overlap, pack_context
+from django.test import SimpleTestCase
+
+
+def chunk(chunk_id, content, chunk_index, document_id=1, page="[1]", media_type="text", source="[]"):
+    return {
+        "id": chunk_id, "document_id": document_id, "page_number": page, "media_type": media_type,
+        "source": source, "chunk_index": chunk_index, "content": content,
+    }
+
+
+class MergeOverlapTests(SimpleTestCase):
+    def test_removes_splitter_overlap(self):
+        self.assertEqual(merge_overlap("營業收入較去年成長", "較去年成長二成"), "營業收入較去年成長二成")
+
+    def test_short_coincidental_overlap_is_kept(self):
+        self.assertEqual(merge_overlap("第一句。", "。第二句"), "第一句。。第二句")
+        self.assertEqual(merge_overlap("abc ", " def"), "abc  def")
+
+    def test_overlap_longer_than_max_overlap_is_kept(self):
+        left, right = "x" + "重複內容" * 5, "重複內容" * 5 + "y"
+        self.assertEqual(merge_overlap(left, right, max_overlap=8), left + right[8:])
+        self.assertEqual(merge_overlap(left, right), "x" + "重複內容" * 5 + "y")
+
+
+class PackContextTests(SimpleTestCase):
+    def test_adjacent_chunks_merge_only_within_the_same_split(self):
+        docs = [
+            chunk("t1", "營業收入較去年成長", 0),
+            chunk("i0", "圖片摘要", 0, media_type="image", source='["fig.png"]'),
+            chunk("t2", "較去年成長二成", 1),
+            chunk("b0", "表格摘要", 0, media_type="table"),
+        ]
+
+        context, stats = pack_context(docs, budget_tokens=1000)
+
+        self.assertEqual(context.split("\n\n"), ["營業收入較去年成長二成", "圖片摘要", "表格摘要"])
+        self.assertEqual((stats["chunks"], stats["segments"]), (4, 3))
+
+    def test_duplicates_are_dropped_by_chunk_id(self):
+        docs = [
+            chunk("a", "第一段內容", 0),
+            chunk("a", "第一段內容", 0),
+            chunk("b", "另一次切割的同編號內容", 0),
+        ]
+
+        context, stats = pack_context(docs, budget_tokens=1000)
+
+        self.assertEqual(context.split("\n\n"), ["第一段內容", "另一次切割的同編號內容"])
+        self.assertEqual(stats["segments"], 2)
+
+    def test_segments_follow_best_rank_and_standalone_items_are_not_merged(self):
+        docs = [
+            chunk("p5", "第五頁", 0, page="[5]"),
+            {"id": "full", "document_id": 1, "page_number": "[1]", "chunk_index": None, "content": "完整表格"},
+            chunk("p1", "第一頁", 0),
+        ]
+
+        context, _ = pack_context(docs, budget_tokens=1000)
+
+        self.assertEqual(context.split("\n\n"), ["第五頁", "完整表格", "第一頁"])
+
+    def test_budget_truncates_and_skips_segments(self):
+        long_text = "長" * 500
+        docs = [chunk("a", "短" * 20, 0), chunk("b", long_text, 0, page="[2]"), chunk("c", "尾" * 10, 0, page="[3]")]
+
+        context, stats = pack_context(docs, budget_tokens=200)
+        parts = context.split("\n\n")
+
+        self.assertEqual(parts[0], "短" * 20)
+        self.assertTrue(long_text.startswith(parts[1]) and len(parts[1]) < len(long_text))
+        self.assertLessEqual(stats["tokens"], 200)
+        self.assertLessEqual(sum(estimate_tokens(p) for p in parts), 200)
+
+        context, stats = pack_context(docs, budget_tokens=60)
+        self.assertEqual(context.split("\n\n"), ["短" * 20, "尾" * 10])
+        self.assertEqual(stats["packed_segments"], 2)
@@ -0,0 +1,153 @@
+import asyncio
+from unittest import mock
+
+from common.modules.ai import llm_factory
+from common.modules.ai.llm_factory import LlmFactory, TimedModel
+from common.modules.ai.model.i_model import IModel
+from common.modules.ai.model.local_model import LocalModel
+from django.test import SimpleTestCase
+from langchain_core.messages import AIMessage
+from langchain_ollama import ChatOllama
+
+
+class LlmFactoryTests(SimpleTestCase):
+    def setUp(self):
+        for target in ("LocalModel", "CloudModel"):
+            patcher = mock.patch.object(llm_factory, target, side_effect=lambda *args: mock.Mock())
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        for name in ("hits", "misses"):
+            patcher = mock.patch.object(LlmFactory, name, 0)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(LlmFactory, "_pool", {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_instances_are_pooled_per_model(self):
+        first = LlmFactory().create("local", "llama3.2")
+        second = LlmFactory().create("local", "llama3.2")
+        other = LlmFactory().create("local", "gemma3")
+
+        self.assertIs(first, second)
+        self.assertIsNot(first, other)
+        self.assertIsInstance(first, TimedModel)
+        self.assertEqual(llm_factory.LocalModel.call_count, 2)
+        stats = LlmFactory.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 2))
+        self.assertEqual(set(stats["models"]), {"local/llama3.2", "local/gemma3"})
+
+    def test_cloud_model_is_shared_across_model_names(self):
+        cloud = LlmFactory().create("cloud", "llama3.2")
+
+        self.assertIs(LlmFactory().create("cloud", "gemma3"), cloud)
+        self.assertEqual(llm_factory.CloudModel.call_count, 1)
+        self.assertEqual(cloud.label, "cloud")
+
+    def test_invalid_model_type(self):
+        with self.assertRaises(Exception):
+            LlmFactory().create("remote", "llama3.2")
+        self.assertEqual(LlmFactory._pool, {})
+
+
+class LocalModelTests(SimpleTestCase):
+    def test_sampling_options_do_not_mutate_the_shared_model(self):
+        model = LocalModel("llama3.2")
+        shared = model._LocalModel__model
+
+        cold = model._bound(0.1, 64, 0.5)
+        hot = model._bound(0.9, 128, 0.2)
+
+        self.assertEqual(cold.kwargs["options"], {"temperature": 0.1, "top_p": 0.5, "num_predict": 64})
+        self.assertEqual(hot.kwargs["options"], {"temperature": 0.9, "top_p": 0.2, "num_predict": 128})
+        self.assertIs(cold.bound, shared)
+        self.assertIsNone(shared.temperature)
+        self.assertIsNone(shared.num_predict)
+
+    def test_generate_passes_options_per_call(self):
+        model = LocalModel("llama3.2")
+        reply = AIMessage(content="營收成長", response_metadata={"prompt_eval_count": 3, "eval_count": 2})
+
+        with mock.patch.object(ChatOllama, "invoke", return_value=reply) as invoke:
+            self.assertEqual(model.generate("營收?", temperature=0.3, max_token=16, call_site="test"), "營收成長")
+            model.generate("營收?", temperature=0.7, max_token=32, call_site="test")
+
+        options = [c.kwargs["options"]["temperature"] for c in invoke.call_args_list]
+        self.assertEqual(options, [0.3, 0.7])
+        self.assertIsNone(model._LocalModel__model.temperature)
+
+
+class AnswerModel(IModel):
+    """ 只實作 generate，stream / agenerate / astream 皆使用 IModel 的預設 """
+
+    def generate(self, query, temperature=0.8, max_token=2048, top_p=0.1, call_site=None):
+        return f"回答：{query}"
+
+
+class StreamingModel(IModel):
+    """ 逐段回傳 tokens，記錄上游串流是否已被關閉 """
+
+    def __init__(self, tokens=("營收", "成長", "二成")):
+        self.tokens = tokens
+        self.closed = False
+
+    def generate(self, query, temperature=0.8, max_token=2048, top_p=0.1, call_site=None):
+        return "".join(self.tokens)
+
+    def stream(self, query, temperature=0.8, max_token=2048, top_p=0.1, call_site=None):
+        try:
+            yield from self.tokens
+        finally:
+            self.closed = True
+
+    async def astream(self, query, temperature=0.8, max_token=2048, top_p=0.1, call_site=None):
+        try:
+            for token in self.tokens:
+                yield token
+        finally:
+            self.closed = True
+
+
+class IModelDefaultTests(SimpleTestCase):
+    def test_stream_yields_the_full_answer_once(self):
+        self.assertEqual(list(AnswerModel().stream("營收")), ["回答：營收"])
+
+    def test_async_defaults_fall_back_to_generate(self):
+        async def run():
+            model = AnswerModel()
+            return await model.agenerate("營收"), [token async for token in model.astream("營收")]
+
+        self.assertEqual(asyncio.run(run()), ("回答：營收", ["回答：營收"]))
+
+
+class TimedModelTests(SimpleTestCase):
+    def setUp(self):
+        self.upstream = StreamingModel()
+        self.model = TimedModel(self.upstream, "local/test")
+
+    def test_stream_passes_tokens_through(self):
+        self.assertEqual(list(self.model.stream("營收")), ["營收", "成長", "二成"])
+        self.assertTrue(self.upstream.closed)
+        self.assertEqual(self.model.stats(), {"calls": 1, "in_flight": 0, "max_in_flight": 1})
+
+    def test_early_close_closes_the_upstream_stream(self):
+        tokens = self.model.stream("營收")
+        self.assertEqual(next(tokens), "營收")
+        self.assertEqual(self.model.stats()["in_flight"], 1)
+
+        tokens.close()
+
+        self.assertTrue(self.upstream.closed)
+        self.assertEqual(self.model.stats()["in_flight"], 0)
+
+    def test_early_aclose_closes_the_upstream_stream(self):
+        async def run():
+            tokens = self.model.astream("營收")
+            first = await tokens.__anext__()
+            in_flight = self.model.stats()["in_flight"]
+            await tokens.aclose()
+            return first, in_flight
+
+        self.assertEqual(asyncio.run(run()), ("營收", 1))
+        self.assertTrue(self.upstream.closed)
+        self.assertEqual(self.model.stats()["in_flight"], 0)
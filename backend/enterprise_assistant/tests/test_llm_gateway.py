@@ -0,0 +1,33 @@
+import asyncio
+from unittest import mock
+
+from common.modules.ai import llm_gateway
+from django.test import SimpleTestCase
+
+
+class FakeAsyncClient:
+    instances = 0
+
+    def __init__(self):
+        FakeAsyncClient.instances += 1
+
+    async def chat(self, model, messages, **kwargs):
+        return {"message": {"content": "ok"}, "prompt_eval_count": 5, "eval_count": 2}
+
+
+class AollamaChatTests(SimpleTestCase):
+    def setUp(self):
+        FakeAsyncClient.instances = 0
+        patcher = mock.patch.object(llm_gateway.ollama, "AsyncClient", FakeAsyncClient)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_reuses_one_client_per_event_loop(self):
+        async def run():
+            for _ in range(3):
+                await llm_gateway.aollama_chat("gemma3", [], call_site="test")
+
+        asyncio.run(run())
+        self.assertEqual(FakeAsyncClient.instances, 1)
+        asyncio.run(run())  # 新的 event loop 需要新的 client
+        self.assertEqual(FakeAsyncClient.instances, 2)
@@ -0,0 +1,93 @@
+import tempfile
+
+import numpy as np
+from common.modules.processor.mmap_index import COMPACT_RATIO, MmapVectorIndex
+from django.test import SimpleTestCase
+
+
+def unit(i, dim=8):
+    vector = np.zeros(dim, dtype=np.float32)
+    vector[i % dim] = 1.0
+    return vector
+
+
+class MmapVectorIndexTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.directory = tmp.name
+        self.index = MmapVectorIndex(self.directory)
+
+    def ids_of(self, hits):
+        return [chunk_id for chunk_id, _, _ in hits]
+
+    def test_add_and_search_without_mutating_inputs(self):
+        embeddings = np.array([[3.0, 0, 0, 0], [0, 2.0, 0, 0], [1.0, 1.0, 0, 0]], dtype=np.float32)
+        original = embeddings.copy()
+        self.index.add(["a", "b", "c"], embeddings, [1, 1, 2])
+        query = np.array([5.0, 0, 0, 0], dtype=np.float32)
+
+        hits = self.index.search(query, k=2, include_vectors=True)
+
+        self.assertEqual(self.ids_of(hits), ["a", "c"])
+        self.assertAlmostEqual(hits[0][1], 1.0, places=3)
+        np.testing.assert_allclose(hits[0][2], [1, 0, 0, 0], atol=1e-3)
+        np.testing.assert_array_equal(embeddings, original)
+        np.testing.assert_array_equal(query, [5.0, 0, 0, 0])
+        self.assertEqual(self.index.count(), 3)
+
+    def test_readding_a_chunk_tombstones_the_old_row(self):
+        self.index.add(["a", "b"], [unit(0), unit(1)], [1, 1])
+        self.index.add(["a"], [unit(2)], [1])
+
+        self.assertEqual(self.index.count(), 2)
+        self.assertEqual(self.index._read_header()["tombstones"], 1)
+        self.assertEqual(self.ids_of(self.index.search(unit(2), k=1)), ["a"])
+        hits = self.index.search(unit(0), k=3)
+        self.assertEqual(sorted(self.ids_of(hits)), ["a", "b"])
+        self.assertTrue(all(score < 0.5 for _, score, _ in hits))  # 舊向量已是墓碑，不再被檢索到
+
+    def test_delete_document_and_department(self):
+        self.index.add(
+            [f"c{i}" for i in range(6)], [unit(i) for i in range(6)],
+            [1, 1, 2, 2, 3, 3], ["財務", "財務", "人資", "人資", "", ""]
+        )
+
+        self.assertEqual(self.index.delete_document(1), 2)
+        self.assertEqual(self.index.delete_department("人資"), 2)
+        self.assertEqual(sorted(self.ids_of(self.index.search(unit(0), k=10))), ["c4", "c5"])
+        self.assertEqual(self.index.delete_document(1), 0)
+
+    def test_auto_compacts_past_tombstone_ratio_and_remaps_other_readers(self):
+        total = 10
+        self.index.add([f"c{i}" for i in range(total)], [unit(i) for i in range(total)], list(range(total)))
+        reader = MmapVectorIndex(self.directory)  # 模擬另一個 worker 行程
+        self.assertEqual(len(reader.search(unit(0), k=total)), total)
+        generation = self.index._read_header()["generation"]
+
+        allowed = int(COMPACT_RATIO * total)
+        self.index.delete_ids([f"c{i}" for i in range(allowed)])
+        self.assertEqual(self.index._read_header()["tombstones"], allowed)
+
+        self.index.delete_ids([f"c{allowed}"])
+        header = self.index._read_header()
+        self.assertEqual((header["count"], header["tombstones"]), (total - allowed - 1, 0))
+        self.assertEqual(header["generation"], generation + 1)
+
+        hits = reader.search(unit(total - 1), k=total)
+        self.assertEqual(len(hits), total - allowed - 1)
+        self.assertEqual(hits[0][0], f"c{total - 1}")
+        self.assertAlmostEqual(hits[0][1], 1.0, places=3)
+        reader.add([f"c{total - 1}"], [unit(0)], [total - 1])  # 壓縮後的列號仍可正確標記墓碑
+        self.assertEqual(self.index.count(), total - allowed - 1)
+
+    def test_department_mask_limits_top_k(self):
+        self.index.add(
+            ["f1", "f2", "h1"], [unit(0), unit(1), [1.0, 0.1, 0, 0, 0, 0, 0, 0]],
+            [1, 1, 2], ["財務", "財務", "人資"]
+        )
+
+        self.assertEqual(self.ids_of(self.index.search(unit(0), k=2)), ["f1", "h1"])
+        self.assertEqual(self.ids_of(self.index.search(unit(0), k=2, departments=["財務"])), ["f1", "f2"])
+        self.assertEqual(self.ids_of(self.index.search(unit(0), k=5, departments=["人資"])), ["h1"])
+        self.assertEqual(self.index.search(unit(0), k=5, departments=["法務"]), [])
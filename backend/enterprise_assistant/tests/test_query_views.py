@@ -0,0 +1,270 @@
+import base64
+import json
+import threading
+import time
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.test import RequestFactory, TestCase
+from enterprise_assistant.models import AdminUser
+from enterprise_assistant.views import query
+from rest_framework.test import APIRequestFactory
+
+
+RETRIEVED = [{"document_id": 1, "chunk_index": 0, "page_number": "[1]", "title": "年報", "content": "營收成長二成"}]
+
+
+class StubModel:
+    """ 依序回傳 tokens；fail_after 指定在第幾段之後拋出錯誤 """
+
+    def __init__(self, tokens=("營收", "成長"), fail_after=None):
+        self.tokens = tokens
+        self.fail_after = fail_after
+        self.closed = False
+
+    def _tokens(self):
+        for i, token in enumerate(self.tokens):
+            if i == self.fail_after:
+                raise RuntimeError("模型中斷")
+            yield token
+
+    def stream(self, prompt, call_site=None):
+        try:
+            yield from self._tokens()
+        finally:
+            self.closed = True
+
+    async def astream(self, prompt, call_site=None):
+        try:
+            for token in self._tokens():
+                yield token
+        finally:
+            self.closed = True
+
+
+def parse_events(chunks):
+    events = []
+    for block in b"".join(chunks).decode("utf-8").strip().split("\n\n"):
+        name, data = block.split("\n")
+        events.append((name[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+def basic_auth(username, password):
+    token = base64.b64encode(f"{username}:{password}".encode("utf-8")).decode("ascii")
+    return {"HTTP_AUTHORIZATION": f"Basic {token}"}
+
+
+class QueryViewTestCase(TestCase):
+    """ 檢索與回答快取以 stub 取代，記錄每次檢索的部門範圍 """
+
+    def setUp(self):
+        self.scopes = []
+
+        def retrieve(query_text, use_retrieval, retrieval_mode, departments, **kwargs):
+            self.scopes.append(departments)
+            return []
+
+        for target, value in (("retrieve_documents", retrieve), ("cache_lookup", lambda *a, **k: (None, None))):
+            patcher = mock.patch.object(query, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def post_sync(self, view, body, **headers):
+        request = APIRequestFactory().post("/", body, format="json", **headers)
+        return view.as_view()(request)
+
+    def post_async(self, view, body, **headers):
+        request = RequestFactory().post("/", json.dumps(body), content_type="application/json", **headers)
+        return async_to_sync(view.as_view())(request)
+
+
+class DepartmentScopeTests(QueryViewTestCase):
+    def setUp(self):
+        super().setUp()
+        user = User.objects.create_user("finance", password="secret")
+        AdminUser.objects.create(user=user, department="財務")
+        superuser = User.objects.create_user("root", password="secret")
+        AdminUser.objects.create(user=superuser, department="資訊", is_superadmin=True)
+
+    def test_sync_and_async_views_scope_basic_auth_users_the_same(self):
+        body = {"query": "營收", "model_type": "local"}
+        for credentials in (basic_auth("finance", "secret"), basic_auth("root", "secret"), {}):
+            self.post_sync(query.EnterpriseQueryView, body, **credentials)
+            self.post_async(query.AsyncEnterpriseQueryView, body, **credentials)
+
+        self.assertEqual(self.scopes, [["財務"], ["財務"], None, None, None, None])
+
+    def test_explicit_departments_override_the_default(self):
+        body = {"query": "營收", "model_type": "local", "departments": ["人資"]}
+        self.post_async(query.AsyncEnterpriseQueryView, body, **basic_auth("finance", "secret"))
+
+        self.assertEqual(self.scopes, [["人資"]])
+
+    def test_bad_credentials_are_rejected_like_the_sync_view(self):
+        body = {"query": "營收", "model_type": "local"}
+        credentials = basic_auth("finance", "wrong")
+
+        sync_response = self.post_sync(query.EnterpriseQueryView, body, **credentials)
+        async_response = self.post_async(query.AsyncEnterpriseQueryView, body, **credentials)
+        stream_response = self.post_async(query.AsyncEnterpriseQueryStreamView, body, **credentials)
+
+        self.assertEqual(sync_response.status_code, 403)
+        self.assertEqual(async_response.status_code, 403)
+        self.assertEqual(stream_response.status_code, 403)
+        self.assertEqual(self.scopes, [])
+
+
+class StreamViewTests(QueryViewTestCase):
+    def setUp(self):
+        super().setUp()
+        self.model = StubModel()
+        self.stored = []
+        factory = mock.Mock()
+        factory.return_value.create.return_value = self.model
+        for target, value in (
+            ("LlmFactory", factory),
+            ("retrieve_documents", lambda *a, **k: RETRIEVED),
+            ("cache_store", lambda *args: self.stored.append(args[3])),
+        ):
+            patcher = mock.patch.object(query, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def stream_events(self, view_class):
+        body = {"query": "營收", "model_type": "local"}
+        if view_class is query.EnterpriseQueryStreamView:
+            return parse_events(list(self.post_sync(view_class, body).streaming_content))
+
+        async def collect():
+            response = await view_class.as_view()(RequestFactory().post(
+                "/", json.dumps(body), content_type="application/json"
+            ))
+            return [chunk async for chunk in response.streaming_content]
+
+        return parse_events(async_to_sync(collect)())
+
+    def test_docs_tokens_done_sequence(self):
+        for view_class in (query.EnterpriseQueryStreamView, query.AsyncEnterpriseQueryStreamView):
+            with self.subTest(view=view_class.__name__):
+                events = self.stream_events(view_class)
+
+                self.assertEqual([name for name, _ in events], ["docs", "token", "token", "done"])
+                self.assertEqual(events[0][1]["retrieved_docs"], RETRIEVED)
+                self.assertEqual([data["token"] for name, data in events if name == "token"], ["營收", "成長"])
+                self.assertIn("llm", events[-1][1]["timings"])
+        self.assertEqual(self.stored, ["營收成長", "營收成長"])
+
+    def test_failures_before_the_model_end_with_an_error_event(self):
+        for target in ("retrieve_documents", "build_prompt"):
+            with mock.patch.object(query, target, side_effect=RuntimeError("向量庫無法開啟")):
+                for view_class in (query.EnterpriseQueryStreamView, query.AsyncEnterpriseQueryStreamView):
+                    with self.subTest(target=target, view=view_class.__name__):
+                        events = self.stream_events(view_class)
+
+                        self.assertEqual(events[-1], ("error", {"message": query.STREAM_ERROR_MESSAGE}))
+                        self.assertNotIn("done", [name for name, _ in events])
+
+    def test_model_failure_mid_stream_is_not_cached(self):
+        self.model.fail_after = 1
+        for view_class in (query.EnterpriseQueryStreamView, query.AsyncEnterpriseQueryStreamView):
+            with self.subTest(view=view_class.__name__):
+                self.model.closed = False
+                events = self.stream_events(view_class)
+
+                self.assertEqual([name for name, _ in events], ["docs", "token", "error"])
+                self.assertTrue(self.model.closed)
+        self.assertEqual(self.stored, [])
+
+
+class BlockingModel:
+    """ generate 會停留一小段時間，記錄同時進行中的最大呼叫數 """
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def generate(self, prompt, call_site=None):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(self.delay)
+            return "營收成長二成"
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+class BatchQueryViewTests(QueryViewTestCase):
+    def setUp(self):
+        super().setUp()
+        self.model = BlockingModel()
+        factory = mock.Mock()
+        factory.return_value.create.return_value = self.model
+
+        def retrieve(query_text, *args, **kwargs):
+            if query_text == "壞掉":
+                raise RuntimeError("向量庫無法開啟")
+            return RETRIEVED
+
+        for target, value in (
+            ("LlmFactory", factory),
+            ("retrieve_documents", retrieve),
+            ("cache_store", lambda *args: None),
+            ("prime_query_embeddings", lambda queries: None),
+        ):
+            patcher = mock.patch.object(query, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def post_batch(self, queries, **extra):
+        response = self.post_sync(
+            query.EnterpriseBatchQueryView, {"queries": queries, "model_type": "local", **extra}
+        )
+        if response.status_code != 200:
+            return response, []
+        return response, [json.loads(line) for line in b"".join(response.streaming_content).decode("utf-8").splitlines()]
+
+    def test_ndjson_lines_then_summary(self):
+        response, lines = self.post_batch(["營收", "福利"])
+
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        answers, summary = lines[:-1], lines[-1]
+        self.assertEqual(sorted(line["index"] for line in answers), [0, 1])
+        for line in answers:
+            self.assertEqual(line["query"], ["營收", "福利"][line["index"]])
+            self.assertEqual(line["answer"], "營收成長二成")
+            self.assertEqual(line["retrieved_docs"], RETRIEVED)
+            self.assertFalse(line["cached"])
+            self.assertIn("llm", line["timings"])
+        self.assertEqual({k: summary[k] for k in ("done", "count", "failed")}, {"done": True, "count": 2, "failed": 0})
+
+    def test_failed_query_yields_error_line_without_aborting(self):
+        _, lines = self.post_batch(["營收", "壞掉", "福利"])
+
+        by_index = {line["index"]: line for line in lines[:-1]}
+        self.assertEqual(sorted(by_index), [0, 1, 2])
+        self.assertEqual(by_index[1], {"index": 1, "query": "壞掉", "error": "⚠️ 查詢失敗，請稍後再試。"})
+        self.assertEqual(by_index[2]["answer"], "營收成長二成")
+        self.assertEqual(lines[-1]["failed"], 1)
+
+    def test_concurrency_bounds_llm_calls(self):
+        _, lines = self.post_batch([f"問題{i}" for i in range(8)], concurrency=2)
+
+        self.assertEqual(lines[-1]["count"], 8)
+        self.assertLessEqual(self.model.max_active, 2)
+        self.assertGreaterEqual(self.model.max_active, 1)
+
+    def test_at_most_50_queries(self):
+        response, _ = self.post_batch([f"問題{i}" for i in range(51)])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("queries", response.data)
+
+        self.model.delay = 0
+        response, lines = self.post_batch([f"問題{i}" for i in range(50)], concurrency=16)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(lines[-1]["count"], 50)
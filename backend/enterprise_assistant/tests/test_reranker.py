@@ -0,0 +1,91 @@
+import sys
+import tempfile
+import types
+from unittest import mock
+
+from common.modules.processor.model_registry import registry
+from common.modules.processor.reranker import CrossEncoderReranker
+from common.modules.processor.vector_store import VectorStoreHandler
+from django.test import SimpleTestCase
+from enterprise_assistant.tests.test_vector_store import KeywordEmbedder
+from langchain_core.documents import Document
+
+
+class LengthCrossEncoder:
+    """ 以文字長度作為分數，記錄每次 predict 的批次 """
+
+    def __init__(self, model_name, max_length=512, device="cpu"):
+        self.batches = []
+
+    def predict(self, pairs, batch_size=32, show_progress_bar=False):
+        self.batches.append(list(pairs))
+        return [float(len(text)) for _, text in pairs]
+
+
+class RecordingReranker:
+    """ 記錄收到的候選數，分數最高者為內容最長的文件 """
+
+    def __init__(self):
+        self.candidates = []
+
+    def rerank(self, query, documents, top_k=5):
+        self.candidates.append(len(documents))
+        ranked = sorted(documents, key=lambda d: len(d.page_content), reverse=True)
+        return [(document, float(len(document.page_content))) for document in ranked[:top_k]]
+
+
+class CrossEncoderRerankerTests(SimpleTestCase):
+    def setUp(self):
+        fake = types.ModuleType("sentence_transformers")
+        fake.CrossEncoder = LengthCrossEncoder
+        patcher = mock.patch.dict(sys.modules, {"sentence_transformers": fake})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.reranker = CrossEncoderReranker("stub")
+
+    def test_rerank_orders_by_score_in_one_batch(self):
+        documents = [Document(page_content=text) for text in ("營收", "營收成長二成", "營收成長")]
+
+        ranked = self.reranker.rerank("營收", documents, top_k=2)
+
+        self.assertEqual([(d.page_content, s) for d, s in ranked], [("營收成長二成", 6.0), ("營收成長", 4.0)])
+        self.assertEqual(self.reranker.model.batches, [[("營收", "營收"), ("營收", "營收成長二成"), ("營收", "營收成長")]])
+
+    def test_empty_candidates_skip_the_model(self):
+        self.assertEqual(self.reranker.rerank("營收", []), [])
+        self.assertEqual(self.reranker.model.batches, [])
+
+
+class SearchRerankTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.addCleanup(registry.clear)
+        self.reranker = RecordingReranker()
+        for patcher in (
+            mock.patch.object(registry, "get_embedder", return_value=KeywordEmbedder()),
+            mock.patch.object(registry, "get_reranker", return_value=self.reranker),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.handler = VectorStoreHandler(db_path=tmp.name)
+        for i in range(6):
+            self.handler.add("營收" + "成長" * i, "text", "[1]", i + 1, "[]")
+
+    def test_rerank_scores_fetch_k_candidates_and_keeps_k(self):
+        for search_type in ("mmr", "hybrid"):
+            with self.subTest(search_type=search_type):
+                documents = self.handler.search(
+                    "營收", k=2, fetch_k=5, search_type=search_type, use_cache=False, rerank=True
+                )
+
+                self.assertEqual(self.reranker.candidates[-1], 5)
+                self.assertEqual(len(documents), 2)
+                lengths = [len(d.page_content) for d in documents]
+                self.assertEqual(lengths, sorted(lengths, reverse=True))
+
+    def test_without_rerank_the_model_is_not_used(self):
+        documents = self.handler.search("營收", k=2, fetch_k=5, use_cache=False)
+
+        self.assertEqual(len(documents), 2)
+        self.assertEqual(self.reranker.candidates, [])
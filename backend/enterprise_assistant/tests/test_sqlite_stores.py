@@ -0,0 +1,300 @@
+import os
+import tempfile
+from unittest import mock
+
+from common.modules.processor.answer_cache import SemanticAnswerCache
+from common.modules.processor.docstore import SqliteDocStore
+from common.modules.processor.embedding_cache import CachedEmbeddings, LruQueryEmbeddings
+from common.modules.processor.lexical_index import LexicalIndex
+from common.modules.processor.retrieval_cache import RetrievalCache
+from common.modules.processor.sqlite_store import SQLITE_MAX_PARAMS, in_chunks
+from common.modules.processor.summary_cache import SummaryCache
+from django.test import SimpleTestCase
+
+
+class CountingEmbedder:
+    """ 以文字長度當向量，記錄實際被計算的文字 """
+
+    def __init__(self):
+        self.seen = []
+
+    def embed_documents(self, texts):
+        self.seen.extend(texts)
+        return [[float(len(t)), 1.0] for t in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+class StoreTestCase(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def path(self, name):
+        return os.path.join(self.tmp.name, "nested", name)
+
+    def advance_clock(self, module):
+        """ 每次 time.time() 遞增 1 秒，last_used 的先後順序才穩定；測試可直接增加 self.now 模擬經過時間 """
+        self.now = 1_000_000.0
+
+        def tick():
+            self.now += 1
+            return self.now
+
+        patcher = mock.patch.object(module.time, "time", side_effect=tick)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class InChunksTests(SimpleTestCase):
+    def test_splits_at_parameter_limit(self):
+        parts = list(in_chunks(range(SQLITE_MAX_PARAMS * 2 + 1)))
+
+        self.assertEqual([len(part) for part, _ in parts], [SQLITE_MAX_PARAMS, SQLITE_MAX_PARAMS, 1])
+        self.assertEqual(parts[-1][1], "?")
+        self.assertEqual(list(in_chunks([])), [])
+
+
+class CachedEmbeddingsTests(StoreTestCase):
+    def test_hits_misses_and_batch_dedup(self):
+        embedder = CountingEmbedder()
+        cache = CachedEmbeddings(embedder, "m", path=self.path("embeddings.sqlite3"))
+
+        first = cache.embed_documents(["甲", "乙乙", "甲"])
+        second = cache.embed_documents(["甲", "乙乙"])
+
+        self.assertEqual(first, [[1.0, 1.0], [2.0, 1.0], [1.0, 1.0]])
+        self.assertEqual(second, first[:2])
+        self.assertEqual(embedder.seen, ["甲", "乙乙"])
+        # 與 LruQueryEmbeddings 相同：批次內重複的文字不需推論，記為 hit
+        self.assertEqual((cache.hits, cache.misses), (3, 2))
+        self.assertEqual(cache.stats()["entries"], 2)
+
+    def test_keys_are_normalized_and_scoped_by_model(self):
+        embedder = CountingEmbedder()
+        path = self.path("embeddings.sqlite3")
+        CachedEmbeddings(embedder, "m", path=path).embed_query("ＡＢＣ  d")
+
+        CachedEmbeddings(embedder, "m", path=path).embed_query("ABC d")
+        CachedEmbeddings(embedder, "other", path=path).embed_query("ABC d")
+
+        self.assertEqual(embedder.seen, ["ＡＢＣ  d", "ABC d"])
+
+    def test_evicts_least_recently_used(self):
+        from common.modules.processor import embedding_cache
+        self.advance_clock(embedding_cache)
+        embedder = CountingEmbedder()
+        cache = CachedEmbeddings(embedder, "m", path=self.path("embeddings.sqlite3"), max_entries=2)
+
+        cache.embed_query("a")
+        cache.embed_query("bb")
+        self.now += embedding_cache.DEFAULT_TOUCH_INTERVAL
+        cache.embed_query("a")  # a 變為最近使用
+        cache.embed_query("ccc")  # 淘汰 bb
+        cache.embed_query("a")
+        cache.embed_query("bb")
+
+        self.assertEqual(embedder.seen, ["a", "bb", "ccc", "bb"])
+        self.assertEqual(cache.stats()["entries"], 2)
+
+    def test_recent_hits_do_not_rewrite_last_used(self):
+        from common.modules.processor import embedding_cache
+        self.advance_clock(embedding_cache)
+        cache = CachedEmbeddings(CountingEmbedder(), "m", path=self.path("embeddings.sqlite3"))
+
+        def last_used():
+            return cache._conn.execute("SELECT last_used FROM embeddings").fetchone()[0]
+
+        cache.embed_query("a")
+        stored = last_used()
+        cache.embed_query("a")
+        self.assertEqual(last_used(), stored)
+
+        self.now += cache.touch_interval
+        cache.embed_query("a")
+        self.assertGreater(last_used(), stored)
+
+    def test_entry_count_survives_reopening(self):
+        path = self.path("embeddings.sqlite3")
+        CachedEmbeddings(CountingEmbedder(), "m", path=path).embed_documents(["a", "bb", "ccc"])
+
+        cache = CachedEmbeddings(CountingEmbedder(), "m", path=path, max_entries=3)
+        cache.embed_documents(["a", "dddd"])
+
+        self.assertEqual(cache.stats()["entries"], 3)
+        self.assertEqual(cache._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0], 3)
+
+
+class LruQueryEmbeddingsTests(SimpleTestCase):
+    def test_batch_and_single_queries_share_entries_and_counters(self):
+        embedder = CountingEmbedder()
+        lru = LruQueryEmbeddings(embedder, max_entries=10)
+        lru.embed_query("甲")
+
+        vectors = lru.embed_queries(["甲", "乙乙", "乙乙 ", "丙丙丙"])
+
+        self.assertEqual(vectors, [[1.0, 1.0], [2.0, 1.0], [2.0, 1.0], [3.0, 1.0]])
+        self.assertEqual(embedder.seen, ["甲", "乙乙", "丙丙丙"])
+        self.assertEqual((lru.hits, lru.misses), (2, 3))
+        lru.embed_query("丙丙丙")
+        self.assertEqual(lru.stats()["hits"], 3)
+
+
+class SqliteDocStoreTests(StoreTestCase):
+    def test_mget_mdelete_and_delete_document(self):
+        store = SqliteDocStore(self.path("docstore.sqlite3"))
+        keys = [f"doc{i}" for i in range(SQLITE_MAX_PARAMS + 5)]
+        store.mset([(key, f"內容 {key}") for key in keys], document_id=7)
+        store.mset([("other", "x")], document_id=8)
+
+        self.assertEqual(store.mget(keys + ["missing"]), [f"內容 {key}" for key in keys] + [None])
+        store.mdelete(keys[:SQLITE_MAX_PARAMS + 1])
+        self.assertEqual(store.mget([keys[0], keys[-1]]), [None, f"內容 {keys[-1]}"])
+
+        store.delete_document(7)
+        self.assertEqual(sorted(store.yield_keys()), ["other"])
+
+    def test_yield_keys_prefix_escapes_wildcards(self):
+        store = SqliteDocStore(self.path("docstore.sqlite3"))
+        store.mset([("a_1", "x"), ("ab1", "y"), ("a%2", "z")])
+
+        self.assertEqual(list(store.yield_keys("a_")), ["a_1"])
+        self.assertEqual(list(store.yield_keys("a%")), ["a%2"])
+
+
+class LexicalIndexTests(StoreTestCase):
+    def test_search_filters_and_deletes(self):
+        index = LexicalIndex(self.path("lexical.sqlite3"))
+        index.add(["c1", "c2", "c3"], ["營業收入成長", "員工福利制度", "營業成本下降"], [1, 2, 3],
+                  departments=["財務", "人資", "財務"])
+
+        self.assertEqual({chunk_id for chunk_id, _ in index.search("營業收入")}, {"c1", "c3"})
+        self.assertEqual(index.search("營業收入")[0][0], "c1")
+        self.assertEqual(index.search("營業", departments=["人資"]), [])
+        self.assertEqual(index.locate(["c2", "missing"]), {"c2": "人資"})
+        self.assertEqual(index.document_department(3), "財務")
+
+        index.delete_document(1)
+        self.assertEqual([chunk_id for chunk_id, _ in index.search("營業收入")], ["c3"])
+        index.delete_department("財務")
+        self.assertEqual(index.search("營業"), [])
+        self.assertEqual(index.document_department(3), None)
+
+    def test_common_terms_are_pruned_in_large_corpora(self):
+        index = LexicalIndex(self.path("lexical.sqlite3"), prune_min_docs=4)
+        index.add(["c1", "c2", "c3", "c4"], ["公司營收成長", "公司福利", "公司設備", "公司營運"], [1, 2, 3, 4])
+
+        # 「公司」出現在所有 chunk 中，只以其餘的詞計分
+        self.assertEqual({chunk_id for chunk_id, _ in index.search("公司營收")}, {"c1", "c4"})
+        self.assertEqual(index.search("公司營收")[0][0], "c1")
+        # 只有高頻詞時仍會回傳結果
+        self.assertEqual(len(index.search("公司")), 4)
+
+        small = LexicalIndex(self.path("small.sqlite3"))
+        small.add(["c1", "c2", "c3", "c4"], ["公司營收成長", "公司福利", "公司設備", "公司營運"], [1, 2, 3, 4])
+        self.assertEqual(len(small.search("公司營收")), 4)
+
+    def test_readding_a_chunk_replaces_its_postings(self):
+        index = LexicalIndex(self.path("lexical.sqlite3"))
+        index.add(["c1"], ["舊內容"], [1])
+        index.add(["c1"], ["新內容"], [1])
+
+        self.assertEqual(index.search("舊內"), [])
+        self.assertEqual([chunk_id for chunk_id, _ in index.search("新內")], ["c1"])
+
+
+class SemanticAnswerCacheTests(StoreTestCase):
+    def test_hit_requires_same_scope_and_similarity(self):
+        cache = SemanticAnswerCache(self.path("answers.sqlite3"), threshold=0.95)
+        scope = SemanticAnswerCache.scope_key("local", "llama3.2", True, "mmr", ["財務"], k=4)
+        cache.put(scope, "營收多少", [1.0, 0.0], "答案", [{"page": 1}], knowledge_ids=[3])
+
+        hit = cache.get(scope, [2.0, 0.01])
+        self.assertEqual((hit["answer"], hit["retrieved_docs"]), ("答案", [{"page": 1}]))
+        self.assertIsNone(cache.get(scope, [0.6, 0.8]))
+        other = SemanticAnswerCache.scope_key("local", "llama3.2", True, "mmr", ["財務"], k=8)
+        self.assertIsNone(cache.get(other, [1.0, 0.0]))
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_ttl_eviction_and_invalidation(self):
+        from common.modules.processor import answer_cache
+        self.advance_clock(answer_cache)
+        cache = SemanticAnswerCache(self.path("answers.sqlite3"), ttl_seconds=5, max_entries=2)
+        cache.put("s", "q1", [1.0, 0.0], "a1", [], knowledge_ids=[1])
+        cache.put("s", "q2", [0.0, 1.0], "a2", [], knowledge_ids=[2])
+        cache.put("t", "q3", [1.0, 0.0], "a3", [], knowledge_ids=[2])  # 超過 max_entries，淘汰 q1
+
+        self.assertIsNone(cache.get("s", [1.0, 0.0]))
+        self.assertEqual(cache.invalidate_knowledge(2), 2)
+        self.assertEqual(cache.stats()["entries"], 0)
+
+        cache.put("s", "q4", [1.0, 0.0], "a4", [])
+        self.assertEqual(cache.get("s", [1.0, 0.0])["answer"], "a4")
+        self.now += 10  # 超過 ttl_seconds
+        self.assertIsNone(cache.get("s", [1.0, 0.0]))
+        self.assertEqual(cache.stats()["entries"], 0)
+
+
+class RetrievalCacheTests(StoreTestCase):
+    def test_versions_and_epoch_invalidate(self):
+        cache = RetrievalCache(self.path("retrieval.sqlite3"))
+        key = RetrievalCache.make_key("營收", 4, 20, "mmr", departments=["財務"])
+        self.assertEqual(key, RetrievalCache.make_key("營收 ", 4, 20, "mmr", departments=["財務"]))
+
+        cache.put(key, ["c1", "c2"], [0.9, 0.8], [1, 2], epoch=cache.epoch())
+        self.assertEqual(cache.get(key), (["c1", "c2"], [0.9, 0.8]))
+
+        cache.bump_documents([3])  # 未被引用的文件不影響
+        self.assertIsNotNone(cache.get(key))
+        cache.bump_documents([2])
+        self.assertIsNone(cache.get(key))
+
+        cache.put(key, ["c1"], [0.9], [1], epoch=cache.epoch())
+        cache.bump_epoch()
+        self.assertIsNone(cache.get(key))
+        self.assertEqual((cache.hits, cache.stale), (2, 2))
+
+    def test_put_skipped_when_epoch_moved_and_eviction(self):
+        from common.modules.processor import retrieval_cache
+        self.advance_clock(retrieval_cache)
+        cache = RetrievalCache(self.path("retrieval.sqlite3"), max_entries=2)
+        epoch = cache.epoch()
+        cache.bump_epoch()
+        cache.put("k0", ["c"], [1.0], [1], epoch=epoch)
+        self.assertIsNone(cache.get("k0"))
+
+        for key in ("k1", "k2", "k3"):
+            cache.put(key, ["c"], [1.0], [1])
+        self.assertIsNone(cache.get("k1"))
+        self.assertIsNotNone(cache.get("k3"))
+
+
+class SummaryCacheTests(StoreTestCase):
+    def test_key_uses_image_bytes_not_paths(self):
+        first, second = self.path("a.png"), os.path.join(self.tmp.name, "b.png")
+        os.makedirs(os.path.dirname(first), exist_ok=True)
+        for path in (first, second):
+            with open(path, "wb") as f:
+                f.write(b"same image")
+
+        key = SummaryCache.make_key("gemma3:27b", "摘要", "system", [first])
+        self.assertEqual(key, SummaryCache.make_key("gemma3:27b", "摘要", "system", [second]))
+        self.assertEqual(key, SummaryCache.make_key("gemma3:27b", "摘要", "system", b"same image"))
+        self.assertNotEqual(key, SummaryCache.make_key("gemma3:4b", "摘要", "system", [first]))
+        self.assertNotEqual(key, SummaryCache.make_key("gemma3:27b", "摘要", "other", [first]))
+
+    def test_errors_are_not_cached_and_size_eviction(self):
+        from common.modules.processor import summary_cache
+        self.advance_clock(summary_cache)
+        cache = SummaryCache(self.path("summaries.sqlite3"), max_bytes=10)
+
+        cache.put("e", "m", "❌ 圖像分析錯誤")
+        self.assertIsNone(cache.get("e"))
+
+        cache.put("k1", "m", "aaaa")
+        cache.put("k2", "m", "bbbb")
+        self.assertEqual(cache.get("k1"), "aaaa")  # k1 變為最近使用
+        cache.put("k3", "m", "cccc")  # 超過 10 bytes，淘汰 k2
+        self.assertIsNone(cache.get("k2"))
+        self.assertEqual(cache.stats()["bytes"], 8)
@@ -0,0 +1,46 @@
+import asyncio
+import time
+from unittest import mock
+
+from common.modules.processor import summary_queue
+from common.modules.processor.summary_queue import SummaryQueue
+from django.test import SimpleTestCase
+
+
+async def echo_chat(model, messages, call_site, client=None, **kwargs):
+    """ prompt 含 slow 時模擬卡住的 Ollama 請求 """
+    prompt = messages[1]["content"]
+    await asyncio.sleep(30 if "slow" in prompt else 0.01)
+    return {"message": {"content": f"摘要：{prompt}"}}
+
+
+class SummaryQueueTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(summary_queue, "aollama_chat", echo_chat)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.queue = SummaryQueue("gemma3", "system", use_cache=False)
+
+    def test_join_fills_results_in_order_and_stops_the_loop(self):
+        filled = []
+        for prompt in ("a", "b", "c"):
+            self.queue.add([], prompt, filled.append)
+
+        summaries = self.queue.join()
+
+        self.assertEqual(summaries, ["摘要：a", "摘要：b", "摘要：c"])
+        self.assertEqual(filled, summaries)
+        self.assertIsNone(self.queue._thread)
+
+    def test_close_cancels_pending_work_and_joins_the_thread(self):
+        self.queue.add([], "slow")
+        thread = self.queue._thread
+
+        start = time.perf_counter()
+        self.queue.close()
+
+        self.assertLess(time.perf_counter() - start, 5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(len(self.queue), 0)
+        self.assertEqual(self.queue.join(), [])
+        self.queue.close()  # 可重複呼叫
@@ -0,0 +1,270 @@
+import json
+import os
+import tempfile
+from unittest import mock
+
+from common.modules.processor import model_registry
+from common.modules.processor.model_registry import DEFAULT_COLLECTION, registry
+from common.modules.processor.vector_store import DOC_ID_KEY, VectorStoreHandler, department_collection_name
+from django.test import SimpleTestCase
+from langchain_core.documents import Document
+
+KEYWORDS = ("營收", "福利", "設備")
+
+
+class KeywordEmbedder:
+    """ 依關鍵字出現與否產生向量，相同主題的 chunk 距離較近；embedded 記錄做過 embedding 的文字 """
+
+    def __init__(self):
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return [self.embed_query(t) for t in texts]
+
+    def embed_query(self, text):
+        return [1.0 if word in text else 0.0 for word in KEYWORDS] + [0.1]
+
+
+class VectorStoreHandlerTests(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.addCleanup(registry.clear)
+        self.embedder = KeywordEmbedder()
+        patcher = mock.patch.object(registry, "get_embedder", return_value=self.embedder)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.handler = VectorStoreHandler(db_path=tmp.name)
+
+    def collection_names(self):
+        return {c if isinstance(c, str) else c.name for c in registry.get_client(self.handler.db_path).list_collections()}
+
+    def test_constructing_a_handler_loads_nothing(self):
+        db_path = os.path.join(self.handler.db_path, "unused")
+        with mock.patch.object(registry, "get_embedder", side_effect=AssertionError("不應載入模型")), \
+                mock.patch.object(registry, "get_client", side_effect=AssertionError("不應開啟向量庫")):
+            handler = VectorStoreHandler(db_path=db_path)
+
+        self.assertEqual(handler.db_path, db_path)
+        self.assertFalse(os.path.exists(db_path))
+
+    def test_writes_are_routed_to_department_shards(self):
+        self.handler.add("營收成長", "text", "[1]", 1, "[]", department="財務")
+        self.handler.add("員工福利", "text", "[1]", 2, "[]")
+
+        self.assertEqual(
+            self.collection_names(), {DEFAULT_COLLECTION, department_collection_name("財務")}
+        )
+        finance = self.handler.shard("財務")._collection.get(include=["metadatas"])
+        self.assertEqual([m["department"] for m in finance["metadatas"]], ["財務"])
+        self.assertEqual(self.handler.vectorstore._collection.count(), 1)
+        self.assertEqual(self.handler.lexical.document_department(1), "財務")
+        self.assertEqual([c["content"] for c in self.handler.get_chunks_by_document_id(1)], ["營收成長"])
+
+    def test_fan_out_merges_shards_by_distance(self):
+        self.handler.add("營收成長", "text", "[1]", 1, "[]", department="財務")
+        self.handler.add("營收與福利", "text", "[1]", 2, "[]", department="人資")
+        self.handler.add("設備採購", "text", "[1]", 3, "[]", department="人資")
+        embedding = KeywordEmbedder().embed_query("營收")
+
+        merged = self.handler._dense_candidates(embedding, fetch_k=2)
+        self.assertEqual([c["content"] for c in merged], ["營收成長", "營收與福利"])
+        distances = [c["distance"] for c in merged]
+        self.assertEqual(distances, sorted(distances))
+
+        scoped = self.handler._dense_candidates(embedding, fetch_k=5, departments=["人資"])
+        self.assertEqual([c["content"] for c in scoped], ["營收與福利", "設備採購"])
+
+    def test_drop_department_removes_only_that_shard(self):
+        self.handler.add("營收成長", "text", "[1]", 1, "[]", department="財務")
+        self.handler.add("員工福利", "text", "[1]", 2, "[]", department="人資")
+
+        self.assertTrue(self.handler.drop_department("財務"))
+
+        self.assertNotIn(department_collection_name("財務"), self.collection_names())
+        self.assertEqual(self.handler.lexical.search("營收"), [])
+        self.assertIsNone(self.handler.lexical.document_department(1))
+        remaining = self.handler._dense_candidates(KeywordEmbedder().embed_query("營收"), fetch_k=5)
+        self.assertEqual([c["content"] for c in remaining], ["員工福利"])
+
+    def test_reshard_moves_legacy_chunks_into_department_shards(self):
+        # 分片前的舊資料：沒有 department metadata，也沒有記錄在 BM25 索引中
+        embedding = KeywordEmbedder().embed_query("營收成長")
+        self.handler.vectorstore._collection.add(
+            ids=["legacy-1", "legacy-2"], embeddings=[embedding, embedding],
+            documents=["營收成長", "未登記的文件"],
+            metadatas=[{"document_id": 1, "chunk_index": 0}, {"document_id": 9, "chunk_index": 0}]
+        )
+
+        self.assertEqual(self.handler.reshard({"1": "財務"}), 1)
+
+        self.assertEqual(self.handler.vectorstore._collection.get()["ids"], ["legacy-2"])
+        moved = self.handler.shard("財務")._collection.get(include=["metadatas"])
+        self.assertEqual(moved["ids"], ["legacy-1"])
+        self.assertEqual(moved["metadatas"][0]["department"], "財務")
+        self.assertEqual(self.handler.lexical.locate(["legacy-1"]), {"legacy-1": "財務"})
+        scoped = self.handler._dense_candidates(embedding, fetch_k=5, departments=["財務"])
+        self.assertEqual([c["id"] for c in scoped], ["legacy-1"])
+        self.assertEqual(self.handler.reshard({"1": "財務"}), 0)
+
+
+class UpsertChunkTests(SimpleTestCase):
+    """ upsert_chunk 原地更新：chunk id 與 metadata 不變，BM25 / mmap 索引與檢索快取同步 """
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.addCleanup(registry.clear)
+        self.embedder = KeywordEmbedder()
+        for patcher in (
+            mock.patch.object(registry, "get_embedder", return_value=self.embedder),
+            mock.patch.object(model_registry, "VECTOR_SEARCH_ENGINE", "mmap"),
+            mock.patch.object(model_registry, "RETRIEVAL_CACHE_ENABLED", True),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.handler = VectorStoreHandler(db_path=tmp.name)
+        self.handler.add("營收成長", "text", "[3]", 7, "[]", department="財務")
+        self.chunk_id = self.handler.shard("財務")._collection.get()["ids"][0]
+        self.embedder.embedded.clear()
+
+    def test_keeps_chunk_id_and_metadata(self):
+        result = self.handler.upsert_chunk(self.chunk_id, "設備採購")
+
+        self.assertEqual(result["id"], self.chunk_id)
+        self.assertEqual(result["old_content"], "營收成長")
+        stored = self.handler.shard("財務")._collection.get(include=["documents", "metadatas"])
+        self.assertEqual(stored["ids"], [self.chunk_id])
+        self.assertEqual(stored["documents"], ["設備採購"])
+        self.assertEqual(stored["metadatas"][0]["page_number"], "[3]")
+        self.assertEqual(stored["metadatas"][0]["document_id"], 7)
+        self.assertEqual(self.embedder.embedded, ["設備採購"])
+
+    def test_unchanged_content_skips_embedding(self):
+        cache = self.handler.retrieval_cache
+        cache.put("q", [self.chunk_id], [1.0], [7])
+
+        result = self.handler.upsert_chunk(self.chunk_id, "營收成長")
+
+        self.assertEqual(result["old_content"], "營收成長")
+        self.assertEqual(self.embedder.embedded, [])
+        self.assertIsNotNone(cache.get("q"))
+
+    def test_updates_lexical_mmap_and_retrieval_cache(self):
+        cache = self.handler.retrieval_cache
+        cache.put("q", [self.chunk_id], [1.0], [7])
+
+        self.handler.upsert_chunk(self.chunk_id, "設備採購")
+
+        self.assertEqual(self.handler.lexical.search("營收"), [])
+        self.assertEqual([chunk_id for chunk_id, _ in self.handler.lexical.search("設備")], [self.chunk_id])
+        self.assertEqual(self.handler.lexical.locate([self.chunk_id]), {self.chunk_id: "財務"})
+        hits = self.handler.mmap_index.search(self.embedder.embed_query("設備"), k=5)
+        self.assertEqual([(chunk_id, round(score, 3)) for chunk_id, score, _ in hits], [(self.chunk_id, 1.0)])
+        self.assertIsNone(cache.get("q"))
+
+    def test_unknown_chunk_returns_none(self):
+        self.assertIsNone(self.handler.upsert_chunk("missing", "設備採購"))
+        self.assertEqual(self.embedder.embedded, [])
+
+
+class ListChunksTests(SimpleTestCase):
+    """ list() 依 (頁碼, chunk_index) 排序後分頁，fields 控制回傳的內容 """
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.addCleanup(registry.clear)
+        patcher = mock.patch.object(registry, "get_embedder", return_value=KeywordEmbedder())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.handler = VectorStoreHandler(db_path=tmp.name)
+        # 寫入順序與頁碼順序不同
+        for page, content in [(3, "第三頁設備採購"), (1, "第一頁營收成長"), (2, "第二頁員工福利")]:
+            self.handler.add(content, "text", f"[{page}]", 5, '["年報.pdf"]')
+
+    def test_orders_by_position(self):
+        chunks = self.handler.list(5)
+
+        self.assertEqual([c["page_number"] for c in chunks], [[1], [2], [3]])
+        self.assertEqual([c["content"] for c in chunks], ["第一頁營收成長", "第二頁員工福利", "第三頁設備採購"])
+        self.assertEqual(chunks[0]["source"], ["年報.pdf"])
+
+    def test_offset_and_limit_page_through_the_ordered_chunks(self):
+        first = self.handler.list(5, offset=0, limit=2)
+        rest = self.handler.list(5, offset=2, limit=2)
+
+        self.assertEqual([c["content"] for c in first], ["第一頁營收成長", "第二頁員工福利"])
+        self.assertEqual([c["content"] for c in rest], ["第三頁設備採購"])
+        self.assertEqual(self.handler.list(5, offset=3, limit=2), [])
+
+    def test_first_chunk_matches_the_first_listed_chunk(self):
+        self.assertEqual(self.handler.first_chunk(5), "第一頁營收成長")
+        self.assertEqual(self.handler.first_chunk(5), self.handler.list(5, limit=1)[0]["content"])
+        self.assertEqual(self.handler.first_chunk(404), "")
+
+    def test_preview_and_metadata_fields(self):
+        preview = self.handler.list(5, limit=1, fields="preview", preview_chars=3)
+        metadata = self.handler.list(5, fields="metadata")
+
+        self.assertEqual(preview[0]["content"], "第一頁")
+        self.assertNotIn("content", metadata[0])
+        self.assertEqual([c["page_number"] for c in metadata], [[1], [2], [3]])
+
+
+class IngestTests(SimpleTestCase):
+    """ add_many / ingest_result：分批 embedding 與寫入，摘要項目的原始內容存入 docstore """
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.addCleanup(registry.clear)
+        self.embedder = KeywordEmbedder()
+        patcher = mock.patch.object(registry, "get_embedder", return_value=self.embedder)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.handler = VectorStoreHandler(db_path=tmp.name)
+
+    def test_add_many_batches_embedding_and_writes(self):
+        items = [
+            {"content": f"第{i}段營收", "media_type": "text", "page": f"[{i}]", "source": "[]"} for i in range(5)
+        ] + [{"content": "   ", "media_type": "text", "page": "[9]", "source": "[]"}]
+        collection = self.handler.vectorstore._collection
+
+        with mock.patch.object(self.embedder, "embed_documents", wraps=self.embedder.embed_documents) as embed, \
+                mock.patch.object(collection, "add", wraps=collection.add) as write:
+            written = self.handler.add_many(items, document_id=3, embed_batch_size=2, write_batch_size=3)
+
+        self.assertEqual(written, 5)
+        self.assertEqual([len(c.args[0]) for c in embed.call_args_list], [2, 1, 2])
+        self.assertEqual([len(c.kwargs["ids"]) for c in write.call_args_list], [3, 2])
+        self.assertEqual(collection.count(), 5)
+        self.assertEqual(len(self.handler.lexical.search("營收")), 5)
+
+    def test_ingest_result_routes_summaries_to_the_docstore(self):
+        result = {
+            "text": [{"content": "員工福利說明", "page": 1, "source": "年報.pdf"}],
+            "table": [{"content": "科目 | 金額\n營收 | 100", "summary": "營收表格摘要", "page": [2, 3],
+                       "source": ["年報.pdf"]}],
+        }
+
+        self.assertEqual(self.handler.ingest_result(result, document_id=4, department="財務"), 2)
+
+        stored = self.handler.shard("財務")._collection.get(include=["documents", "metadatas"])
+        by_type = {m["media_type"]: (doc, m) for doc, m in zip(stored["documents"], stored["metadatas"])}
+        text_doc, text_meta = by_type["text"]
+        table_doc, table_meta = by_type["table"]
+        self.assertEqual((json.loads(text_meta["page_number"]), json.loads(text_meta["source"])), ([1], ["年報.pdf"]))
+        self.assertNotIn(DOC_ID_KEY, text_meta)
+        self.assertEqual(table_meta["page_number"], "[2, 3]")
+        # 表格只對摘要做 embedding，完整內容存在 docstore
+        self.assertEqual(table_doc, "營收表格摘要")
+        self.assertNotIn("科目 | 金額\n營收 | 100", self.embedder.embedded)
+        self.assertEqual(self.handler.docstore.mget([table_meta[DOC_ID_KEY]]), ["科目 | 金額\n營收 | 100"])
+
+        resolved = self.handler.resolve_payloads([
+            Document(page_content=table_doc, metadata=table_meta), Document(page_content=text_doc, metadata=text_meta)
+        ])
+        self.assertEqual([d.page_content for d in resolved], ["科目 | 金額\n營收 | 100", "員工福利說明"])
+        self.assertEqual(resolved[0].metadata["summary"], "營收表格摘要")
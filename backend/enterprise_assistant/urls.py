@@ -1,5 +1,10 @@
 from django.urls import path
-from enterprise_assistant.views.query import EnterpriseQueryView
+from enterprise_assistant.views.query import (AnswerCacheStatsView,
+                                                AsyncEnterpriseQueryStreamView,
+                                                AsyncEnterpriseQueryView,
+                                                EnterpriseBatchQueryView,
+                                                EnterpriseQueryStreamView,
+                                                EnterpriseQueryView)
 
 from .views.chunk import ChunkDetailView, ChunkListCreateView
 from .views.knowledge import KnowledgeDetailView, KnowledgeListCreateView
@@ -15,4 +20,9 @@ urlpatterns = [
 
     # 查詢 API
     path("query_user/", EnterpriseQueryView.as_view(), name="enterprise-query"),
+    path("query_user/stream/", EnterpriseQueryStreamView.as_view(), name="enterprise-query-stream"),
+    path("query_user/batch/", EnterpriseBatchQueryView.as_view(), name="enterprise-query-batch"),
+    path("query_user/async/", AsyncEnterpriseQueryView.as_view(), name="enterprise-query-async"),
+    path("query_user/async/stream/", AsyncEnterpriseQueryStreamView.as_view(), name="enterprise-query-async-stream"),
+    path("query_user/cache/", AnswerCacheStatsView.as_view(), name="enterprise-query-cache"),
 ]
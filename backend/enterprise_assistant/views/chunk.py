@@ -1,10 +1,18 @@
+import base64
+from urllib import parse
+
 from common.modules.processor.vector_store import VectorStoreHandler
+from django.conf import settings
+from django.db.models import F
 from django.shortcuts import get_object_or_404
 from django.utils.timezone import now
 from enterprise_assistant.models import Knowledge
 from enterprise_assistant.serializers import ChunkSerializer
-from rest_framework import status
+from enterprise_assistant.signals import invalidate_knowledge_cache
+from rest_framework import pagination, status
+from rest_framework.exceptions import NotFound
 from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 from rest_framework.views import APIView
 
 
@@ -15,21 +23,98 @@ def standard_response(success=True, message="成功", data=None):
         "data": data
     }, status=status.HTTP_200_OK if success else status.HTTP_400_BAD_REQUEST)
 
-vectorstore = VectorStoreHandler("chroma_user_db")
+
+def get_vectorstore():
+    # handler 建立時不載入任何資源，embedding 模型與 collection 由 registry 共用，第一次使用時才載入
+    return VectorStoreHandler(settings.VECTOR_STORE_DB_PATH)
+
+
+class ChunkCursorPagination(pagination.BasePagination):
+    """
+    chunk 列表的 cursor 分頁：cursor 為編碼後的位置，依 (頁碼, chunk_index) 排序
+    """
+    page_size = 50
+    page_size_query_param = "size"
+    max_page_size = 200
+    cursor_query_param = "cursor"
+    invalid_cursor_message = "無效的 cursor"
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return 0
+        try:
+            querystring = base64.b64decode(encoded.encode("ascii")).decode("ascii")
+            return max(0, int(parse.parse_qs(querystring)["o"][0]))
+        except (TypeError, ValueError, KeyError, IndexError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, offset):
+        if offset <= 0:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        encoded = base64.b64encode(parse.urlencode({"o": offset}).encode("ascii")).decode("ascii")
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def paginate(self, request, fetch):
+        """
+        fetch(offset, limit) 回傳該範圍的 chunks；多取一筆用來判斷是否還有下一頁
+        """
+        self.base_url = request.build_absolute_uri()
+        self.offset = self.decode_cursor(request)
+        self.size = self.get_page_size(request)
+        chunks = fetch(self.offset, self.size + 1)
+        self.has_next = len(chunks) > self.size
+        return chunks[:self.size]
+
+    def get_next_link(self):
+        return self.encode_cursor(self.offset + self.size) if self.has_next else None
+
+    def get_previous_link(self):
+        return self.encode_cursor(max(0, self.offset - self.size)) if self.offset > 0 else None
+
 
 class ChunkListCreateView(APIView):
     """
-    GET: 取得特定文件 (knowledge_id) 的所有向量 chunks
+    GET: 取得特定文件 (knowledge_id) 的向量 chunks（cursor 分頁，依頁碼與 chunk_index 排序）
+    - size：每頁筆數（預設 50，最多 200）
+    - cursor：上一個回應的 next / previous
+    - fields：full（預設）/ preview（只回傳前 preview_chars 字）/ metadata（不含內容）
     """
+    pagination_class = ChunkCursorPagination
+
     def get(self, request, pk):
         knowledge = get_object_or_404(Knowledge, pk=pk)
-        chunks = vectorstore.list(document_id=knowledge.id)
+        fields = request.query_params.get("fields", "full")
+        if fields not in ("full", "preview", "metadata"):
+            return standard_response(False, "fields 只能是 full、preview 或 metadata")
+        try:
+            preview_chars = int(request.query_params.get("preview_chars", 200))
+        except ValueError:
+            return standard_response(False, "preview_chars 必須為整數")
+
+        paginator = self.pagination_class()
+        chunks = paginator.paginate(
+            request,
+            lambda offset, limit: get_vectorstore().list(
+                document_id=knowledge.id, offset=offset, limit=limit, fields=fields, preview_chars=preview_chars,
+                department=knowledge.department
+            )
+        )
 
         try:
             serializer = ChunkSerializer(chunks, many=True)
             return Response({
                 "knowledge_id": knowledge.id,
                 "title": knowledge.title,
+                "next": paginator.get_next_link(),
+                "previous": paginator.get_previous_link(),
                 "chunks": serializer.data
             }, status=status.HTTP_200_OK)
         except Exception as e:
@@ -46,32 +131,41 @@ class ChunkDetailView(APIView):
         content = request.data.get("content")
         if not content:
             return standard_response(False, "請提供新的內容")
-        
-        new_chunk_id = vectorstore.update(chunk_id, content)
 
-        if not new_chunk_id:
+        # 原地更新：chunk_id 不變，只對這一段重新 embedding
+        result = get_vectorstore().upsert_chunk(chunk_id, content)
+
+        if not result:
             return standard_response(False, "更新失敗或找不到 chunk")
 
-        # 根據新 chunk 的 metadata 找到 document_id
-        metadata = vectorstore.get_chunk_metadata_by_id(new_chunk_id)
-        knowledge_id = metadata.get("document_id") if metadata else None
+        knowledge_id = result["metadata"].get("document_id")
 
         if knowledge_id:
             try:
                 knowledge = Knowledge.objects.get(id=knowledge_id)
-                chunks = vectorstore.list(document_id=knowledge_id)
-                first_chunk = chunks[0]["content"] if chunks else ""
-                knowledge.content = first_chunk
-                knowledge.updated_at = now()
-                knowledge.chunk = len(chunks)
-                knowledge.save(update_fields=["content", "chunk", "updated_at"])
             except Knowledge.DoesNotExist:
                 return standard_response(False, "找不到對應的知識文件")
+            # chunk 數量不變；只有被修改的是預覽用的第一個 chunk 時才需要更新 content
+            update_fields = ["updated_at"]
+            if knowledge.content == result["old_content"]:
+                knowledge.content = content
+                update_fields.append("content")
+            knowledge.updated_at = now()
+            knowledge.save(update_fields=update_fields)
 
-        return standard_response(message="✅ 已更新 chunk")
+        return standard_response(message="✅ 已更新 chunk", data={"id": chunk_id})
 
     def delete(self, request, chunk_id):
-        deleted = vectorstore.delete_chunk_by_id(chunk_id)
-        if deleted:
-            return Response(status=status.HTTP_204_NO_CONTENT)
-        return standard_response(False, "刪除失敗")
+        vectorstore = get_vectorstore()
+        removed = vectorstore.delete_chunk(chunk_id)
+        if not removed:
+            return standard_response(False, "刪除失敗")
+
+        knowledge_id = removed["metadata"].get("document_id")
+        if knowledge_id:
+            Knowledge.objects.filter(id=knowledge_id, chunk__gt=0).update(chunk=F("chunk") - 1, updated_at=now())
+            invalidate_knowledge_cache(knowledge_id)
+            # 刪掉的是預覽用的第一個 chunk 時，才需要再讀取新的第一個 chunk
+            if Knowledge.objects.filter(id=knowledge_id, content=removed["content"]).exists():
+                Knowledge.objects.filter(id=knowledge_id).update(content=vectorstore.first_chunk(knowledge_id))
+        return Response(status=status.HTTP_204_NO_CONTENT)
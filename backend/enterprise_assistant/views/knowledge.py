@@ -16,7 +16,11 @@ from ..models import Knowledge
 from ..serializers import KnowledgeSerializer
 from .tasks import process_pdf_background
 
-vectorstore = VectorStoreHandler(db_path="chroma_user_db")
+
+def get_vectorstore():
+    # handler 建立時不載入任何資源，embedding 模型與 collection 由 registry 共用，第一次使用時才載入
+    return VectorStoreHandler(settings.VECTOR_STORE_DB_PATH)
+
 
 class KnowledgePagination(pagination.PageNumberPagination):
     page_size = 5
@@ -98,9 +102,10 @@ class KnowledgeDetailView(generics.RetrieveUpdateDestroyAPIView):
             knowledge.department = department
             knowledge.save()
 
-            vectorstore = VectorStoreHandler("chroma_user_db")
+            vectorstore = get_vectorstore()
             vectorstore.delete(knowledge_id)
-            vectorstore.add(content, media_type="text", page=1, document_id=knowledge_id, source="manual_update")
+            vectorstore.add(content, media_type="text", page=1, document_id=knowledge_id, source="manual_update",
+                            department=department)
 
             return standard_response(message="已更新並同步向量庫", data=KnowledgeSerializer(knowledge).data)
 
@@ -124,9 +129,11 @@ class KnowledgeDetailView(generics.RetrieveUpdateDestroyAPIView):
         new_file_path = knowledge.file.path
         processor = PdfProcessor(pdf_path=new_file_path, knowledge_id=str(knowledge_id))
         result = processor.optimized_process()
-        first_chunk = result["text"][0] if result["text"] else ""
-        knowledge.content = first_chunk
-        knowledge.chunk = sum(len(result[k]) for k in ["text", "table", "image"])
+        vectorstore = get_vectorstore()
+        vectorstore.delete(knowledge_id)
+        chunk_count = vectorstore.ingest_result(result, document_id=knowledge_id, department=knowledge.department)
+        knowledge.content = vectorstore.first_chunk(knowledge_id, department=knowledge.department)
+        knowledge.chunk = chunk_count
         knowledge.save()
 
         return standard_response(message="文件已更新並同步向量庫", data=KnowledgeSerializer(knowledge).data)
@@ -135,6 +142,7 @@ class KnowledgeDetailView(generics.RetrieveUpdateDestroyAPIView):
         knowledge = self.get_object()
         file_name = os.path.basename(knowledge.file.name) if knowledge.file else None
         knowledge_id = knowledge.id
+        department = knowledge.department
         filename_without_ext = os.path.splitext(file_name)[0]
 
         # 原始上傳檔案的完整路徑
@@ -147,8 +155,11 @@ class KnowledgeDetailView(generics.RetrieveUpdateDestroyAPIView):
             # 1️⃣ 刪除 DB 資料
             knowledge.delete()
 
-            # 2️⃣ 刪除向量資料庫內容
+            # 2️⃣ 刪除向量資料庫內容（部門已無其他文件時直接 drop 該部門的 collection）
+            vectorstore = get_vectorstore()
             vectorstore.delete(knowledge_id)
+            if department and not Knowledge.objects.filter(department=department).exists():
+                vectorstore.drop_department(department)
 
             # 3️⃣ 刪除 extract_data 資料夾
             if extract_dir and os.path.exists(extract_dir):
@@ -1,16 +1,229 @@
 # views/query.py
 
-from common.modules.ai.llm_factory import LlmFactory
-from common.modules.processor.vector_store import VectorStoreHandler
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager, nullcontext
+
+from asgiref.sync import sync_to_async
+from common.modules.ai.llm_factory import LlmFactory, model_label
+from common.modules.monitoring.metrics import stage_metrics
+from common.modules.monitoring.timing import StageTimer
+from common.modules.processor.answer_cache import SemanticAnswerCache
+from common.modules.processor.context_packer import pack_context, token_budget
+from common.modules.processor.executor import run_blocking
+from common.modules.processor.model_registry import registry
+from common.modules.processor.vector_store import CHUNK_OVERLAP, VectorStoreHandler
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from drf_spectacular.utils import extend_schema
+from enterprise_assistant.models import AdminUser
 from enterprise_assistant.serializers import (
-    EnterpriseQueryResponseSerializer, EnterpriseQuerySerializer)
+    EnterpriseBatchQuerySerializer, EnterpriseQueryResponseSerializer,
+    EnterpriseQuerySerializer)
 from langchain_core.prompts import PromptTemplate
+from rag_project.auth import authenticate_request
 from rest_framework import status
+from rest_framework.exceptions import APIException
 from rest_framework.generics import CreateAPIView
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+RETRIEVAL_K = 5
+# hybrid 檢索有 BM25 補足精確詞，向量部分只需較小的 fetch_k
+FETCH_K = {"mmr": 20, "hybrid": 10}
+# 批次查詢：同時進行的 LLM 生成數（Ollama / Azure 的併發上限），以及額外用於檢索的執行緒數
+BATCH_LLM_CONCURRENCY = int(os.environ.get("BATCH_LLM_CONCURRENCY", "2"))
+BATCH_RETRIEVAL_WORKERS = int(os.environ.get("BATCH_RETRIEVAL_WORKERS", "4"))
+
+
+def resolve_departments(request, departments):
+    """
+    未指定部門時，部門管理員只檢索自己部門的知識，超級管理員與一般使用者檢索全部
+    部門分片前上傳的知識需先執行 manage.py reshard_departments 搬到部門 collection，部門管理員才查得到
+    """
+    if departments:
+        return departments
+    if request.user.is_authenticated:
+        admin = AdminUser.objects.filter(user=request.user).first()
+        if admin and admin.department and not admin.is_superadmin:
+            return [admin.department]
+    return None
+
+
+NO_DOCUMENT_ANSWER = "我不知道，我沒有被提供相關的知識文件，你可以試試關閉檢索功能再問我問題!!感恩!!"
+
+
+def retrieval_options(validated_data):
+    """
+    由查詢參數取得 k / fetch_k / rerank；未指定 fetch_k 時依檢索方式使用預設值
+    """
+    k = validated_data.get("k", RETRIEVAL_K)
+    return {
+        "k": k,
+        "fetch_k": validated_data.get("fetch_k") or max(FETCH_K[validated_data["retrieval_mode"]], k),
+        "rerank": validated_data.get("rerank", False),
+    }
+
+
+def retrieve_documents(query, use_retrieval, retrieval_mode, departments, k=RETRIEVAL_K, fetch_k=None,
+                       rerank=False, timer=None):
+    """
+    檢索知識庫，回傳 [{"title", "page_number", "content"}, ...]；未啟用檢索時回傳空 list
+    """
+    retrieved_docs = []
+    if not use_retrieval:
+        return retrieved_docs
+
+    vectorstore = VectorStoreHandler(settings.VECTOR_STORE_DB_PATH)
+    documents = vectorstore.search(
+        query, k=k, fetch_k=fetch_k or FETCH_K[retrieval_mode], search_type=retrieval_mode,
+        departments=departments, rerank=rerank, timer=timer
+    )
+    if documents:
+        print(f"✅ [檢索結果] 找到 {len(documents)} 份文件")
+    for doc in documents:
+        page_number = doc.metadata.get("page_number", "未知頁碼")
+        title = doc.metadata.get("title", "未知文件")
+        retrieved_docs.append({
+            "id": doc.id,
+            "document_id": doc.metadata.get("document_id"),
+            "media_type": doc.metadata.get("media_type"),
+            "source": doc.metadata.get("source"),
+            # docstore 取回的完整內容（有 summary）不是切割後的 chunk，不與相鄰 chunk 合併
+            "chunk_index": None if "summary" in doc.metadata else doc.metadata.get("chunk_index"),
+            "title": title,
+            "page_number": page_number,
+            "content": doc.page_content
+        })
+        print(f"page_number {page_number} / title {title}: {doc.page_content[:100]}...")
+    return retrieved_docs
+
+
+def build_prompt(query, retrieved_docs, use_retrieval, model_type="local", model_name="llama3.2", timer=None):
+    if use_retrieval:
+        # 合併同頁相鄰 chunk、去除重疊文字，並依模型的 token 上限裁切
+        with timer.stage("pack") if timer else nullcontext():
+            context, stats = pack_context(
+                retrieved_docs, token_budget(model_type, model_name), max_overlap=CHUNK_OVERLAP
+            )
+        print(
+            f"📦 [Context] {stats['chunks']} 個 chunk → {stats['packed_segments']}/{stats['segments']} 段，"
+            f"{stats['raw_chars']} → {stats['context_chars']} 字，約 {stats['tokens']} tokens（上限 {stats['budget']}）"
+        )
+        prompt_template = PromptTemplate(
+            template="根據以下背景資訊回答問題：\n\n{context}\n\n問題：{query}\n回答：",
+            input_variables=["context", "query"]
+        )
+        return prompt_template.format(context=context, query=query)
+    prompt_template = PromptTemplate(
+        template="請根據你的知識範圍回答問題：\n\n問題：{query}\n回答：",
+        input_variables=["query"]
+    )
+    return prompt_template.format(query=query)
+
+
+def cache_lookup(query, scope, timer=None):
+    """
+    查詢語意回答快取，回傳 (命中項目或 None, 查詢向量)；快取停用時皆為 None
+    timer 分別記錄 embed（查詢向量）與 cache（比對）兩個階段
+    """
+    cache = registry.get_answer_cache(settings.VECTOR_STORE_DB_PATH)
+    if cache is None:
+        return None, None
+    with timer.stage("embed") if timer else nullcontext():
+        query_vector = registry.get_embedder().embed_query(query)
+    with timer.stage("cache") if timer else nullcontext():
+        cached = cache.get(scope, query_vector)
+    if cached:
+        print(f"🎯 [回答快取] 命中（相似度 {cached['similarity']:.3f}）：{cached['query'][:50]}")
+    return cached, query_vector
+
+
+def cache_store(scope, query, query_vector, answer, retrieved_docs):
+    cache = registry.get_answer_cache(settings.VECTOR_STORE_DB_PATH)
+    if cache is None or query_vector is None:
+        return
+    knowledge_ids = [doc["document_id"] for doc in retrieved_docs if doc.get("document_id") is not None]
+    cache.put(scope, query, query_vector, answer, retrieved_docs, knowledge_ids)
+
+
+@contextmanager
+def llm_slot(slots, timer):
+    """
+    slots（threading.Semaphore）不為 None 時，先取得名額才呼叫 LLM，等待時間記為 llm_queue
+    """
+    if slots is None:
+        yield
+        return
+    with timer.stage("llm_queue"):
+        slots.acquire()
+    try:
+        yield
+    finally:
+        slots.release()
+
+
+def answer_query(query, model_type, model_name, use_retrieval, retrieval_mode, departments, options, timer,
+                 llm_slots=None, call_site="query_user"):
+    """
+    同步查詢流程：回答快取 → 檢索 → 組 prompt → LLM，回傳 (answer, retrieved_docs, cached)
+    call_site 為 LLM 呼叫在 metrics 中的呼叫位置，與 observe_query 的 endpoint 相同
+    """
+    scope = SemanticAnswerCache.scope_key(
+        model_type, model_name, use_retrieval, retrieval_mode, departments, **options
+    )
+    cached, query_vector = cache_lookup(query, scope, timer)
+    if cached:
+        return cached["answer"], cached["retrieved_docs"], True
+
+    retrieved_docs = retrieve_documents(query, use_retrieval, retrieval_mode, departments, timer=timer, **options)
+    if use_retrieval and not retrieved_docs:
+        return NO_DOCUMENT_ANSWER, [], False
+
+    formatted_prompt = build_prompt(query, retrieved_docs, use_retrieval, model_type, model_name, timer)
+    print(f"📜 [Prompt] 送入 LLM:\n{formatted_prompt[:500]}...")
+
+    try:
+        model = LlmFactory().create(model_type, model_name)
+        with llm_slot(llm_slots, timer), timer.stage("llm"):
+            answer = model.generate(formatted_prompt, call_site=call_site)
+        print(f"[LLM 回應] {answer[:300]}...")
+        cache_store(scope, query, query_vector, answer, retrieved_docs)
+    except Exception as e:
+        print(f"[LLM 錯誤] {str(e)}")
+        answer = "⚠️ LLM 伺服器錯誤，請稍後再試。"
+
+    print(f"⏱ [耗時] {timer.summary()}")
+    return answer, retrieved_docs, False
+
+
+def observe_query(timer, endpoint, validated_data):
+    """
+    將各階段耗時記入 /metrics 的直方圖，依 endpoint / model / retrieval_mode 分開統計
+    """
+    stage_metrics.observe_timer(
+        timer,
+        endpoint=endpoint,
+        model=model_label(validated_data["model_type"], validated_data["model_name"]),
+        retrieval_mode=validated_data["retrieval_mode"] if validated_data["use_retrieval"] else "none"
+    )
+
+
+def prime_query_embeddings(queries):
+    """
+    以一次推論計算所有查詢的向量並放入查詢 LRU，之後各查詢的回答快取與檢索直接命中
+    查詢 LRU 停用（QUERY_EMBEDDING_LRU_SIZE=0）時不預先計算，各查詢各自 embed
+    """
+    embedder = registry.get_embedder()
+    if hasattr(embedder, "embed_queries"):
+        embedder.embed_queries(queries)
+
 
 @extend_schema(
     request=EnterpriseQuerySerializer,
@@ -30,60 +243,420 @@ class EnterpriseQueryView(CreateAPIView):
         model_type = serializer.validated_data["model_type"]
         model_name = serializer.validated_data["model_name"]
         use_retrieval = serializer.validated_data["use_retrieval"]
+        retrieval_mode = serializer.validated_data["retrieval_mode"]
+        departments = resolve_departments(request, serializer.validated_data.get("departments"))
+        options = retrieval_options(serializer.validated_data)
+        timer = StageTimer()
+
+        answer, retrieved_docs, _ = answer_query(
+            query, model_type, model_name, use_retrieval, retrieval_mode, departments, options, timer
+        )
+        response_data = {
+            "query": query,
+            "answer": answer,
+            "retrieved_docs": retrieved_docs,
+            "timings": timer.as_dict()
+        }
+        observe_query(timer, "query_user", serializer.validated_data)
+        response_serializer = EnterpriseQueryResponseSerializer(response_data)
+        return Response(
+            response_serializer.data, status=status.HTTP_200_OK,
+            headers={"Server-Timing": timer.server_timing()}
+        )
 
-        retrieved_docs = []
-        context = ""
-        vectorstore = VectorStoreHandler("chroma_user_db")
-
-        if use_retrieval:
-            retriever = vectorstore.vectorstore.as_retriever(search_type="mmr", search_kwargs={"k": 5, "fetch_k": 20})
-            documents = retriever.invoke(query)
-
-            if documents:
-                print(f"✅ [檢索結果] 找到 {len(documents)} 份文件")
-                for doc in documents:
-                    page_number = doc.metadata.get("page_number", "未知頁碼")
-                    title = doc.metadata.get("title", "未知文件")
-                    retrieved_docs.append({
-                        "title": title,
-                        "page_number": page_number,
-                        "content": doc.page_content
-                    })
-                    print(f"page_number {page_number} / title {title}: {doc.page_content[:100]}...")
-                context = "\n\n".join([doc["content"] for doc in retrieved_docs])
-            else:
-                answer = "我不知道，我沒有被提供相關的知識文件，你可以試試關閉檢索功能再問我問題!!感恩!!"
-                response_data = {
-                    "query": query,
-                    "answer": answer,
-                    "retrieved_docs": []
-                }
-                response_serializer = EnterpriseQueryResponseSerializer(response_data)
-                return Response(response_serializer.data, status=status.HTTP_200_OK)
 
-        prompt_template = PromptTemplate(
-            template="根據以下背景資訊回答問題：\n\n{context}\n\n問題：{query}\n回答：",
-            input_variables=["context", "query"]
-        ) if use_retrieval else PromptTemplate(
-            template="請根據你的知識範圍回答問題：\n\n問題：{query}\n回答：",
-            input_variables=["query"]
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+STREAM_ERROR_MESSAGE = "⚠️ 伺服器錯誤，請稍後再試。"
+
+
+def guarded_events(events):
+    """
+    包住 SSE 事件 generator：回應標頭已送出，之後任何階段（回答快取、檢索、組 prompt）失敗
+    都以 error 事件結束串流，client 不會只收到被截斷的連線
+    """
+    try:
+        yield from events
+    except Exception as e:
+        print(f"[串流錯誤] {str(e)}")
+        yield sse_event("error", {"message": STREAM_ERROR_MESSAGE})
+
+
+async def aguarded_events(events):
+    """ guarded_events 的 async 版本；外層被關閉或取消時一併關閉內層 generator """
+    try:
+        async for event in events:
+            yield event
+    except Exception as e:
+        print(f"[串流錯誤] {str(e)}")
+        yield sse_event("error", {"message": STREAM_ERROR_MESSAGE})
+    finally:
+        await events.aclose()
+
+
+def timed_tokens(tokens, timer):
+    """
+    逐段轉交模型串流，llm / first_token 只計入等待模型產生下一段的時間
+    yield 給 view 之後寫出給 client（含 client 讀取慢造成的背壓）的時間不計入；串流完整結束才記錄 llm
+    """
+    elapsed = 0.0
+    while True:
+        start = time.perf_counter()
+        try:
+            token = next(tokens)
+        except StopIteration:
+            break
+        finally:
+            elapsed += time.perf_counter() - start
+        if "first_token" not in timer.timings:
+            timer.record("first_token", elapsed * 1000)
+        yield token
+    timer.record("llm", elapsed * 1000)
+
+
+async def atimed_tokens(tokens, timer):
+    """ timed_tokens 的 async 版本 """
+    elapsed = 0.0
+    while True:
+        start = time.perf_counter()
+        try:
+            token = await tokens.__anext__()
+        except StopAsyncIteration:
+            break
+        finally:
+            elapsed += time.perf_counter() - start
+        if "first_token" not in timer.timings:
+            timer.record("first_token", elapsed * 1000)
+        yield token
+    timer.record("llm", elapsed * 1000)
+
+
+@extend_schema(
+    request=EnterpriseQuerySerializer,
+    responses={(200, "text/event-stream"): str},
+    summary="串流查詢企業知識庫 (Server-Sent Events)",
+    description="與 query_user 相同的參數；先送出 docs 事件（檢索結果），接著逐段送出 token 事件，最後為 done 事件。"
+)
+class EnterpriseQueryStreamView(APIView):
+    def post(self, request, *args, **kwargs):
+        serializer = EnterpriseQuerySerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        query = serializer.validated_data["query"]
+        model_type = serializer.validated_data["model_type"]
+        model_name = serializer.validated_data["model_name"]
+        use_retrieval = serializer.validated_data["use_retrieval"]
+        retrieval_mode = serializer.validated_data["retrieval_mode"]
+        departments = resolve_departments(request, serializer.validated_data.get("departments"))
+        options = retrieval_options(serializer.validated_data)
+        timer = StageTimer()
+
+        scope = SemanticAnswerCache.scope_key(
+            model_type, model_name, use_retrieval, retrieval_mode, departments, **options
+        )
+
+        def event_stream():
+            cached, query_vector = cache_lookup(query, scope, timer)
+            if cached:
+                yield sse_event("docs", {"query": query, "retrieved_docs": cached["retrieved_docs"]})
+                yield sse_event("token", {"token": cached["answer"]})
+                observe_query(timer, "query_user_stream", serializer.validated_data)
+                yield sse_event("done", {"cached": True, "timings": timer.as_dict()})
+                return
+
+            retrieved_docs = retrieve_documents(
+                query, use_retrieval, retrieval_mode, departments, timer=timer, **options
+            )
+            yield sse_event("docs", {"query": query, "retrieved_docs": retrieved_docs})
+            if use_retrieval and not retrieved_docs:
+                yield sse_event("token", {"token": NO_DOCUMENT_ANSWER})
+                observe_query(timer, "query_user_stream", serializer.validated_data)
+                yield sse_event("done", {"timings": timer.as_dict()})
+                return
+
+            formatted_prompt = build_prompt(query, retrieved_docs, use_retrieval, model_type, model_name, timer)
+            print(f"📜 [Prompt] 送入 LLM（串流）:\n{formatted_prompt[:500]}...")
+            tokens = None
+            try:
+                model = LlmFactory().create(model_type, model_name)
+                tokens = model.stream(formatted_prompt, call_site="query_user_stream")
+                answer = []
+                for token in timed_tokens(tokens, timer):
+                    answer.append(token)
+                    yield sse_event("token", {"token": token})
+                # 只有完整送出的回答才寫入快取（client 中途斷線不會執行到這裡）
+                cache_store(scope, query, query_vector, "".join(answer), retrieved_docs)
+                print(f"⏱ [耗時] {timer.summary()}")
+                observe_query(timer, "query_user_stream", serializer.validated_data)
+                yield sse_event("done", {"timings": timer.as_dict()})
+            except Exception as e:
+                print(f"[LLM 錯誤] {str(e)}")
+                yield sse_event("error", {"message": "⚠️ LLM 伺服器錯誤，請稍後再試。"})
+            finally:
+                # client 斷線時 Django 會關閉此 generator，連帶關閉模型的串流連線，釋放 worker
+                if tokens is not None:
+                    tokens.close()
+
+        response = StreamingHttpResponse(guarded_events(event_stream()), content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"  # 關閉 nginx 緩衝，token 才能即時送達
+        return response
+
+
+@extend_schema(
+    request=EnterpriseBatchQuerySerializer,
+    responses={(200, "application/x-ndjson"): str},
+    summary="批次查詢企業知識庫 (NDJSON 串流)",
+    description=(
+        "一次送出多個查詢，共用模型與檢索參數。所有查詢的向量以一次推論計算，檢索平行執行，"
+        "LLM 生成同時最多 concurrency 個；每完成一個查詢即送出一行 JSON"
+        "（index / query / answer / retrieved_docs / cached / timings，失敗時為 error），最後一行為 done。"
+    )
+)
+class EnterpriseBatchQueryView(APIView):
+    def post(self, request, *args, **kwargs):
+        serializer = EnterpriseBatchQuerySerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        queries = serializer.validated_data["queries"]
+        model_type = serializer.validated_data["model_type"]
+        model_name = serializer.validated_data["model_name"]
+        use_retrieval = serializer.validated_data["use_retrieval"]
+        retrieval_mode = serializer.validated_data["retrieval_mode"]
+        departments = resolve_departments(request, serializer.validated_data.get("departments"))
+        options = retrieval_options(serializer.validated_data)
+        concurrency = serializer.validated_data.get("concurrency") or BATCH_LLM_CONCURRENCY
+        llm_slots = threading.Semaphore(concurrency)
+
+        def run(index, query):
+            timer = StageTimer()
+            answer, retrieved_docs, cached = answer_query(
+                query, model_type, model_name, use_retrieval, retrieval_mode, departments, options, timer,
+                llm_slots=llm_slots, call_site="query_user_batch"
+            )
+            observe_query(timer, "query_user_batch", serializer.validated_data)
+            response_serializer = EnterpriseQueryResponseSerializer({
+                "query": query,
+                "answer": answer,
+                "retrieved_docs": retrieved_docs,
+                "timings": timer.as_dict()
+            })
+            return {"index": index, **response_serializer.data, "cached": cached}
+
+        def ndjson_stream():
+            timer = StageTimer()
+            # 只有回答快取或檢索會用到查詢向量
+            if use_retrieval or registry.get_answer_cache(settings.VECTOR_STORE_DB_PATH) is not None:
+                try:
+                    with timer.stage("embed"):
+                        prime_query_embeddings(queries)
+                except Exception as e:
+                    print(f"❌ [批次查詢] 查詢向量批次計算失敗，改為逐筆計算：{e}")
+
+            # LLM 名額由 llm_slots 限制；多出的執行緒讓後面的查詢在等待 LLM 時先完成檢索
+            pool = ThreadPoolExecutor(
+                max_workers=min(len(queries), concurrency + BATCH_RETRIEVAL_WORKERS),
+                thread_name_prefix="batch-query"
+            )
+            try:
+                futures = {pool.submit(run, index, query): index for index, query in enumerate(queries)}
+                failed = 0
+                for future in as_completed(futures):
+                    index = futures[future]
+                    try:
+                        line = future.result()
+                    except Exception as e:
+                        print(f"❌ [批次查詢] 第 {index} 筆查詢失敗：{e}")
+                        failed += 1
+                        line = {"index": index, "query": queries[index], "error": "⚠️ 查詢失敗，請稍後再試。"}
+                    yield json.dumps(line, ensure_ascii=False) + "\n"
+                print(f"📦 [批次查詢] {len(queries)} 筆完成（失敗 {failed} 筆），{timer.summary()}")
+                yield json.dumps(
+                    {"done": True, "count": len(queries), "failed": failed, "timings": timer.as_dict()},
+                    ensure_ascii=False
+                ) + "\n"
+            finally:
+                # client 斷線時 Django 會關閉此 generator：取消尚未開始的查詢，執行中的查詢完成後即結束
+                pool.shutdown(wait=False, cancel_futures=True)
+
+        response = StreamingHttpResponse(ndjson_stream(), content_type="application/x-ndjson")
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+
+@method_decorator(csrf_exempt, name="dispatch")  # 與 DRF APIView 相同，不對 API 呼叫做 CSRF 檢查
+class AsyncEnterpriseQueryView(View):
+    """
+    POST: query_user 的 async 版本，參數與回應格式相同
+    - LLM 呼叫以 ainvoke / httpx 非同步等待，不佔用 worker 執行緒
+    - embedding 與 Chroma 檢索在有上限的執行緒池中執行（BLOCKING_WORKERS）
+    - 以 DRF 相同的認證設定（Session / Basic）辨識使用者，部門範圍與同步版一致
+    需以 ASGI 部署（例如 uvicorn rag_project.asgi:application），一個 worker 即可同時服務多個查詢
+    """
+
+    async def post(self, request, *args, **kwargs):
+        try:
+            user_request = await sync_to_async(authenticate_request)(request)
+        except APIException as e:
+            return JsonResponse({"detail": e.detail}, status=e.status_code)
+        try:
+            data = json.loads(request.body or b"{}")
+        except ValueError:
+            return JsonResponse({"detail": "JSON 格式錯誤"}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = EnterpriseQuerySerializer(data=data)
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        query = serializer.validated_data["query"]
+        model_type = serializer.validated_data["model_type"]
+        model_name = serializer.validated_data["model_name"]
+        use_retrieval = serializer.validated_data["use_retrieval"]
+        retrieval_mode = serializer.validated_data["retrieval_mode"]
+        departments = await sync_to_async(resolve_departments)(
+            user_request, serializer.validated_data.get("departments")
+        )
+        options = retrieval_options(serializer.validated_data)
+        timer = StageTimer()
+
+        scope = SemanticAnswerCache.scope_key(
+            model_type, model_name, use_retrieval, retrieval_mode, departments, **options
+        )
+        cached, query_vector = await run_blocking(cache_lookup, query, scope, timer)
+        if cached:
+            return self.respond(query, cached["answer"], cached["retrieved_docs"], timer, serializer.validated_data)
+
+        retrieved_docs = await run_blocking(
+            retrieve_documents, query, use_retrieval, retrieval_mode, departments, timer=timer, **options
         )
+        if use_retrieval and not retrieved_docs:
+            return self.respond(query, NO_DOCUMENT_ANSWER, [], timer, serializer.validated_data)
 
-        formatted_prompt = prompt_template.format(context=context, query=query) if use_retrieval else prompt_template.format(query=query)
-        print(f"📜 [Prompt] 送入 LLM:\n{formatted_prompt[:500]}...")
+        formatted_prompt = build_prompt(query, retrieved_docs, use_retrieval, model_type, model_name, timer)
+        print(f"📜 [Prompt] 送入 LLM（async）:\n{formatted_prompt[:500]}...")
 
         try:
             model = LlmFactory().create(model_type, model_name)
-            answer = model.generate(formatted_prompt)
+            with timer.stage("llm"):
+                answer = await model.agenerate(formatted_prompt, call_site="query_user_async")
             print(f"[LLM 回應] {answer[:300]}...")
+            await run_blocking(cache_store, scope, query, query_vector, answer, retrieved_docs)
         except Exception as e:
             print(f"[LLM 錯誤] {str(e)}")
             answer = "⚠️ LLM 伺服器錯誤，請稍後再試。"
 
-        response_data = {
+        print(f"⏱ [耗時] {timer.summary()}")
+        return self.respond(query, answer, retrieved_docs, timer, serializer.validated_data)
+
+    @staticmethod
+    def respond(query, answer, retrieved_docs, timer, validated_data):
+        observe_query(timer, "query_user_async", validated_data)
+        response_serializer = EnterpriseQueryResponseSerializer({
             "query": query,
             "answer": answer,
-            "retrieved_docs": retrieved_docs
-        }
-        response_serializer = EnterpriseQueryResponseSerializer(response_data)
-        return Response(response_serializer.data, status=status.HTTP_200_OK)
+            "retrieved_docs": retrieved_docs,
+            "timings": timer.as_dict()
+        })
+        response = JsonResponse(response_serializer.data, json_dumps_params={"ensure_ascii": False})
+        response["Server-Timing"] = timer.server_timing()
+        return response
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class AsyncEnterpriseQueryStreamView(View):
+    """
+    POST: query_user/stream 的 async 版本，事件格式相同（docs / token / done / error）
+    - token 以 IModel.astream 非同步取得，串流期間不佔用 worker 執行緒
+    - client 斷線時 Django 取消回應的 task，取消會傳入 astream，模型的 HTTP 串流隨之關閉、停止生成
+    需以 ASGI 部署
+    """
+
+    async def post(self, request, *args, **kwargs):
+        try:
+            user_request = await sync_to_async(authenticate_request)(request)
+        except APIException as e:
+            return JsonResponse({"detail": e.detail}, status=e.status_code)
+        try:
+            data = json.loads(request.body or b"{}")
+        except ValueError:
+            return JsonResponse({"detail": "JSON 格式錯誤"}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = EnterpriseQuerySerializer(data=data)
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        query = serializer.validated_data["query"]
+        model_type = serializer.validated_data["model_type"]
+        model_name = serializer.validated_data["model_name"]
+        use_retrieval = serializer.validated_data["use_retrieval"]
+        retrieval_mode = serializer.validated_data["retrieval_mode"]
+        departments = await sync_to_async(resolve_departments)(
+            user_request, serializer.validated_data.get("departments")
+        )
+        options = retrieval_options(serializer.validated_data)
+        timer = StageTimer()
+
+        scope = SemanticAnswerCache.scope_key(
+            model_type, model_name, use_retrieval, retrieval_mode, departments, **options
+        )
+
+        async def event_stream():
+            cached, query_vector = await run_blocking(cache_lookup, query, scope, timer)
+            if cached:
+                yield sse_event("docs", {"query": query, "retrieved_docs": cached["retrieved_docs"]})
+                yield sse_event("token", {"token": cached["answer"]})
+                observe_query(timer, "query_user_async_stream", serializer.validated_data)
+                yield sse_event("done", {"cached": True, "timings": timer.as_dict()})
+                return
+
+            retrieved_docs = await run_blocking(
+                retrieve_documents, query, use_retrieval, retrieval_mode, departments, timer=timer, **options
+            )
+            yield sse_event("docs", {"query": query, "retrieved_docs": retrieved_docs})
+            if use_retrieval and not retrieved_docs:
+                yield sse_event("token", {"token": NO_DOCUMENT_ANSWER})
+                observe_query(timer, "query_user_async_stream", serializer.validated_data)
+                yield sse_event("done", {"timings": timer.as_dict()})
+                return
+
+            formatted_prompt = build_prompt(query, retrieved_docs, use_retrieval, model_type, model_name, timer)
+            print(f"📜 [Prompt] 送入 LLM（async 串流）:\n{formatted_prompt[:500]}...")
+            tokens = None
+            try:
+                model = LlmFactory().create(model_type, model_name)
+                tokens = model.astream(formatted_prompt, call_site="query_user_async_stream")
+                answer = []
+                async for token in atimed_tokens(tokens, timer):
+                    answer.append(token)
+                    yield sse_event("token", {"token": token})
+                await run_blocking(cache_store, scope, query, query_vector, "".join(answer), retrieved_docs)
+                print(f"⏱ [耗時] {timer.summary()}")
+                observe_query(timer, "query_user_async_stream", serializer.validated_data)
+                yield sse_event("done", {"timings": timer.as_dict()})
+            except Exception as e:
+                print(f"[LLM 錯誤] {str(e)}")
+                yield sse_event("error", {"message": "⚠️ LLM 伺服器錯誤，請稍後再試。"})
+            finally:
+                # CancelledError（client 斷線）不會被上面的 except 攔下，此處關閉模型的串流
+                if tokens is not None:
+                    await tokens.aclose()
+
+        response = StreamingHttpResponse(aguarded_events(event_stream()), content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+
+class AnswerCacheStatsView(APIView):
+    """
+    GET: 語意回答快取的命中率與項目數，以及查詢向量 LRU / embedding 快取的命中率（此 worker 行程的計數）
+    """
+
+    @extend_schema(summary="回答快取統計")
+    def get(self, request, *args, **kwargs):
+        cache = registry.get_answer_cache(settings.VECTOR_STORE_DB_PATH)
+        embeddings = registry.cache_stats()
+        if cache is None:
+            return Response({"enabled": False, "embeddings": embeddings}, status=status.HTTP_200_OK)
+        return Response({"enabled": True, **cache.stats(), "embeddings": embeddings}, status=status.HTTP_200_OK)
@@ -1,9 +1,8 @@
 # tasks.py
-import json
-
 from background_task import background
 from common.modules.processor.pdf_processor import PdfProcessor
 from common.modules.processor.vector_store import VectorStoreHandler
+from django.conf import settings
 from enterprise_assistant.models import Knowledge
 
 
@@ -17,22 +16,11 @@ def process_pdf_background(knowledge_id):
         processor = PdfProcessor(pdf_path=knowledge.file.path, knowledge_id=knowledge_id)
         result = processor.optimized_process()
 
-        vectorstore = VectorStoreHandler("chroma_user_db")
-
-        for media_type in ["text", "table", "image"]:
-            for item in result.get(media_type, []):
-                vectorstore.add(
-                    content=item["content"],
-                    page=json.dumps(item["page"] if isinstance(item["page"], list) else [item["page"]]),
-                    document_id=knowledge_id,
-                    media_type=media_type,
-                    source=json.dumps(item["source"] if isinstance(item["source"], list) else [item["source"]])
-                )
+        vectorstore = VectorStoreHandler(settings.VECTOR_STORE_DB_PATH)
+        chunk_count = vectorstore.ingest_result(result, document_id=knowledge_id, department=knowledge.department)
 
-        chunks = vectorstore.list(knowledge_id)
-        first_chunk = chunks[0]["content"] if chunks else ""
-        knowledge.content = first_chunk
-        knowledge.chunk = len(chunks)
+        knowledge.content = vectorstore.first_chunk(knowledge_id, department=knowledge.department)
+        knowledge.chunk = chunk_count
         knowledge.processing_status = "done"
         knowledge.save()
 
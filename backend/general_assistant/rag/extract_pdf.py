@@ -9,7 +9,8 @@ import io
 import torch
 from transformers import DetrImageProcessor, TableTransformerForObjectDetection
 from unstructured.partition.pdf import partition_pdf
-import ollama
+from common.modules.ai.llm_gateway import ollama_chat
+from common.modules.processor.summary_cache import cached_summary
 from difflib import SequenceMatcher
 
 ocr_engine = PaddleOCR(use_angle_cls=True, lang='ch')
@@ -94,15 +95,19 @@ def extract_title_above(image: Image.Image, box, ocr_engine, crop_height=200):
         return "\n".join([line[1][0] for line in ocr_result[0]]).strip()
     return ""
 
-def summarize_image(image_path, prompt):
-    try:
-        response = ollama.chat(
-            model='gemma3:4b',
-            messages=[{'role': 'user', 'content': prompt, 'images': [image_path]}]
-        )
-        return response['message']['content']
-    except Exception as e:
-        return f"❌ 圖像分析錯誤: {str(e)}"
+def summarize_image(image_path, prompt, use_cache=True):
+    def summarize():
+        try:
+            response = ollama_chat(
+                model='gemma3:4b',
+                messages=[{'role': 'user', 'content': prompt, 'images': [image_path]}],
+                call_site="extract_pdf.summarize_image"
+            )
+            return response['message']['content']
+        except Exception as e:
+            return f"❌ 圖像分析錯誤: {str(e)}"
+
+    return cached_summary('gemma3:4b', prompt, summarize, images=[image_path], use_cache=use_cache)
 
 def extract_table_and_summary(images, ocr_cache, save_dir="tables_valid"):
     output_dir = os.path.join(MEDIA_ROOT, save_dir)
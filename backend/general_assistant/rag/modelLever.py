@@ -8,12 +8,13 @@ from langchain_core.prompts import (
 )
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.messages import SystemMessage, HumanMessage
-from langchain_core.documents import Document
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from langchain_openai import ChatOpenAI
 from langchain_community.chat_models import ChatOllama
 from langchain.retrievers.multi_vector import MultiVectorRetriever
-from langchain_community.vectorstores import Chroma
-from langchain.storage import InMemoryStore
+
+from common.modules.ai.llm_gateway import ollama_chat
+from common.modules.processor.summary_cache import cached_summary
+from common.modules.processor.vector_store import DOC_ID_KEY, VectorStoreHandler
 
 import base64
 import uuid
@@ -33,44 +34,57 @@ def encode_image_base64(img_path):
         return base64.b64encode(img.read()).decode("utf-8")
 
 # === 圖片摘要處理 ===
-def interpret_image(img_base64, service="Ollama", model="gemma3:4b"):
+def interpret_image(img_base64, service="Ollama", model="gemma3:4b", use_cache=True):
     if service != "Ollama":
         raise NotImplementedError("目前僅支援 Ollama 圖片摘要")
 
-    image_path = f"/tmp/{uuid.uuid4().hex}.jpg"
-    with open(image_path, "wb") as f:
-        f.write(base64.b64decode(img_base64))
-
+    image_bytes = base64.b64decode(img_base64)
     prompt = "你是一位針對影像和圖片進行摘要的助手，請詳細描述這張圖片的內容，若是圖表請說明其趨勢與關鍵數據"
-    try:
-        response = ollama.chat(
+
+    def summarize():
+        image_path = f"/tmp/{uuid.uuid4().hex}.jpg"
+        with open(image_path, "wb") as f:
+            f.write(image_bytes)
+        try:
+            response = ollama_chat(
+                model=model,
+                messages=[{'role': 'user', 'content': prompt, 'images': [image_path]}],
+                call_site="modelLever.interpret_image"
+            )
+            return response['message']['content']
+        except Exception as e:
+            return f"❌ 圖像分析錯誤: {str(e)}"
+        finally:
+            if os.path.exists(image_path):
+                os.remove(image_path)
+
+    # 以解碼後的圖片內容計算快取 key，命中時不需寫出暫存檔
+    return cached_summary(model, prompt, summarize, images=[image_bytes], use_cache=use_cache)
+
+# === 使用 Ollama 的文字/表格摘要 ===
+def summarize_element_ollama(content, element_type, model="gemma3:4b", use_cache=True):
+    prompt = f"你是一位文本處理的助手，請根據以下內容進行摘要 {element_type}：\n{content}"
+
+    def summarize():
+        response = ollama_chat(
             model=model,
-            messages=[{'role': 'user', 'content': prompt, 'images': [image_path]}]
+            messages=[{'role': 'user', 'content': prompt}],
+            call_site="modelLever.summarize_element_ollama"
         )
         return response['message']['content']
-    except Exception as e:
-        return f"❌ 圖像分析錯誤: {str(e)}"
-    finally:
-        if os.path.exists(image_path):
-            os.remove(image_path)
-
-# === 使用 ollama.chat 的文字/表格摘要 ===
-def summarize_element_ollama(content, element_type, model="gemma3:4b"):
-    prompt = f"你是一位文本處理的助手，請根據以下內容進行摘要 {element_type}：\n{content}"
-    response = ollama.chat(
-        model=model,
-        messages=[{'role': 'user', 'content': prompt}]
-    )
-    return response['message']['content']
+
+    return cached_summary(model, prompt, summarize, use_cache=use_cache)
 
 # === 多模態摘要處理 ===
 def summarize_data_from_pdf(extract_data, service="Ollama", model="gemma3:4b", temp=0.8):
-    text_summaries = [summarize_element_ollama(t, "text", model=model) for t in extract_data.get("textElements", [])]
-    table_summaries = [summarize_element_ollama(t, "table", model=model) for t in extract_data.get("tableElements", [])]
+    # 元素可為字串或帶有 page / source 的 dict，dict 原樣保留在 payload 供 retrieverGenerator 寫入頁碼
+    content_of = lambda e: e["content"] if isinstance(e, dict) else e
+    text_summaries = [summarize_element_ollama(content_of(t), "text", model=model) for t in extract_data.get("textElements", [])]
+    table_summaries = [summarize_element_ollama(content_of(t), "table", model=model) for t in extract_data.get("tableElements", [])]
 
     image_summaries = []
     for path in extract_data.get("imgPath", []):
-        image_base64 = encode_image_base64(path)
+        image_base64 = encode_image_base64(content_of(path))
         result = interpret_image(image_base64, service, model)
         image_summaries.append(result)
 
@@ -81,27 +95,34 @@ def summarize_data_from_pdf(extract_data, service="Ollama", model="gemma3:4b", t
     }
 
 
-# === 可選：建立本地記憶體用的 retriever（非寫入向量庫） ===
-def retrieverGenerator(summarized_data):
-    vectorstore = Chroma(collection_name="summaries", embedding_function=OpenAIEmbeddings())
-    docstore = InMemoryStore()
-    id_key = "rec_id"
-    retriever = MultiVectorRetriever(vectorstore=vectorstore, docstore=docstore, id_key=id_key)
+# 通用小助手的摘要向量與原始內容另存一個向量庫（含 docstore），不會被企業知識庫的檢索查到
+GENERAL_SUMMARY_DB_PATH = "chroma_general_summaries"
+SUMMARY_MEDIA_TYPES = {"textSummaries": "text", "tableSummaries": "table", "imageSummaries": "image"}
 
-    for category in summarized_data:
-        summary = summarized_data[category]["summary"]
-        payload = summarized_data[category]["payload"]
-        media_type = summarized_data[category]["mediatype"]
-        doc_ids = [str(uuid.uuid4()) for _ in summary]
 
-        documents = []
-        for i, s in enumerate(summary):
-            metadata = {id_key: doc_ids[i], "mediaType": media_type}
-            if media_type == "image":
-                metadata["source"] = payload[i]
-            documents.append(Document(page_content=s, metadata=metadata))
-
-        retriever.vectorstore.add_documents(documents)
-        retriever.docstore.mset(list(zip(doc_ids, payload)))
+# === 建立持久化的多向量 retriever：摘要建立向量，檢索時回傳原始內容 ===
+def retrieverGenerator(summarized_data, document_id, db_path=GENERAL_SUMMARY_DB_PATH, source=""):
+    """
+    summarized_data 為 summarize_data_from_pdf 的結果；payload 可為字串或帶有 page / source 的 dict
+    （processData 的格式），以 ingest_result 的格式寫入：page / source 存為 JSON list，沒有頁碼時為空 list
+    """
+    handler = VectorStoreHandler(db_path=db_path)
+    retriever = MultiVectorRetriever(
+        vectorstore=handler.vectorstore, docstore=handler.docstore, id_key=DOC_ID_KEY
+    )
 
+    result = {"text": [], "table": [], "image": []}
+    for category, media_type in SUMMARY_MEDIA_TYPES.items():
+        data = summarized_data.get(category) or {}
+        for payload, summary in zip(data.get("payload", []), data.get("summary", [])):
+            element = payload if isinstance(payload, dict) else {"content": payload}
+            result[media_type].append({
+                "content": element["content"],
+                "summary": summary,
+                "page": element.get("page", []),
+                "source": element.get("source", element["content"] if media_type == "image" else source),
+            })
+
+    # 摘要向量與原始內容皆持久化，重啟後不需重新摘要
+    handler.ingest_result(result, document_id=document_id)
     return retriever
@@ -1,4 +1,5 @@
 import os
+from contextlib import nullcontext
 from PIL import Image
 from rest_framework import status
 from rest_framework.response import Response
@@ -8,6 +9,8 @@ from ..models import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_chroma import Chroma
+from langchain_core.documents import Document as LangchainDocument
+from common.modules.processor.model_registry import registry
 import ollama
 import fitz  # PyMuPDF
 import pdfplumber
@@ -20,6 +23,53 @@ embedder = HuggingFaceEmbeddings(model_name="sentence-transformers/paraphrase-mu
 CHROMA_user_DB_PATH = "chroma_user_db"
 user_vectorstore = Chroma(persist_directory=CHROMA_user_DB_PATH, embedding_function=embedder)
 text_splitter = RecursiveCharacterTextSplitter(chunk_size=512, chunk_overlap=128)
+# 檢索結果快取（與企業知識庫的 embedding 模型不同，使用獨立的快取檔）
+retrieval_cache = registry.get_retrieval_cache(CHROMA_user_DB_PATH, name="retrieval_cache_general")
+
+
+def invalidate_retrieval_cache(document_ids=(), new_chunks=False):
+    """
+    新增 chunk 時遞增 epoch，更新/刪除時遞增文件版本號，使引用的快取結果過期
+    """
+    if retrieval_cache is None:
+        return
+    if new_chunks:
+        retrieval_cache.bump_epoch()
+    retrieval_cache.bump_documents(document_ids)
+
+
+def retrieve_from_general_vectorstore(query, k=5, fetch_k=20, timer=None):
+    """
+    MMR 檢索，回傳 langchain Document list；相同查詢命中快取時只依 chunk id 讀回內容
+    timer（StageTimer）分別記錄 embed 與 retrieve 兩個階段的耗時
+    """
+    key = epoch = None
+    if retrieval_cache is not None:
+        with timer.stage("retrieve") if timer else nullcontext():
+            key = retrieval_cache.make_key(query, k, fetch_k, "mmr")
+            cached = retrieval_cache.get(key)
+            if cached:
+                chunk_ids, _ = cached
+                result = user_vectorstore._collection.get(ids=chunk_ids, include=["documents", "metadatas"])
+                found = {
+                    chunk_id: LangchainDocument(id=chunk_id, page_content=text, metadata=meta or {})
+                    for chunk_id, text, meta in zip(result["ids"], result["documents"], result["metadatas"])
+                }
+                if all(chunk_id in found for chunk_id in chunk_ids):
+                    print(f"🎯 [檢索快取] 命中：{query[:50]}")
+                    return [found[chunk_id] for chunk_id in chunk_ids]
+            epoch = retrieval_cache.epoch()
+
+    with timer.stage("embed") if timer else nullcontext():
+        embedding = embedder.embed_query(query)
+    with timer.stage("retrieve") if timer else nullcontext():
+        documents = user_vectorstore.max_marginal_relevance_search_by_vector(embedding, k=k, fetch_k=fetch_k)
+    if retrieval_cache is not None and all(doc.id for doc in documents):
+        retrieval_cache.put(
+            key, [doc.id for doc in documents], [None] * len(documents),
+            [doc.metadata.get("document_id") for doc in documents], epoch=epoch
+        )
+    return documents
 
 # 儲存向量庫
 def add_to_general_vectorstore(content, page_number=1, document_id=None, media_type="text", source=None):
@@ -38,12 +88,14 @@ def add_to_general_vectorstore(content, page_number=1, document_id=None, media_t
             meta["source"] = source
         metadata.append(meta)
     user_vectorstore.add_texts(chunks, metadatas=metadata)
+    invalidate_retrieval_cache([document_id], new_chunks=True)
     return True
 
     
 def delete_from_general_vectorstore(document_id):
     try:
         user_vectorstore._collection.delete(where={"document_id": document_id})
+        invalidate_retrieval_cache([document_id])
         print(f"✅ 已刪除 document_id={document_id} 的向量資料")
         return True
     except Exception as e:
@@ -138,6 +190,8 @@ class ChunkDetailView(APIView):
                 [content],
                 metadatas=[metadata]
             )
+            # 更新會產生新的 chunk id
+            invalidate_retrieval_cache([metadata.get("document_id")], new_chunks=True)
 
             # 嘗試更新 document 的 updated_at 時間
             document_id = metadata.get("document_id")
@@ -173,6 +227,7 @@ class ChunkDetailView(APIView):
 
             document_id = metadata.get("document_id", "未知")
             user_vectorstore._collection.delete(ids=[chunk_id])
+            invalidate_retrieval_cache([metadata.get("document_id")])
             print(f"🗑 已刪除 chunk（ID: {chunk_id}, document_id: {document_id}）")
 
             return Response({"message": "✅ 已刪除 chunk"}, status=status.HTTP_204_NO_CONTENT)
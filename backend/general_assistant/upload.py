@@ -2,7 +2,8 @@
 
 import os
 import base64
-import ollama
+from common.modules.ai.llm_gateway import ollama_chat
+from common.modules.processor.summary_cache import cached_summary
 from unstructured.partition.pdf import partition_pdf
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_huggingface import HuggingFaceEmbeddings
@@ -15,34 +16,45 @@ user_vectorstore = Chroma(persist_directory=CHROMA_USER_DB_PATH, embedding_funct
 text_splitter = RecursiveCharacterTextSplitter(chunk_size=512, chunk_overlap=128)
 
 # 使用 Gemma3 模型摘要文字或表格
-def summarize_text_or_table(element, element_type):
+def summarize_text_or_table(element, element_type, use_cache=True):
     print(element, ":", element_type)
     prompt = f"你是一位文本處理的助手，請根據以下內容進行摘要 {element_type}:\n{element}"
-    response = ollama.chat(
-        model='gemma3:4b',
-        messages=[{
-            'role': 'user',
-            'content': prompt,
-        }]
-    )
-    print(response.message.content)
-    return response.message.content
 
-# 使用 Gemma3 模型摘要圖片
-def summarize_image(image_path):
-    prompt = "你是一位針對影像和圖片進行摘要的助手，請詳細描述這張圖片的內容，若是圖表請說明其趨勢與關鍵數據"
-    try:
-        response = ollama.chat(
+    def summarize():
+        response = ollama_chat(
             model='gemma3:4b',
             messages=[{
                 'role': 'user',
                 'content': prompt,
-                'images': [image_path]
-            }]
+            }],
+            call_site="upload.summarize_text_or_table"
         )
-        return response['message']['content']
-    except Exception as e:
-        return f"\u274c Gemma3 \u5716\u50cf\u5206\u6790\u932f\u8aa4: {str(e)}"
+        return response.message.content
+
+    summary = cached_summary('gemma3:4b', prompt, summarize, use_cache=use_cache)
+    print(summary)
+    return summary
+
+# 使用 Gemma3 模型摘要圖片
+def summarize_image(image_path, use_cache=True):
+    prompt = "你是一位針對影像和圖片進行摘要的助手，請詳細描述這張圖片的內容，若是圖表請說明其趨勢與關鍵數據"
+
+    def summarize():
+        try:
+            response = ollama_chat(
+                model='gemma3:4b',
+                messages=[{
+                    'role': 'user',
+                    'content': prompt,
+                    'images': [image_path]
+                }],
+                call_site="upload.summarize_image"
+            )
+            return response['message']['content']
+        except Exception as e:
+            return f"\u274c Gemma3 \u5716\u50cf\u5206\u6790\u932f\u8aa4: {str(e)}"
+
+    return cached_summary('gemma3:4b', prompt, summarize, images=[image_path], use_cache=use_cache)
 
 # 將資料加入向量庫
 def add_to_user_vectorstore(file_path, title, content, page_number=1, knowledge_id=None):
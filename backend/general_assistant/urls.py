@@ -1,6 +1,6 @@
 from django.urls import path
 from django.urls import path
-from .views import DocumentListCreateView, DocumentDetailView,UserQueryView
+from .views import DocumentListCreateView, DocumentDetailView,UserQueryView, AsyncUserQueryView
 from .rag.vectorstores import (
     ChunkListCreateView,
     ChunkDetailView
@@ -17,4 +17,6 @@ urlpatterns = [
     path("document/chunk/<str:chunk_id>/", ChunkDetailView.as_view(), name="chunk-detail"),
     # 查詢 API（LLM + RAG）
     path("query_user/", UserQueryView.as_view(), name="query-user"),
+    # async 查詢 API（query_user/ 已被企業知識庫的路由使用，另取路徑）
+    path("query_general/async/", AsyncUserQueryView.as_view(), name="query-general-async"),
 ]
\ No newline at end of file
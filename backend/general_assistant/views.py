@@ -12,10 +12,21 @@ from django.core.files.storage import default_storage
 from rest_framework.views import APIView
 from langchain_core.prompts import PromptTemplate
 import uuid
-import ollama
 import requests
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
+import json
+from django.http import JsonResponse
+from django.utils.decorators import method_decorator
+from asgiref.sync import sync_to_async
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from common.modules.ai.llm_gateway import aollama_chat, ollama_chat
+from common.modules.monitoring.metrics import stage_metrics
+from common.modules.monitoring.timing import StageTimer
+from common.modules.processor.executor import run_blocking
+from rag_project.auth import authenticate_request
+from rest_framework.exceptions import APIException
 import os
 from django.conf import settings
 from django.core.files.storage import default_storage
@@ -24,6 +35,7 @@ from .rag.vectorstores import (
     add_to_general_vectorstore,
     delete_from_general_vectorstore,
     list_from_general_vectorstore,
+    retrieve_from_general_vectorstore,
 )
 
 class AskImageView(APIView):
@@ -58,13 +70,14 @@ class AskImageView(APIView):
                 f.write(chunk)
 
         try:
-            response = ollama.chat(
+            response = ollama_chat(
                 model='gemma3:4b',
                 messages=[{
                     'role': 'user',
                     'content': question,
                     'images': [temp_path]
-                }]
+                }],
+                call_site="ask_image"
             )
             answer = response['message']['content']
         except Exception as e:
@@ -243,17 +256,70 @@ class UserQueryView(APIView):
         if not query:
             return Response({"error": "請提供查詢內容"}, status=status.HTTP_400_BAD_REQUEST)
 
-        context = retrieve_from_chroma(query)
-        prompt = PromptTemplate(template="根據以下內容回答問題：\n\n{context}\n\n問題：{query}\n回答：", input_variables=["context", "query"])
-        formatted_prompt = prompt.format(context=context, query=query)
+        timer = StageTimer()
+        documents = retrieve_from_general_vectorstore(query, timer=timer)
+        with timer.stage("prompt"):
+            context = "\n\n".join(doc.page_content for doc in documents)
+            prompt = PromptTemplate(template="根據以下內容回答問題：\n\n{context}\n\n問題：{query}\n回答：", input_variables=["context", "query"])
+            formatted_prompt = prompt.format(context=context, query=query)
 
         try:
-            response = ollama.chat(
-                model='gemma3:4b',
-                messages=[{'role': 'user', 'content': formatted_prompt}]
-            )
+            with timer.stage("llm"):
+                response = ollama_chat(
+                    model='gemma3:4b',
+                    messages=[{'role': 'user', 'content': formatted_prompt}],
+                    call_site="query_general"
+                )
             answer = response['message']['content']
         except Exception as e:
             return Response({"error": f"Gemma3 查詢錯誤: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        return Response({"query": query, "answer": answer, "context": context})
+        stage_metrics.observe_timer(timer, endpoint="query_general", model="local/gemma3:4b", retrieval_mode="mmr")
+        return Response(
+            {"query": query, "answer": answer, "context": context},
+            headers={"Server-Timing": timer.server_timing()}
+        )
+
+
+@method_decorator(csrf_exempt, name="dispatch")  # 與 DRF APIView 相同，不對 API 呼叫做 CSRF 檢查
+class AsyncUserQueryView(View):
+    """
+    UserQueryView 的 async 版本：檢索在有上限的執行緒池中執行，Gemma3 以 ollama.AsyncClient 非同步呼叫
+    """
+
+    async def post(self, request):
+        # 與 DRF 的 UserQueryView 使用相同的認證設定，錯誤的帳密同樣回傳 403
+        try:
+            await sync_to_async(authenticate_request)(request)
+        except APIException as e:
+            return JsonResponse({"error": str(e.detail)}, status=e.status_code)
+        try:
+            data = json.loads(request.body or b"{}")
+        except ValueError:
+            return JsonResponse({"error": "JSON 格式錯誤"}, status=status.HTTP_400_BAD_REQUEST)
+        query = data.get("query")
+        if not query:
+            return JsonResponse({"error": "請提供查詢內容"}, status=status.HTTP_400_BAD_REQUEST)
+
+        timer = StageTimer()
+        documents = await run_blocking(retrieve_from_general_vectorstore, query, timer=timer)
+        with timer.stage("prompt"):
+            context = "\n\n".join(doc.page_content for doc in documents)
+            prompt = PromptTemplate(template="根據以下內容回答問題：\n\n{context}\n\n問題：{query}\n回答：", input_variables=["context", "query"])
+            formatted_prompt = prompt.format(context=context, query=query)
+
+        try:
+            with timer.stage("llm"):
+                response = await aollama_chat(
+                    model='gemma3:4b',
+                    messages=[{'role': 'user', 'content': formatted_prompt}],
+                    call_site="query_general_async"
+                )
+            answer = response['message']['content']
+        except Exception as e:
+            return JsonResponse({"error": f"Gemma3 查詢錯誤: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        stage_metrics.observe_timer(timer, endpoint="query_general_async", model="local/gemma3:4b", retrieval_mode="mmr")
+        response = JsonResponse({"query": query, "answer": answer, "context": context}, json_dumps_params={"ensure_ascii": False})
+        response["Server-Timing"] = timer.server_timing()
+        return response
@@ -0,0 +1,85 @@
+"""
+比較同步 (query_user/) 與 async (query_user/async/) 查詢 API 在併發下的吞吐量與延遲
+
+先以單一 ASGI worker 啟動服務，讓兩個端點在相同條件下比較：
+    uvicorn rag_project.asgi:application --workers 1 --port 8000
+
+同步 view 在 ASGI 下會被放到執行緒中執行（同一時間只有一個 sync 執行緒，thread_sensitive），
+LLM 等待期間整個 worker 都被佔住；async view 則在等待 Ollama / Azure 時釋放 event loop
+
+用法：
+    python load_test_query.py                               # 預設併發 1, 5, 10, 20
+    python load_test_query.py --concurrency 10 --requests 50 --use-retrieval
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+QUERIES = [
+    "群益證券的發言人是誰？",
+    "公司的總公司地址與電話",
+    "112年度的營業收入與稅後淨利",
+    "實收資本額減少到多少？",
+    "董事會成員與獨立董事",
+]
+
+
+async def run_level(client, url, concurrency, total, payload):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+
+    async def one(i):
+        nonlocal errors
+        async with semaphore:
+            # 每個請求的查詢略有不同，避免全部命中回答快取
+            body = {**payload, "query": f"{QUERIES[i % len(QUERIES)]}（#{i}）"}
+            t = time.perf_counter()
+            try:
+                response = await client.post(url, json=body)
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - t)
+            except httpx.HTTPError as e:
+                errors += 1
+                print(f"  ❌ {e}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    p95 = latencies[max(int(len(latencies) * 0.95) - 1, 0)] if latencies else 0.0
+    median = statistics.median(latencies) if latencies else 0.0
+    print(f"  併發 {concurrency:>3}：{len(latencies)}/{total} 成功，{elapsed:.1f}s，"
+          f"{len(latencies) / elapsed:.2f} req/s，p50 {median:.2f}s，p95 {p95:.2f}s，錯誤 {errors}")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000/api/")
+    parser.add_argument("--endpoints", nargs="+", default=["query_user/", "query_user/async/"])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 5, 10, 20])
+    parser.add_argument("--requests", type=int, default=20, help="每個併發等級送出的請求數")
+    parser.add_argument("--model-type", default="local")
+    parser.add_argument("--model-name", default="llama3.2")
+    parser.add_argument("--use-retrieval", action="store_true")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    args = parser.parse_args()
+
+    payload = {
+        "model_type": args.model_type,
+        "model_name": args.model_name,
+        "use_retrieval": args.use_retrieval,
+    }
+    limits = httpx.Limits(max_connections=max(args.concurrency), max_keepalive_connections=max(args.concurrency))
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        for endpoint in args.endpoints:
+            print(f"\n[{endpoint}]")
+            for concurrency in args.concurrency:
+                await run_level(client, endpoint, concurrency, args.requests, payload)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,20 @@
+from rest_framework import exceptions, status
+from rest_framework.views import APIView
+
+
+def authenticate_request(request):
+    """
+    async view（一般 Django View）不經過 DRF 的 APIView，以相同的 DEFAULT_AUTHENTICATION_CLASSES
+    （Session / Basic）認證，回傳帶有 user 的 DRF Request；需在同步環境呼叫（sync_to_async）
+    認證失敗時拋出 APIException，狀態碼與 APIView.handle_exception 相同
+    """
+    view = APIView()
+    drf_request = view.initialize_request(request)
+    try:
+        view.perform_authentication(drf_request)
+    except (exceptions.NotAuthenticated, exceptions.AuthenticationFailed) as exc:
+        # 第一個認證方式沒有 WWW-Authenticate header（SessionAuthentication）時回傳 403
+        if not view.get_authenticate_header(drf_request):
+            exc.status_code = status.HTTP_403_FORBIDDEN
+        raise
+    return drf_request
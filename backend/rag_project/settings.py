@@ -23,6 +23,10 @@ MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 CORS_ALLOW_ALL_ORIGINS = True  # 測試環境允許所有請求
 CSRF_TRUSTED_ORIGINS = ["http://127.0.0.1:8000", "http://localhost:3000"]
 
+# 向量庫設定：VECTOR_STORE_WARMUP=1 時於 worker 啟動時預先載入 embedding 模型
+VECTOR_STORE_DB_PATH = "chroma_user_db"
+VECTOR_STORE_WARMUP = os.environ.get("VECTOR_STORE_WARMUP", "0") == "1"
+
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.1/howto/deployment/checklist/
 
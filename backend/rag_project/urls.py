@@ -5,6 +5,8 @@ from django.urls import include, path
 from drf_spectacular.views import (SpectacularAPIView, SpectacularRedocView,
                                    SpectacularSwaggerView)
 
+from .views import metrics_view
+
 urlpatterns = [
     # Django Admin
     path("admin/", admin.site.urls),
@@ -13,6 +15,9 @@ urlpatterns = [
     path("api/", include("enterprise_assistant.urls")),
     path("api/", include("general_assistant.urls")),
 
+    # Prometheus metrics
+    path("metrics", metrics_view, name="metrics"),
+
     # API Schema & Docs (OpenAPI)
     path("api/schema/", SpectacularAPIView.as_view(), name="schema"),
     path("api/schema/swagger-ui/", SpectacularSwaggerView.as_view(url_name="schema"), name="swagger-ui"),
@@ -0,0 +1,12 @@
+from common.modules.monitoring.metrics import render_metrics
+from django.http import HttpResponse
+from django.views.decorators.http import require_GET
+
+
+@require_GET
+def metrics_view(request):
+    """
+    Prometheus 抓取端點：查詢各階段耗時的直方圖與最近 p50 / p95 / p99
+    計數存在各 worker 行程的記憶體中，多 worker 部署時每個 worker 需分別抓取
+    """
+    return HttpResponse(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
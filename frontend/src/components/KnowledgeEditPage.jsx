@@ -11,14 +11,25 @@ const KnowledgeEditPage = () => {
     const [searchText, setSearchText] = useState("");
 
     useEffect(() => {
-        fetch(`${API_BASE_URL}/api/knowledge/${id}/chunks/`)
-            .then(res => res.json())
-            .then(data => {
+        // chunks 採 cursor 分頁：先顯示第一頁，再依 next 逐頁載入
+        let cancelled = false;
+        const loadChunks = async () => {
+            let url = `${API_BASE_URL}/api/knowledge/${id}/chunks/?size=100`;
+            let allChunks = [];
+            while (url && !cancelled) {
+                const res = await fetch(url);
+                const data = await res.json();
+                if (cancelled) return;
                 setTitle((data.title || "").replace(/\.pdf$/i, "")); // 保留文件名
-                const grouped = groupChunksByPage(data.chunks || []);
-                setChunkGroups(grouped);
-            })
-            .catch(err => console.error("❌ 載入 chunks 失敗", err));
+                allChunks = allChunks.concat(data.chunks || []);
+                setChunkGroups(groupChunksByPage(allChunks));
+                url = data.next;
+            }
+        };
+        loadChunks().catch(err => console.error("❌ 載入 chunks 失敗", err));
+        return () => {
+            cancelled = true;
+        };
     }, [id]);
 
     const groupChunksByPage = (chunks) => {
@@ -146,8 +157,10 @@ const KnowledgeEditPage = () => {
 
     const handleSaveAll = async () => {
         try {
+            // 只送出有修改的 chunk，後端會保留 chunk id 原地更新
             for (const group of chunkGroups) {
                 for (const chunk of group.chunks) {
+                    if (!modifiedChunks.has(chunk.id)) continue;
                     await fetch(`${API_BASE_URL}/api/knowledge/chunk/${chunk.id}/`, {
                         method: "PUT",
                         headers: {